@@ -1,6 +1,77 @@
+import io
+
 import streamlit as st
-import gtts 
-from exercisegen import ExerciseGen
+import tts_cache
+from exercisegen import ExerciseGen, records_to_frame
+
+
+def show_task(i, task, count_tasks, audio_slots):
+    """Вывод упражнения на экран и запись ответа в task['task_result']. Возвращает номер следующего задания.
+    Аудиозапись создается в фоне, место для плеера и задача синтеза добавляются в audio_slots"""
+
+    # Вывод номера задания для всех предложений, для которых удалось создать упражнение
+    if task['task_type'] != 'sent_with_no_exercises':
+        st.write('**Задание #'+ str(count_tasks) + ':** ' +str(task['task_description']))
+        count_tasks += 1
+
+    # Вывод предложений, для которых не удалось создать упражнение
+    if task['task_type'] == 'sent_with_no_exercises':
+        st.write(str(task['task_text']))
+
+    # Вывод предложений с выбором правильного варианта предложения. Окно selectbox с выбором варианта будет только одно
+    elif task['task_type'] in ['select_sent_word', 'select_sent_adj', 'select_sent_verb']:
+        task['task_result'][0] = st.selectbox('nolabel', 
+                                              ['–––'] + list(task['task_options']), 
+                                              label_visibility="hidden",
+                                              key = str(i))
+
+    # Вывод предложений с вводом пропущеного текста. Текстовых полей будет выводится столько, сколько пропущено полей
+    elif task['task_type'] in ['fill_words_in_the_gaps', 'listening_fill_chunks']:
+        col1, col2 = st.columns(2)
+        with col1:
+            if task['task_type'] == 'listening_fill_chunks':
+                audio_slots.append((st.empty(), tts_cache.cache.submit(task['raw'])))
+            st.write(str(task['task_text']))
+        with col2:
+            for j in range(len(task['task_answer'])):
+                task['task_result'][j] = st.text_input('nolabel',
+                                                       value='–––', 
+                                                       label_visibility="hidden",
+                                                       key = str(i) + '_' + str(j))
+
+    # Вывод предложений с расстановкой слов в правильном порядке
+    elif task['task_type'] == 'set_word_order':
+        task['task_result'][0] = st.multiselect('nolabel',
+                                                options=task['task_text'],
+                                                label_visibility="hidden",
+                                                placeholder='Выберите слово из выпадающего списка',
+                                                key = str(i))
+
+    # Вывод предложений с выбором правильного слова
+    else:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write(str(task['task_text']))
+        with col2:
+            for j in range(len(task['task_options'])):
+                option = task['task_options'][j]
+                task['task_result'][j] = st.selectbox('nolabel', 
+                                                      ['–––'] + list(option), 
+                                                      label_visibility="hidden",
+                                                      key = str(i) + '_' + str(j))
+    st.write('---')
+    return count_tasks
+
+
+def show_audio(audio_slots):
+    """Вывод аудиозаписей, когда они будут готовы"""
+
+    for slot, future in audio_slots:
+        try:
+            slot.audio(future.result())
+        except Exception:
+            slot.write('Не удалось создать аудиозапись')
+
 
 st.header('Генератор упражнений по английскому языку')
 
@@ -87,6 +158,17 @@ with st.expander('Настройка упражнений для урока'):
     for i in range(len(exercise_types)-1):
         st.session_state['q_task_exercises'][i] = st.slider(label=exercise_types[i], min_value = 1, max_value = 10, value = 1, step = 1)
 
+    # Режим генерации: сначала выбирается тип упражнения для каждого предложения, потом создается только это упражнение
+    st.write('**Режим генерации**')
+    if 'planned_lesson' not in st.session_state:
+        st.session_state['planned_lesson'] = True
+    st.session_state['planned_lesson'] = st.checkbox(label='Быстрая генерация (создаются только те упражнения, которые будут показаны)', 
+                                                     value=True)
+    # Замеры времени этапов генерации для отладки
+    if 'show_metrics' not in st.session_state:
+        st.session_state['show_metrics'] = False
+    st.session_state['show_metrics'] = st.checkbox(label='Показать замеры времени генерации', value=False)
+
         
 ################################################################     
 # Кнопка генерации упражнений. Проверяем, что именно было загружено, загружаем и обрабатываем данные
@@ -98,6 +180,12 @@ st.button('Загрузить текст упражнений', on_click=generat
 
 # Загружаем файл после нажатия кнопки
 if st.session_state.generation_clicked:
+    # Замеры включаются и выключаются флажком на каждом запуске. Перед созданием нового урока старые замеры удаляются,
+    # поэтому на панели показаны замеры только текущего урока
+    if 'ex_gen' in st.session_state:
+        st.session_state['ex_gen'].metrics.enabled = st.session_state['show_metrics']
+        if 'default_lesson' not in st.session_state:
+            st.session_state['ex_gen'].metrics.reset()
     if 'dataset' not in st.session_state:
         st.session_state['dataset'] = None
     if st.session_state['lesson_file'] is not None and st.session_state['lesson_text'] != '':
@@ -105,21 +193,21 @@ if st.session_state.generation_clicked:
     elif st.session_state['lesson_file'] is not None:
         if 'ex_gen' not in st.session_state:
             with st.spinner('Обработка файла...'):
-                st.session_state['ex_gen'] = ExerciseGen()
-                st.session_state['dataset'] = st.session_state['ex_gen'].open_file(st.session_state['lesson_file'])
-                st.session_state['dataset'] = st.session_state['ex_gen'].beautify_text(st.session_state['dataset'])
+                st.session_state['ex_gen'] = ExerciseGen(metrics=st.session_state['show_metrics'])
+                # Разобранный текст сохраняется на диск, повторно тот же текст открывается без обработки моделью spacy
+                st.session_state['dataset'] = st.session_state['ex_gen'].load_file(st.session_state['lesson_file'])
     elif st.session_state['lesson_text'] != '':
         if 'ex_gen' not in st.session_state:
             with st.spinner('Обработка загруженного текста...'):
-                st.session_state['ex_gen'] = ExerciseGen()
-                st.session_state['dataset'] = st.session_state['ex_gen'].open_text(st.session_state['lesson_text'])
-                st.session_state['dataset'] = st.session_state['ex_gen'].beautify_text(st.session_state['dataset'])
+                st.session_state['ex_gen'] = ExerciseGen(metrics=st.session_state['show_metrics'])
+                # Разобранный текст сохраняется на диск, повторно тот же текст открывается без обработки моделью spacy
+                st.session_state['dataset'] = st.session_state['ex_gen'].load_text(st.session_state['lesson_text'])
     elif st.session_state['lesson_file'] is None and st.session_state['lesson_text'] == '':
         if 'ex_gen' not in st.session_state:
             with st.spinner('Обработка стандартного текста...'):
-                st.session_state['ex_gen'] = ExerciseGen()
-                st.session_state['dataset'] = st.session_state['ex_gen'].open_text(st.session_state['lesson_default_text'])
-                st.session_state['dataset'] = st.session_state['ex_gen'].beautify_text(st.session_state['dataset'])
+                st.session_state['ex_gen'] = ExerciseGen(metrics=st.session_state['show_metrics'])
+                # Разобранный текст сохраняется на диск, повторно тот же текст открывается без обработки моделью spacy
+                st.session_state['dataset'] = st.session_state['ex_gen'].load_text(st.session_state['lesson_default_text'])
     else:
         pass
     
@@ -129,78 +217,46 @@ if st.session_state.generation_clicked:
     if st.session_state['dataset'] is not None:
         with st.spinner('Генерация упражнений...'):
             
-            # Создаем упражнения
-            if 'lesson_dataset' not in st.session_state:
-                st.session_state['lesson_dataset'] = st.session_state['ex_gen'].create_lesson(st.session_state['dataset'], 
-                    start_row=st.session_state['start_row'], 
-                    q_task=st.session_state['q_task'],
-                    list_of_exercises=st.session_state['list_of_exercises'],
-                    q_words=st.session_state['q_task_exercises'])
-            if 'default_lesson' not in st.session_state:
-                st.session_state['default_lesson'] = st.session_state['ex_gen'].create_default_lesson(st.session_state['lesson_dataset'])
-                
             # Выводим упражнения на экран и записываем ответы
             st.subheader('Упражнения по английскому')
             count_tasks = 1
-            for i in range(len(st.session_state['default_lesson'])):
-
-                task = st.session_state['default_lesson'].loc[i]    
-
-                # Вывод номера задания для всех предложений, для которых удалось создать упражнение
-                if task['task_type'] != 'sent_with_no_exercises':
-                    st.write('**Задание #'+ str(count_tasks) + ':** ' +str(task['task_description']))
-                    count_tasks += 1
-
-                # Вывод предложений, для которых не удалось создать упражнение
-                if task['task_type'] == 'sent_with_no_exercises':
-                    st.write(str(task['task_text']))
-
-                # Вывод предложений с выбором правильного варианта предложения. Окно selectbox с выбором варианта будет только одно
-                elif task['task_type'] in ['select_sent_word', 'select_sent_adj', 'select_sent_verb']:
-                    task['task_result'][0] = st.selectbox('nolabel', 
-                                                          ['–––'] + task['task_options'], 
-                                                          label_visibility="hidden",
-                                                          key = str(i))
-
-                # Вывод предложений с вводом пропущеного текста. Текстовых полей будет выводится столько, сколько пропущено полей
-                elif task['task_type'] in ['fill_words_in_the_gaps', 'listening_fill_chunks']:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if task['task_type'] == 'listening_fill_chunks':
-                            audiofile_name = 'audiofile_'+str(i)+'.mp3'
-                            if audiofile_name not in st.session_state:
-                                audiofile = gtts.gTTS(task['raw'])
-                                st.session_state[audiofile_name] = audiofile.save(audiofile_name)
-                            st.audio(audiofile_name)
-                        st.write(str(task['task_text']))
-                    with col2:
-                        for j in range(len(task['task_answer'])):
-                            task['task_result'][j] = st.text_input('nolabel',
-                                                                   value='–––', 
-                                                                   label_visibility="hidden",
-                                                                   key = str(i) + '_' + str(j))
+            audio_slots = []
+            
+            # Быстрая генерация: упражнения выводятся на экран сразу после создания, не дожидаясь всего урока
+            if 'default_lesson' not in st.session_state and st.session_state['planned_lesson']:
+                lesson_tasks = []
+                for task in st.session_state['ex_gen'].iter_lesson(st.session_state['dataset'], 
+                    start_row=st.session_state['start_row'], 
+                    q_task=st.session_state['q_task'],
+                    list_of_exercises=st.session_state['list_of_exercises'],
+                    q_words=st.session_state['q_task_exercises']):
+                    count_tasks = show_task(len(lesson_tasks), task, count_tasks, audio_slots)
+                    lesson_tasks.append(task)
+                st.session_state['default_lesson'] = records_to_frame(lesson_tasks)
+            else:
+                # Создаем упражнения
+                if 'lesson_dataset' not in st.session_state and 'default_lesson' not in st.session_state:
+                    st.session_state['lesson_dataset'] = st.session_state['ex_gen'].create_lesson(st.session_state['dataset'], 
+                        start_row=st.session_state['start_row'], 
+                        q_task=st.session_state['q_task'],
+                        list_of_exercises=st.session_state['list_of_exercises'],
+                        q_words=st.session_state['q_task_exercises'])
+                if 'default_lesson' not in st.session_state:
+                    st.session_state['default_lesson'] = st.session_state['ex_gen'].create_default_lesson(st.session_state['lesson_dataset'])
                 
-                # Вывод предложений с расстановкой слов в правильном порядке
-                elif task['task_type'] == 'set_word_order':
-                    task['task_result'][0] = st.multiselect('nolabel',
-                                                            options=task['task_text'],
-                                                            label_visibility="hidden",
-                                                            placeholder='Выберите слово из выпадающего списка',
-                                                            key = str(i))
-                    
-                # Вывод предложений с выбором правильного слова
-                else:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(str(task['task_text']))
-                    with col2:
-                        for j in range(len(task['task_options'])):
-                            option = task['task_options'][j]
-                            task['task_result'][j] = st.selectbox('nolabel', 
-                                                                  ['–––'] + option, 
-                                                                  label_visibility="hidden",
-                                                                  key = str(i) + '_' + str(j))
-                '---'          
+                for i in range(len(st.session_state['default_lesson'])):
+                    count_tasks = show_task(i, st.session_state['default_lesson'].loc[i], count_tasks, audio_slots)
+            
+            # Аудиозаписи создаются в фоне, пока выводятся упражнения
+            show_audio(audio_slots)
+
+            # Замеры времени этапов генерации текущего урока
+            if st.session_state['show_metrics']:
+                with st.expander('Замеры времени генерации'):
+                    st.write('Этапы могут быть вложены друг в друга: например, поиск синонимов - часть упражнения')
+                    st.dataframe(st.session_state['ex_gen'].metrics.to_frame())
+                    st.write(st.session_state['ex_gen'].get_metrics()['counters'])
+                    st.code(st.session_state['ex_gen'].metrics.to_prometheus())
 
                 
             #######################################################################################################
@@ -214,17 +270,18 @@ if st.session_state.generation_clicked:
             # Результат прохождения теста
             if st.session_state.result_clicked:
                 
-                st.session_state['default_lesson']['task_total'] = (st.session_state['default_lesson']['task_answer'] ==
-                                                                    st.session_state['default_lesson']['task_result'])
+                # Каждый пропуск проверяется отдельно: за частично верный ответ засчитывается доля верных пропусков
+                report = st.session_state['ex_gen'].grade_lesson(st.session_state['default_lesson'])
+                st.session_state['default_lesson']['task_total'] = report.task_total()
 
                 st.balloons()
                 
-                result_info, result_comment, result_mistakes = st.session_state['ex_gen'].result_interpretation(st.session_state['default_lesson'])
+                result_info, result_comment, result_mistakes = st.session_state['ex_gen'].result_interpretation(st.session_state['default_lesson'], report)
                 st.write(result_info)
                 st.write(result_comment)
                 st.write(result_mistakes)
                 st.write('Расшифровка результатов в разрезе типов упражнений:')
-                st.dataframe(st.session_state['ex_gen'].show_result_by_task_type(st.session_state['default_lesson']))
+                st.dataframe(st.session_state['ex_gen'].show_result_by_task_type(st.session_state['default_lesson'], report))
                 st.write('Полная расшифровка результатов прохождения теста:')
                 st.dataframe(st.session_state['ex_gen'].show_result_table(st.session_state['default_lesson']))
                 st.write('Скачайте файл с расшифровкой, чтобы поделиться результатом:')
@@ -240,4 +297,15 @@ if st.session_state.generation_clicked:
                     data=csv,
                     file_name='english_lesson_result.csv',
                     mime='text/csv',
+                )
+
+                # В JSONL варианты ответов и ответы сохраняются списками, урок можно загрузить обратно без моделей
+                jsonl = io.BytesIO()
+                st.session_state['ex_gen'].export_lesson(st.session_state['default_lesson'], jsonl, format='jsonl')
+
+                st.download_button(
+                    label="Скачать результат теста в JSONL",
+                    data=jsonl.getvalue(),
+                    file_name='english_lesson_result.jsonl',
+                    mime='application/jsonl',
                 )
\ No newline at end of file
@@ -0,0 +1,365 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+import pandas as pd
+import numpy as np
+import spacy
+import gensim
+from gensim.models import KeyedVectors
+
+import distractors
+from model_registry import ModelRegistry
+from text_store import TextStore
+from exercisegen import ExerciseGen, LESSON_COLUMNS, EXERCISE_TYPES, records_to_frame
+
+
+# Bundled texts, which are used in benchmark suite
+TEXTS = ['Little_Red_Cap_Jacob_and_Wilhelm_Grimm.txt', 'Little_Red_Riding_Hood_Charles_Perrault.txt']
+
+# Words at the start of sentences in copies of texts
+OPENERS = ['Then', 'Later', 'Meanwhile', 'Soon', 'Afterwards', 'Suddenly', 'Still', 'Again', 'Next', 'Finally', 
+           'Now', 'Once more', 'At last', 'That day', 'Indeed']
+
+
+def synthetic_rows(n_rows, tasks_per_row=3, seed=123):
+    """Generate exercise dictionaries similar to the ones returned by ExerciseGen() generators.
+
+    Parameters
+    ----------
+    - n_rows: number of sentences
+    - tasks_per_row: number of exercises for every sentence (the last one is 'sent_with_no_exercises')
+    - seed: random seed
+
+    Returns
+    -------
+    list with lists of exercise dictionaries for every sentence
+    """
+
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n_rows):
+        raw = ' '.join(rnd.choice(['the', 'wolf', 'came', 'to', 'grandmother', 'house', 'and', 'knocked'])
+                       for _ in range(12))
+        row = []
+        for j in range(tasks_per_row - 1):
+            row.append({'raw': raw, 'task_type': 'select_word_adj', 'task_text': raw, 'task_object': ['wolf'],
+                        'task_options': [['wolf', 'house', 'grandmother']], 'task_answer': ['wolf'],
+                        'task_result': [''] * 1, 'task_description': 'Выберите слово', 'task_total': 0})
+        row.append({'raw': raw, 'task_type': 'sent_with_no_exercises', 'task_text': raw, 'task_object': np.nan,
+                    'task_options': np.nan, 'task_answer': np.nan, 'task_result': np.nan,
+                    'task_description': '', 'task_total': np.nan})
+        rows.append((i + 1, row))
+    return rows
+
+
+def legacy_assembly(rows):
+    """Assemble lesson like create_lesson() did before: dataframe for every sentence, enlarged row by row,
+    and pd.concat() with all previous sentences"""
+
+    lesson_tasks = pd.DataFrame(columns=LESSON_COLUMNS)
+    for row_num, row in rows:
+        row_tasks = pd.DataFrame(columns=LESSON_COLUMNS[1:])
+        for mark, task in enumerate(row):
+            row_tasks.loc[mark] = task
+        row_tasks['row_num'] = row_num
+        row_tasks = row_tasks[row_tasks['task_description'].isna() == False]
+        lesson_tasks = pd.concat([lesson_tasks, row_tasks], ignore_index=True)
+    return lesson_tasks
+
+
+def columnar_assembly(rows):
+    """Assemble lesson like create_lesson() does now: list of dictionaries and one dataframe at the end"""
+
+    records = []
+    for row_num, row in rows:
+        for task in row:
+            if not pd.isna(task['task_description']):
+                records.append(dict(task, row_num=row_num))
+    return records_to_frame(records)
+
+
+def benchmark_assembly(sizes=(500, 1000, 2000, 4000)):
+    """Compare time of legacy and columnar lesson assembly
+
+    Parameters
+    ----------
+    - sizes: numbers of sentences
+
+    Returns
+    -------
+    pd.DataFrame with columns 'sentences', 'legacy_seconds', 'columnar_seconds', 'speedup'
+    """
+
+    results = []
+    for n_rows in sizes:
+        rows = synthetic_rows(n_rows)
+
+        start_time = time.perf_counter()
+        legacy = legacy_assembly(rows)
+        legacy_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        columnar = columnar_assembly(rows)
+        columnar_seconds = time.perf_counter() - start_time
+
+        # Legacy assembly keeps 'task_total' as object or float64 depending on pandas version, 
+        # columnar assembly always returns float64, so only values are compared
+        pd.testing.assert_frame_equal(legacy[LESSON_COLUMNS].reset_index(drop=True), columnar, check_dtype=False,
+                                      obj='Assembly results')
+        results.append({'sentences': n_rows, 'legacy_seconds': legacy_seconds, 'columnar_seconds': columnar_seconds,
+                        'speedup': legacy_seconds / columnar_seconds})
+    return pd.DataFrame(results, columns=['sentences', 'legacy_seconds', 'columnar_seconds', 'speedup'])
+
+
+def read_texts():
+    """Return bundled texts joined into one text"""
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    texts = []
+    for name in TEXTS:
+        with open(os.path.join(folder, name), encoding='utf-8') as f:
+            texts.append(f.read())
+    return '\n'.join(texts)
+
+
+def scaled_text(text, scale):
+    """Return synthetic text, which is the original text repeated 'scale' times. Every copy except the first one
+    has its own word at the start of sentences, so sentences are not repeated and are not taken from caches"""
+
+    copies = [text]
+    for k in range(1, scale):
+        opener = OPENERS[(k-1) % len(OPENERS)]
+        if k > len(OPENERS):
+            opener += ' ' + str((k-1) // len(OPENERS))
+        copies.append(re.sub(r'(^|[.!?]"? +)("?)(?=[A-Z])', lambda m: m.group(1) + m.group(2) + opener + ' ', 
+                             text, flags=re.M))
+    return '\n'.join(copies)
+
+
+def stub_vectors(text, nlp, vector_size=50, extra_words=5000, seed=0):
+    """Create small gensim model with random vectors for benchmarks without internet connection.
+    Vocabulary contains all tokens of the text, 'good' and 'bad' (they are used to find antonyms)
+    and extra random words, so the search goes through a vocabulary of realistic shape
+
+    Parameters
+    ----------
+    - text: text, which words must be in vocabulary
+    - nlp: spacy model to split text into tokens
+    - vector_size: size of vectors
+    - extra_words: number of extra words
+    - seed: random seed
+
+    Returns
+    -------
+    gensim KeyedVectors
+    """
+
+    words = {token.text.lower() for token in nlp.make_doc(text)} | {'good', 'bad'}
+    words = sorted(words) + ['word' + str(i) for i in range(extra_words)]
+    vectors = np.random.default_rng(seed).standard_normal((len(words), vector_size)).astype('float32')
+
+    model = KeyedVectors(vector_size=vector_size)
+    model.add_vectors(words, vectors)
+    model.fill_norms()
+    return model
+
+
+def stub_registry(text, name='glove-wiki-gigaword-100'):
+    """Create registry with spacy model and stub gensim model. Neighbour table and ANN index are not used"""
+
+    registry = ModelRegistry()
+    nlp = registry.nlp()
+    registry.put('gensim/' + name, stub_vectors(text, nlp))
+    registry.put('neighbours/' + name, None)
+    registry.put('ann/' + name, None)
+    return registry
+
+
+def measure(func, repeat=3, memory=True):
+    """Measure time and peak memory of function. Random seeds are fixed before every call,
+    caches of distractors are cleared, so every call does the same work
+
+    Parameters
+    ----------
+    - func: function without arguments
+    - repeat: number of calls to measure time. The best and the median time are returned
+    - memory: if True, one more call is done with tracemalloc to measure peak memory
+
+    Returns
+    -------
+    dictionary with keys 'seconds', 'median_seconds', 'peak_mb' (None if memory=False) and result of the last call under key 'result'
+    """
+
+    times = []
+    for _ in range(repeat):
+        random.seed(123)
+        np.random.seed(123)
+        for cache in distractors.caches.values():
+            cache.clear()
+        start_time = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start_time)
+
+    peak_mb = None
+    if memory:
+        random.seed(123)
+        np.random.seed(123)
+        for cache in distractors.caches.values():
+            cache.clear()
+        tracemalloc.start()
+        func()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    return {'seconds': min(times), 'median_seconds': float(np.median(times)), 'peak_mb': peak_mb, 'result': result}
+
+
+def run_suite(scales=(1, 4, 16), repeat=3, memory=True, q_task=None):
+    """Benchmark ExerciseGen() on bundled texts and their scaled-up versions
+
+    Parameters
+    ----------
+    - scales: how many times bundled texts are repeated
+    - repeat: number of calls to measure time
+    - memory: if True, peak memory is measured with tracemalloc
+    - q_task: number of exercises in lessons. Default - all sentences of the text
+
+    Returns
+    -------
+    list with dictionaries {'name', 'scale', 'sentences', 'seconds', 'median_seconds', 'peak_mb'}
+    """
+
+    text = read_texts()
+    results = []
+
+    def add(name, scale, sentences, stat):
+        results.append({'name': name, 'scale': scale, 'sentences': sentences, 'seconds': stat['seconds'],
+                        'median_seconds': stat['median_seconds'], 'peak_mb': stat['peak_mb']})
+        return stat['result']
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        # Model load: spacy model, stub gensim model and distractor engine
+        def load_models():
+            registry = stub_registry(scaled_text(text, max(scales)))
+            return registry, ExerciseGen(registry=registry, store=TextStore(os.path.join(store_dir, 'hit')))
+        registry, gen = add('model_load', 1, None, measure(load_models, repeat=1, memory=memory))
+        # Texts are opened with load_text() by separate object, so 'gen' always parses sentences itself
+        gen_store = ExerciseGen(registry=registry, store=TextStore(os.path.join(store_dir, 'hit')))
+
+        for scale in scales:
+            big_text = scaled_text(text, scale)
+
+            df = add('open_text', scale, None, measure(lambda: gen.open_text(big_text), repeat, memory))
+            df = add('beautify_text', scale, len(df), measure(lambda: gen.beautify_text(df.copy()), repeat, memory))
+            sentences = len(df)
+            q = sentences if q_task is None else q_task
+
+            # Text store: every miss uses a new empty store, hits restore the text saved by the first call
+            misses = []
+            def load_text_miss():
+                misses.append(scale)
+                store = TextStore(os.path.join(store_dir, 'miss', str(scale), str(len(misses))))
+                return ExerciseGen(registry=registry, store=store).load_text(big_text)
+            add('load_text_miss', scale, sentences, measure(load_text_miss, repeat, memory))
+            gen_store.load_text(big_text)
+            add('load_text_hit', scale, sentences, measure(lambda: gen_store.load_text(big_text), repeat, memory))
+
+            # Every generator on all parsed sentences
+            docs = list(gen.parse_sentences(list(df['raw'])).values())
+            for ex_type in EXERCISE_TYPES:
+                generator = getattr(gen, ex_type)
+                add(ex_type, scale, sentences, measure(lambda: [generator(doc) for doc in docs], repeat, memory))
+
+            lesson = add('create_lesson', scale, sentences, 
+                         measure(lambda: gen.create_lesson(df, q_task=q), repeat, memory))
+            add('create_default_lesson', scale, sentences, 
+                measure(lambda: gen.create_default_lesson(lesson), repeat, memory))
+            add('create_planned_lesson', scale, sentences, 
+                measure(lambda: gen.create_planned_lesson(df, q_task=q), repeat, memory))
+            # Lesson with cheap exercise types only: tagger is run, parser and lemmatizer are not
+            cheap = [ex_type in ['fill_words_in_the_gaps', 'set_word_order'] for ex_type in EXERCISE_TYPES]
+            add('create_planned_lesson_cheap', scale, sentences, 
+                measure(lambda: gen.create_planned_lesson(df, q_task=q, list_of_exercises=cheap), repeat, memory))
+
+    return results
+
+
+def environment():
+    """Return versions of python and libraries"""
+
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'spacy': spacy.__version__, 'gensim': gensim.__version__}
+
+
+def compare(results, baseline, tolerance=0.25, min_delta=0.005):
+    """Compare benchmark results with baseline
+
+    Parameters
+    ----------
+    - results: list with results of run_suite()
+    - baseline: list with results of run_suite() saved before
+    - tolerance: allowed relative slowdown. If time is bigger than baseline time * (1 + tolerance), it is a regression
+    - min_delta: allowed slowdown in seconds. Very fast benchmarks are noisy, so smaller slowdown is not a regression
+
+    Returns
+    -------
+    pd.DataFrame with columns 'name', 'scale', 'baseline_seconds', 'seconds', 'ratio', 'baseline_peak_mb', 'peak_mb', 
+    'regression'
+    """
+
+    current = pd.DataFrame(results, columns=['name', 'scale', 'seconds', 'peak_mb'])
+    before = pd.DataFrame(baseline, columns=['name', 'scale', 'seconds', 'peak_mb'])
+    before = before.rename(columns={'seconds': 'baseline_seconds', 'peak_mb': 'baseline_peak_mb'})
+
+    df = before.merge(current, on=['name', 'scale'], how='inner')
+    df['ratio'] = df['seconds'] / df['baseline_seconds']
+    df['regression'] = (df['ratio'] > 1 + tolerance) & (df['seconds'] - df['baseline_seconds'] > min_delta)
+    return df[['name', 'scale', 'baseline_seconds', 'seconds', 'ratio', 'baseline_peak_mb', 'peak_mb', 'regression']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of ExerciseGen')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    suite_parser = subparsers.add_parser('suite', help='time and memory of ExerciseGen methods on bundled texts')
+    suite_parser.add_argument('--scales', type=int, nargs='+', default=[1, 4, 16], 
+                              help='how many times bundled texts are repeated')
+    suite_parser.add_argument('--repeat', type=int, default=3, help='number of calls to measure time')
+    suite_parser.add_argument('--q-task', type=int, help='number of exercises in lessons. Default - all sentences')
+    suite_parser.add_argument('--no-memory', action='store_true', help='do not measure peak memory')
+    suite_parser.add_argument('--output', help='JSON file for results')
+    suite_parser.add_argument('--baseline', help='JSON file with saved results to compare with')
+    suite_parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative slowdown')
+
+    assembly_parser = subparsers.add_parser('assembly', help='legacy and columnar lesson assembly')
+    assembly_parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 4000],
+                                 help='numbers of sentences for lesson assembly benchmark')
+    args = parser.parse_args()
+
+    if args.command == 'assembly':
+        print(benchmark_assembly(args.sizes).to_string(index=False))
+        sys.exit(0)
+
+    results = run_suite(args.scales, repeat=args.repeat, memory=not args.no_memory, q_task=args.q_task)
+    print(pd.DataFrame(results).to_string(index=False))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        comparison = compare(results, baseline, tolerance=args.tolerance)
+        print(comparison.to_string(index=False))
+        if comparison['regression'].any():
+            print('Regression: some benchmarks are slower than baseline by more than', args.tolerance * 100, '%')
+            sys.exit(1)
@@ -0,0 +1,35 @@
+import pytest
+
+from benchmark import stub_registry
+from text_store import TextStore
+from exercisegen import ExerciseGen
+
+
+# Fixed paragraph for tests. The second sentence is repeated. Words of every sentence are not parts 
+# of the words before them, so the old search of words by text finds them in the right place
+PARAGRAPH = ('Once upon a time a dear little girl lived in a village near the forest. '
+             'The wolf thought to himself, what a tender young creature. '
+             'Little Red Cap, however, had been running about picking flowers. '
+             'The wolf thought to himself, what a tender young creature. '
+             'Then she remembered her grandmother, and set out on the way to her.')
+
+
+@pytest.fixture(scope='session')
+def registry():
+    """Registry with spacy model and stub gensim model, which knows words of the paragraph"""
+
+    return stub_registry(PARAGRAPH)
+
+
+@pytest.fixture
+def ex_gen(registry, tmp_path):
+    """ExerciseGen() object with empty text store"""
+
+    return ExerciseGen(registry=registry, store=TextStore(str(tmp_path / 'store')))
+
+
+@pytest.fixture
+def sentences(ex_gen):
+    """Sentences of the paragraph with repeated ones"""
+
+    return ex_gen.split_sentences([PARAGRAPH])
@@ -0,0 +1,648 @@
+import os
+import time
+import hashlib
+import argparse
+import weakref
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def vocab_fingerprint(model):
+    """Return hash of gensim model vocabulary. It is used to check that saved data belongs to the same model"""
+
+    return hashlib.md5('\n'.join(model.index_to_key).encode('utf-8')).hexdigest()
+
+
+def normed_vectors(model, rows=slice(None)):
+    """Return unit vectors of gensim model for rows in 'rows'"""
+
+    model.fill_norms()
+    return model.vectors[rows] / model.norms[rows, np.newaxis]
+
+
+def similarity_scores(model, queries):
+    """Return cosine similarity between unit query vectors and all words of gensim model.
+    Vectors of the model are not normalized in memory, scores are divided by norms instead (as gensim does)
+
+    Parameters
+    ----------
+    - model: gensim KeyedVectors
+    - queries: np.array with unit query vectors, shape (number of queries, vector size)
+
+    Returns
+    -------
+    np.array with scores, shape (number of queries, vocabulary size)
+    """
+
+    model.fill_norms()
+    # Division is in place, so there is only one array of vocabulary size for every query
+    scores = queries @ model.vectors.T
+    scores /= model.norms
+    return scores
+
+
+def antonym_query(model, vectors):
+    """Return query vectors for antonyms: unit vector of (word + 'bad' - 'good'),
+    the same as gensim most_similar(positive=[word, 'bad'], negative=['good']) uses
+
+    Parameters
+    ----------
+    - model: gensim KeyedVectors
+    - vectors: np.array with unit vectors of words, shape (number of words, vector size)
+
+    Returns
+    -------
+    np.array with unit query vectors
+    """
+
+    shift = model.get_vector('bad', norm=True) - model.get_vector('good', norm=True)
+    query = vectors + shift
+    return query / np.linalg.norm(query, axis=1, keepdims=True)
+
+
+def top_k(scores, k, exclude):
+    """Return indexes and scores of k best columns in every row of 'scores'.
+
+    Parameters
+    ----------
+    - scores: np.array with similarity scores, shape (number of queries, vocabulary size)
+    - k: number of neighbours
+    - exclude: list with arrays of column indexes, which must not be returned for each query (query words themselves)
+
+    Returns
+    -------
+    tuple (np.array int32 with indexes, np.array float32 with scores), both with shape (number of queries, k)
+    """
+
+    for row, columns in enumerate(exclude):
+        scores[row, columns] = -np.inf
+    k = min(k, scores.shape[1])
+    # Rows are selected one by one without negation of scores, 
+    # so only one index array of vocabulary size exists at the same time
+    best = np.empty((scores.shape[0], k), dtype=np.intp)
+    for row in range(scores.shape[0]):
+        best[row] = np.argpartition(scores[row], -k)[-k:]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    return best.astype(np.int32), best_scores.astype(np.float32)
+
+
+class NeighbourTable():
+
+    def __init__(self, syn_idx, syn_score, ant_idx, ant_score, fingerprint=''):
+        """Initiation of NeighbourTable() object. Table contains precomputed synonym and antonym neighbours
+        for the most frequent words of gensim model. Row number in table is the index of word in gensim model
+
+        Parameters
+        ----------
+        - syn_idx, syn_score: np.array int32 and float32 with synonym indexes and scores, shape (number of words, k)
+        - ant_idx, ant_score: np.array int32 and float32 with antonym indexes and scores, shape (number of words, k)
+        - fingerprint: hash of model vocabulary (see vocab_fingerprint())
+        """
+
+        self.syn_idx = syn_idx
+        self.syn_score = syn_score
+        self.ant_idx = ant_idx
+        self.ant_score = ant_score
+        self.fingerprint = fingerprint
+
+
+    @classmethod
+    def build(cls, model, q_words=50000, k=20, block_size=128):
+        """Compute synonym and antonym neighbours for 'q_words' most frequent words of gensim model.
+        Neighbours are computed with blocked matrix multiplies against all vectors of the model.
+
+        Parameters
+        ----------
+        - model: gensim KeyedVectors. Words in gensim models are sorted by frequency
+        - q_words: number of the most frequent words in table
+        - k: number of neighbours for each word
+        - block_size: number of words in one matrix multiply. Bigger blocks are faster but need more memory
+
+        Returns
+        -------
+        NeighbourTable()
+        """
+
+        q_words = min(q_words, len(model.index_to_key))
+        special = [model.get_index('bad'), model.get_index('good')]
+
+        syn_idx = np.zeros((q_words, k), dtype=np.int32)
+        syn_score = np.zeros((q_words, k), dtype=np.float32)
+        ant_idx = np.zeros((q_words, k), dtype=np.int32)
+        ant_score = np.zeros((q_words, k), dtype=np.float32)
+
+        for start in range(0, q_words, block_size):
+            end = min(start + block_size, q_words)
+            block = normed_vectors(model, slice(start, end))
+            rows = np.arange(start, end)
+
+            # Synonyms: the closest words, except the word itself
+            scores = similarity_scores(model, block)
+            syn_idx[start:end], syn_score[start:end] = top_k(scores, k, [[row] for row in rows])
+
+            # Antonyms: the closest words to word + 'bad' - 'good', except all query words
+            scores = similarity_scores(model, antonym_query(model, block))
+            ant_idx[start:end], ant_score[start:end] = top_k(scores, k, [[row] + special for row in rows])
+
+        return cls(syn_idx, syn_score, ant_idx, ant_score, vocab_fingerprint(model))
+
+
+    @property
+    def nbytes(self):
+        """Size of table arrays in bytes"""
+
+        return self.syn_idx.nbytes + self.syn_score.nbytes + self.ant_idx.nbytes + self.ant_score.nbytes
+
+
+    def save(self, path):
+        """Save table into .npz file"""
+
+        np.savez(path,
+                 syn_idx=self.syn_idx, syn_score=self.syn_score,
+                 ant_idx=self.ant_idx, ant_score=self.ant_score,
+                 fingerprint=np.array(self.fingerprint))
+
+
+    @classmethod
+    def load(cls, path, model=None):
+        """Load table from .npz file. If gensim model is given, check that table was built for the same model
+
+        Returns
+        -------
+        NeighbourTable()
+        """
+
+        with np.load(path) as data:
+            table = cls(data['syn_idx'], data['syn_score'], data['ant_idx'], data['ant_score'], str(data['fingerprint']))
+        if model is not None and table.fingerprint != vocab_fingerprint(model):
+            raise ValueError('Neighbour table ' + str(path) + ' was built for another gensim model')
+        return table
+
+
+    def __lookup(self, model, word, topn, idx, score):
+        """Return neighbours from table or None, if word is not in table"""
+
+        row = model.key_to_index.get(word)
+        if row is None or row >= len(idx) or topn > idx.shape[1]:
+            return None
+        return [(model.index_to_key[j], float(s)) for j, s in zip(idx[row, :topn], score[row, :topn])]
+
+
+    def synonyms(self, model, word, topn=10):
+        """Return list of (word, score) like gensim most_similar(word, topn=topn) or None, if word is not in table"""
+
+        return self.__lookup(model, word, topn, self.syn_idx, self.syn_score)
+
+
+    def antonyms(self, model, word, topn=10):
+        """Return list of (word, score) like gensim most_similar(positive=[word, 'bad'], negative=['good'], topn=topn)
+        or None, if word is not in table"""
+
+        return self.__lookup(model, word, topn, self.ant_idx, self.ant_score)
+
+
+class IVFIndex():
+
+    def __init__(self, centroids, order, offsets, n_probe=16, fingerprint=''):
+        """Initiation of IVFIndex() object. Approximate nearest neighbour index for big gensim models:
+        words are split into clusters by k-means (coarse quantizer), the search scans only 'n_probe' clusters,
+        which are the closest to query. More clusters in search give better recall but slower search
+
+        Parameters
+        ----------
+        - centroids: np.array float32 with unit cluster centres, shape (number of clusters, vector size)
+        - order: np.array int32 with word indexes sorted by cluster
+        - offsets: np.array int64, words of cluster i are order[offsets[i]:offsets[i+1]]
+        - n_probe: number of clusters scanned by search
+        - fingerprint: hash of model vocabulary (see vocab_fingerprint())
+        """
+
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.n_probe = n_probe
+        self.fingerprint = fingerprint
+
+
+    @classmethod
+    def build(cls, model, n_lists=None, n_iter=10, sample_size=100000, n_probe=16, block_size=4096, seed=123):
+        """Build index with spherical k-means on a sample of word vectors.
+
+        Parameters
+        ----------
+        - model: gensim KeyedVectors
+        - n_lists: number of clusters. Default is 4 * sqrt(vocabulary size)
+        - n_iter: number of k-means iterations
+        - sample_size: number of words for k-means training
+        - n_probe: default number of clusters scanned by search
+        - block_size: number of words in one matrix multiply
+        - seed: random seed
+
+        Returns
+        -------
+        IVFIndex()
+        """
+
+        rng = np.random.default_rng(seed)
+        q_words = len(model.index_to_key)
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(q_words))
+        n_lists = max(1, min(n_lists, q_words))
+
+        sample = np.sort(rng.choice(q_words, size=min(sample_size, q_words), replace=False))
+        sample_vectors = normed_vectors(model, sample)
+        centroids = sample_vectors[rng.choice(len(sample), size=n_lists, replace=False)]
+
+        for _ in range(n_iter):
+            labels = np.argmax(sample_vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample_vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their old centres
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        labels = np.zeros(q_words, dtype=np.int32)
+        for start in range(0, q_words, block_size):
+            block = normed_vectors(model, slice(start, start+block_size))
+            labels[start:start+len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(labels, kind='stable').astype(np.int32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+
+        return cls(centroids.astype(np.float32), order, offsets, n_probe, vocab_fingerprint(model))
+
+
+    @property
+    def nbytes(self):
+        """Size of index arrays in bytes"""
+
+        return self.centroids.nbytes + self.order.nbytes + self.offsets.nbytes
+
+
+    def save(self, path):
+        """Save index into .npz file"""
+
+        np.savez(path, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                 n_probe=np.array(self.n_probe), fingerprint=np.array(self.fingerprint))
+
+
+    @classmethod
+    def load(cls, path, model=None):
+        """Load index from .npz file. If gensim model is given, check that index was built for the same model
+
+        Returns
+        -------
+        IVFIndex()
+        """
+
+        with np.load(path) as data:
+            index = cls(data['centroids'], data['order'], data['offsets'], int(data['n_probe']), str(data['fingerprint']))
+        if model is not None and index.fingerprint != vocab_fingerprint(model):
+            raise ValueError('ANN index ' + str(path) + ' was built for another gensim model')
+        return index
+
+
+    def search(self, model, queries, k, exclude, n_probe=None):
+        """Find approximate k nearest words for every query.
+
+        Parameters
+        ----------
+        - model: gensim KeyedVectors
+        - queries: np.array with unit query vectors, shape (number of queries, vector size)
+        - k: number of neighbours
+        - exclude: list with arrays of word indexes, which must not be returned for each query
+        - n_probe: number of clusters scanned by search. Default is self.n_probe
+
+        Returns
+        -------
+        list with tuple (np.array with word indexes, np.array with scores) for each query
+        """
+
+        if n_probe is None:
+            n_probe = self.n_probe
+        n_probe = min(n_probe, len(self.centroids))
+        model.fill_norms()
+
+        closest_lists = np.argpartition(-(queries @ self.centroids.T), n_probe-1, axis=1)[:, :n_probe]
+        results = []
+        for query, lists, excluded in zip(queries, closest_lists, exclude):
+            candidates = np.concatenate([self.order[self.offsets[i]:self.offsets[i+1]] for i in lists])
+            scores = (model.vectors[candidates] @ query) / model.norms[candidates]
+            scores[np.isin(candidates, excluded)] = -np.inf
+            best, best_scores = top_k(scores[np.newaxis, :], k, [[]])
+            best = best[0][np.isfinite(best_scores[0])]
+            results.append((candidates[best], best_scores[0][:len(best)]))
+        return results
+
+
+def recall_at_k(index, model, k=10, q_queries=200, n_probe=None, seed=123):
+    """Compare approximate search of the index with exact search on random words of the model.
+
+    Parameters
+    ----------
+    - index: IVFIndex()
+    - model: gensim KeyedVectors
+    - k: number of neighbours
+    - q_queries: number of random query words
+    - n_probe: number of clusters scanned by search. Default is index.n_probe
+    - seed: random seed
+
+    Returns
+    -------
+    dictionary with recall@k and average time of exact and approximate search for one query in milliseconds
+    """
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(model.index_to_key), size=min(q_queries, len(model.index_to_key)), replace=False)
+    queries = normed_vectors(model, rows)
+    exclude = [[row] for row in rows]
+
+    start_time = time.perf_counter()
+    exact_idx, _ = top_k(similarity_scores(model, queries), k, exclude)
+    exact_ms = (time.perf_counter() - start_time) * 1000 / len(rows)
+
+    start_time = time.perf_counter()
+    approx = index.search(model, queries, k, exclude, n_probe=n_probe)
+    approx_ms = (time.perf_counter() - start_time) * 1000 / len(rows)
+
+    found = sum(len(np.intersect1d(exact, idx)) for exact, (idx, _) in zip(exact_idx, approx))
+    return {'n_probe': n_probe if n_probe is not None else index.n_probe,
+            'recall_at_' + str(k): found / (k * len(rows)),
+            'exact_ms': exact_ms,
+            'approx_ms': approx_ms}
+
+
+class LRUCache():
+
+    def __init__(self, max_size=100000):
+        """Initiation of LRUCache() object. Thread-safe cache with limited size: when it is full,
+        the least recently used value is removed. Cache counts hits, misses and evictions
+
+        Parameters
+        ----------
+        - max_size: maximum number of values in cache
+        """
+
+        self.max_size = max_size
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __contains__(self, key):
+        """Check key without changing statistics and order of values"""
+
+        with self.__lock:
+            return key in self.__data
+
+
+    def __len__(self):
+        return len(self.__data)
+
+
+    def get(self, key, default=None):
+        """Return value by key or default, if there is no such key"""
+
+        with self.__lock:
+            if key in self.__data:
+                self.__data.move_to_end(key)
+                self.hits += 1
+                return self.__data[key]
+            self.misses += 1
+            return default
+
+
+    def put(self, key, value):
+        """Save value into cache. If cache is full, remove the least recently used values"""
+
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+            self.__evict()
+
+
+    def resize(self, max_size):
+        """Change maximum number of values in cache"""
+
+        with self.__lock:
+            self.max_size = max_size
+            self.__evict()
+
+
+    def __evict(self):
+        while len(self.__data) > self.max_size:
+            self.__data.popitem(last=False)
+            self.evictions += 1
+
+
+    def clear(self):
+        """Remove all values and reset statistics"""
+
+        with self.__lock:
+            self.__data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+    def stats(self):
+        """Return dictionary with cache size and hits, misses, evictions counters"""
+
+        with self.__lock:
+            requests = self.hits + self.misses
+            return {'size': len(self.__data),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / requests if requests else np.nan}
+
+
+# Caches of the process with synonyms and antonyms, one cache for each gensim model.
+# Keys are (lowercased word, query kind, topn). Cache is removed together with its model
+caches = weakref.WeakKeyDictionary()
+caches_lock = threading.Lock()
+
+
+def cache_for(model, max_size=100000):
+    """Return LRU cache of the process for gensim model. All ExerciseGen() objects with the same model share it
+
+    Parameters
+    ----------
+    - model: gensim KeyedVectors
+    - max_size: maximum number of values, used only when the cache is created
+    """
+
+    with caches_lock:
+        if model not in caches:
+            caches[model] = LRUCache(max_size)
+        return caches[model]
+
+
+class DistractorEngine():
+
+    def __init__(self, model, table=None, cache=None, index=None):
+        """Initiation of DistractorEngine() object. Engine finds synonyms and antonyms for wrong answer options.
+        Words of the whole lesson are collected first and queried together by prefetch(),
+        then generators take the results by synonyms() and antonyms().
+        All the results are saved into LRU cache, which is shared by the whole process
+
+        Parameters
+        ----------
+        - model: gensim KeyedVectors
+        - table: NeighbourTable() with precomputed neighbours or None
+        - cache: LRUCache() for results. By default the cache of the process for this model is used
+        - index: IVFIndex() for approximate search in big models or None for exact search
+        """
+
+        self.model = model
+        self.table = table
+        self.cache = cache if cache is not None else cache_for(model)
+        self.index = index
+
+
+    def __search(self, rows, kind, topn):
+        """Find neighbours of words with indexes 'rows'. Exact search uses one matrix multiply for all words,
+        approximate search uses ANN index if it is given
+
+        Returns
+        -------
+        list with neighbours of each word: list of (word, score)
+        """
+
+        queries = normed_vectors(self.model, rows)
+        if kind == 'syn':
+            exclude = [[row] for row in rows]
+        else:
+            queries = antonym_query(self.model, queries)
+            special = [self.model.get_index('bad'), self.model.get_index('good')]
+            exclude = [[row] + special for row in rows]
+
+        if self.index is not None:
+            found = self.index.search(self.model, queries, topn, exclude)
+            # Probed clusters could contain less than topn words, such words are searched exactly
+            short = [i for i, (idx, scores) in enumerate(found) if len(idx) < topn]
+            if len(short) > 0:
+                exact = zip(*top_k(similarity_scores(self.model, queries[short]), topn, [exclude[i] for i in short]))
+                for i, result in zip(short, exact):
+                    found[i] = result
+        else:
+            found = zip(*top_k(similarity_scores(self.model, queries), topn, exclude))
+        return [[(self.model.index_to_key[j], float(score)) for j, score in zip(idx, scores)] for idx, scores in found]
+
+
+    def prefetch(self, words, topns=(10,), block_bytes=32 * 2**20):
+        """Find synonyms and antonyms for all words at once. Queries of all words are put into one matrix,
+        so the whole lesson needs a couple of matrix multiplies instead of two vocabulary scans per word.
+        Words that are not in model, that are already in precomputed table or in cache are skipped.
+
+        Parameters
+        ----------
+        - words: list with words
+        - topns: list with numbers of neighbours, which will be asked for each word
+        - block_bytes: maximal size of scores of one matrix multiply in bytes. Number of words in one multiply 
+        depends on vocabulary size: about 20 words for glove models with 400000 words
+        """
+
+        topn = max(topns)
+        new_words = []
+        for word in dict.fromkeys(words):
+            if word not in self.model.key_to_index:
+                continue
+            if all((word, kind, i) in self.cache for kind in ['syn', 'ant'] for i in topns):
+                continue
+            if self.table is not None and self.table.synonyms(self.model, word, topn) is not None:
+                continue
+            new_words.append(word)
+        if not new_words or 'good' not in self.model.key_to_index or 'bad' not in self.model.key_to_index:
+            return
+
+        block_size = max(1, block_bytes // (self.model.vectors.dtype.itemsize * len(self.model.index_to_key)))
+        for start in range(0, len(new_words), block_size):
+            block_words = new_words[start:start+block_size]
+            rows = [self.model.get_index(word) for word in block_words]
+
+            for word, synonyms, antonyms in zip(block_words,
+                                                self.__search(rows, 'syn', topn),
+                                                self.__search(rows, 'ant', topn)):
+                for j in topns:
+                    self.cache.put((word, 'syn', j), synonyms[:j])
+                    self.cache.put((word, 'ant', j), antonyms[:j])
+
+
+    def synonyms(self, word, topn=10):
+        """Return list of (word, score) like gensim most_similar(word, topn=topn)"""
+
+        word = word.lower()
+        key = (word, 'syn', topn)
+        result = self.cache.get(key)
+        if result is None:
+            if self.table is not None:
+                result = self.table.synonyms(self.model, word, topn)
+            if result is None:
+                result = self.__search([self.model.get_index(word)], 'syn', topn)[0]
+            self.cache.put(key, result)
+        return result
+
+
+    def antonyms(self, word, topn=10):
+        """Return list of (word, score) like gensim most_similar(positive=[word, 'bad'], negative=['good'], topn=topn)"""
+
+        word = word.lower()
+        key = (word, 'ant', topn)
+        result = self.cache.get(key)
+        if result is None:
+            if self.table is not None:
+                result = self.table.antonyms(self.model, word, topn)
+            if result is None:
+                result = self.__search([self.model.get_index(word)], 'ant', topn)[0]
+            self.cache.put(key, result)
+        return result
+
+
+if __name__ == '__main__':
+    import model_registry
+
+    parser = argparse.ArgumentParser(description='Precompute data for fast search of synonyms and antonyms')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    table_parser = subparsers.add_parser('table', help='precompute neighbours for the most frequent words')
+    table_parser.add_argument('name', nargs='?', default='glove-wiki-gigaword-100', help='model name in gensim downloader')
+    table_parser.add_argument('--words', type=int, default=50000, help='number of the most frequent words in table')
+    table_parser.add_argument('--topn', type=int, default=20, help='number of neighbours for each word')
+    table_parser.add_argument('--block-size', type=int, default=128, help='number of words in one matrix multiply')
+    table_parser.add_argument('--target', help='path to table. By default VECTORS_DIR/<name>.neighbours.npz')
+
+    ann_parser = subparsers.add_parser('ann', help='build approximate nearest neighbour index and report its recall')
+    ann_parser.add_argument('name', nargs='?', default='glove-wiki-gigaword-100', help='model name in gensim downloader')
+    ann_parser.add_argument('--n-lists', type=int, help='number of clusters. Default is 4 * sqrt(vocabulary size)')
+    ann_parser.add_argument('--n-probe', type=int, default=16, help='number of clusters scanned by search')
+    ann_parser.add_argument('--n-iter', type=int, default=10, help='number of k-means iterations')
+    ann_parser.add_argument('--target', help='path to index. By default VECTORS_DIR/<name>.ivf.npz')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    model = model_registry.registry.vectors(args.name)
+
+    if args.command == 'table':
+        data = NeighbourTable.build(model, q_words=args.words, k=args.topn, block_size=args.block_size)
+        target = args.target or model_registry.neighbours_path(args.name)
+    else:
+        data = IVFIndex.build(model, n_lists=args.n_lists, n_iter=args.n_iter, n_probe=args.n_probe)
+        target = args.target or model_registry.ann_index_path(args.name)
+
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    data.save(target)
+    print('Data is saved into', target, 'in', round(time.perf_counter() - start_time, 1), 'seconds')
+
+    if args.command == 'ann':
+        for n_probe in sorted({1, args.n_probe // 4 or 1, args.n_probe, args.n_probe * 4}):
+            print(recall_at_k(data, model, k=10, n_probe=n_probe))
@@ -0,0 +1,167 @@
+import pandas as pd
+import numpy as np
+
+
+# Columns of dataframe with lesson exercises
+LESSON_COLUMNS = ['row_num', 'raw', 'task_type', 'task_text', 'task_object', 'task_options',
+                  'task_answer', 'task_result', 'task_description', 'task_total']
+
+
+class Empty():
+    """Type of EMPTY marker"""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'EMPTY'
+
+    def __bool__(self):
+        return False
+
+    def __reduce__(self):
+        return 'EMPTY'
+
+
+# Marker of missing field of exercise. In dataframes it becomes np.nan
+EMPTY = Empty()
+
+
+def compact_options(options):
+    """Convert list of options or list of lists of options into tuples"""
+
+    if isinstance(options, list):
+        return tuple(tuple(option) if isinstance(option, list) else option for option in options)
+    return options
+
+
+class ExerciseRecord():
+
+    __slots__ = LESSON_COLUMNS
+
+    def __init__(self, raw, task_type, task_text, task_object=EMPTY, task_options=EMPTY, task_answer=EMPTY,
+                 task_result=EMPTY, task_description=EMPTY, task_total=EMPTY, row_num=EMPTY):
+        """Initiation of ExerciseRecord() object. Record keeps one exercise, its answers and results.
+        Missing fields are EMPTY, options are kept in tuples. Record could be read and changed
+        like a dictionary: record['task_result'][0] = answer
+
+        Parameters
+        ----------
+        - raw: original sentence
+        - task_type: exercise type
+        - task_text: text of exercise
+        - task_object: list with words/chunks, which are questioned
+        - task_options: list with options for every questioned word (it is converted into tuple of tuples)
+        - task_answer: list with correct answers
+        - task_result: list with answers of user
+        - task_description: description of exercise. Exercise without description is empty
+        - task_total: result of exercise
+        - row_num: number of sentence in text
+        """
+
+        self.raw = raw
+        self.task_type = task_type
+        self.task_text = task_text
+        self.task_object = task_object
+        self.task_options = compact_options(task_options)
+        self.task_answer = task_answer
+        self.task_result = task_result
+        self.task_description = task_description
+        self.task_total = task_total
+        self.row_num = row_num
+
+
+    @property
+    def is_empty(self):
+        """True, if exercise could not be created for the sentence"""
+
+        return self.task_description is EMPTY
+
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+
+    def __setitem__(self, key, value):
+        if key not in LESSON_COLUMNS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+
+    def __contains__(self, key):
+        return key in LESSON_COLUMNS
+
+
+    def keys(self):
+        return list(LESSON_COLUMNS)
+
+
+    def to_dict(self):
+        """Return dictionary with all fields. EMPTY fields are np.nan, like in dataframes"""
+
+        return {column: np.nan if self[column] is EMPTY else self[column] for column in LESSON_COLUMNS}
+
+
+    def __eq__(self, other):
+        if not isinstance(other, ExerciseRecord):
+            return NotImplemented
+        return all(self[column] == other[column] for column in LESSON_COLUMNS)
+
+
+    def __repr__(self):
+        return 'ExerciseRecord({})'.format(', '.join(column + '=' + repr(self[column]) for column in LESSON_COLUMNS))
+
+
+def records_to_frame(records):
+    """Convert list of exercise records into dataframe with lesson exercises in one step.
+    EMPTY fields become np.nan, column 'task_total' is float64. Dictionaries with the same keys are accepted too
+
+    Parameters
+    ----------
+    - records: list with ExerciseRecord() objects or exercise dictionaries with all keys from LESSON_COLUMNS
+
+    Returns
+    -------
+    pd.DataFrame with columns LESSON_COLUMNS
+    """
+
+    columns = {}
+    for column in LESSON_COLUMNS:
+        values = np.empty(len(records), dtype=object)
+        for i, record in enumerate(records):
+            value = record[column]
+            if value is EMPTY:
+                value = np.nan
+            elif isinstance(value, np.generic):
+                value = value.item()
+            values[i] = value
+        columns[column] = values
+
+    df = pd.DataFrame(columns, columns=LESSON_COLUMNS)
+    df['task_total'] = df['task_total'].astype('float64')
+    return df
+
+
+def frame_to_records(df):
+    """Convert dataframe with lesson exercises back into exercise records one by one. np.nan fields become EMPTY
+
+    Parameters
+    ----------
+    - df: pd.DataFrame with columns LESSON_COLUMNS
+
+    Yields
+    ------
+    ExerciseRecord() objects
+    """
+
+    for row in df[LESSON_COLUMNS].itertuples(index=False, name=None):
+        values = {}
+        for column, value in zip(LESSON_COLUMNS, row):
+            if isinstance(value, float) and np.isnan(value):
+                value = EMPTY
+            elif isinstance(value, np.generic):
+                value = value.item()
+            values[column] = value
+        yield ExerciseRecord(**values)
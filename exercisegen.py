@@ -1,45 +1,124 @@
 import re
+import time
+import codecs
 import random
+import itertools
 
 import pandas as pd
 import numpy as np
 import gensim
 import spacy
-import pyinflect
+from spacy.tokens import Doc
 import streamlit  as st
 
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
-import gensim.downloader as api
+import model_registry
+import text_store
+import lesson_io
+import inflections
+import grading
+from metrics import Metrics
+from distractors import DistractorEngine
+from exercise_record import ExerciseRecord, EMPTY, LESSON_COLUMNS, records_to_frame
 
 np.random.seed(123)
 random.seed(123)
 
+# Exercise types in the order of list_of_exercises argument of create_lesson()
+EXERCISE_TYPES = ['select_word_syn_ant', 'select_word_adj', 'select_word_verb', 'select_sent_word', 'select_sent_adj',
+                  'select_sent_verb', 'select_memb_groups', 'fill_words_in_the_gaps', 'listening_fill_chunks',
+                  'set_word_order']
+
+# Sentence, which starts with lowercase letter, is the ending of direct speech from the previous sentence
+LOWER_START = re.compile(r'[a-z]')
+
+# Opening quote is followed by a letter
+OPENING_QUOTE = re.compile(r'"(?=[a-zA-Z])')
+
+# Spacy components, which set parts of speech. Tagger of small model listens to tok2vec
+POS_COMPONENTS = ['tok2vec', 'tagger', 'attribute_ruler']
+
+# Spacy components, which are needed by every exercise type: parts of speech, lemmas and tags for inflections 
+# (lemmatizer uses parts of speech), dependencies for noun chunks. NER is not used by any exercise type
+EXERCISE_COMPONENTS = {'select_word_syn_ant': POS_COMPONENTS, 
+                       'select_word_adj': POS_COMPONENTS + ['lemmatizer'], 
+                       'select_word_verb': POS_COMPONENTS + ['lemmatizer'], 
+                       'select_sent_word': POS_COMPONENTS, 
+                       'select_sent_adj': POS_COMPONENTS + ['lemmatizer'], 
+                       'select_sent_verb': POS_COMPONENTS + ['lemmatizer'], 
+                       'select_memb_groups': POS_COMPONENTS + ['parser'], 
+                       'fill_words_in_the_gaps': POS_COMPONENTS, 
+                       'listening_fill_chunks': POS_COMPONENTS + ['parser'], 
+                       'set_word_order': []}
+
+
 class ExerciseGen():
     
-    def __init__(self):
+    def __init__(self, registry=None, store=None, metrics=False):
         """Initiation of ExerciseGen() object. 
-        Contain spacy 'en_core_web_sm' model and gensim 'glove-wiki-gigaword-100' model"""
+        Contain spacy 'en_core_web_sm' model and gensim 'glove-wiki-gigaword-100' model.
+        Models are taken from the registry, so they are loaded only once per process and shared by all objects
         
+        Parameters
+        ----------
+        registry : ModelRegistry() - registry with models. Default registry is shared by the whole process
+        store : TextStore() - disk store with parsed texts, which is used by load_text() and load_file()
+        metrics : bool - if True, time of every stage is measured (see get_metrics()). 
+        It could be switched later with self.metrics.enabled"""
+        
+        if registry is None:
+            registry = model_registry.registry
+        if store is None:
+            store = text_store.store
+        self.__store = store
+
+        # Timers and counters of stages: parsing, synonyms and antonyms, inflections, lesson assembly and every exercise type
+        self.metrics = Metrics(enabled=metrics)
+
         # Small spacy model
-        self.__nlp = spacy.load("en_core_web_sm")
+        self.__nlp = registry.nlp("en_core_web_sm")
+
+        # Lean copy of small spacy model, which only splits text by sentences. 
+        # Full model parses only sentences, which get into a lesson
+        self.__senter = registry.senter("en_core_web_sm")
 
         # Small glove wiki model
         # Attention - it takes a very long time to download if it is not already installed
-        self.__model = api.load("glove-wiki-gigaword-100")
-        
+        self.__model = registry.vectors("glove-wiki-gigaword-100")
+
+        # Synonyms and antonyms for wrong answer options. Engine uses precomputed neighbours of the most frequent words
+        # if the table was built, and finds neighbours for all words of a lesson in batches.
+        # For big models approximate nearest neighbour index could be built, otherwise the search is exact
+        self.__distractors = DistractorEngine(self.__model, 
+                                              table=registry.neighbours("glove-wiki-gigaword-100"),
+                                              index=registry.ann_index("glove-wiki-gigaword-100"))
+        
+        # Statistics of the last text splitting: number of paragraphs and sentences, time and speed
+        self.ingestion_stats = {}
+
+        # Key and sentences of the last text opened by load_text() or load_file()
+        self.__text_key = None
+        self.__text_sentences = frozenset()
+        # Parsed sentences of that text: {tuple with names of spacy components : {sentence : spacy Doc}}.
+        # They are loaded from the text store and saved back after lesson generation (see save_docs())
+        self.__docs = {}
+        self.__unsaved_docs = set()
+
         # Fix random seed
         np.random.seed(123)
         random.seed(123)
     
     
-    def open_text(self, text):
+    def open_text(self, text, batch_size=64, n_process=1):
         """Split text by paragraphs and create dataframe from text.
         
         Parameters
         ----------
         text : str - original text for exercise generator
+        batch_size : int - number of paragraphs that spacy model processes in one batch
+        n_process : int - number of processes for spacy model. Use more than 1 process only for very long texts
         
         Returns
         -------
@@ -51,44 +130,247 @@ class ExerciseGen():
         dataset = dataset[dataset['raw'] != '']
 
         # Split text in DataFrame by sentences
-        rows_list = []
-        list_text = dataset['raw'].values
-        for i in list_text:
-            doc = self.__nlp(i)
-            a = [sent.text.strip() for sent in doc.sents]
-            for j in a:
-                rows_list.append(j)
+        rows_list = self.split_sentences(dataset['raw'].values, batch_size=batch_size, n_process=n_process)
         df = pd.DataFrame(rows_list, columns=['raw'])
 
         return df
     
     
-    def open_file(self, file):
+    def open_file(self, file, batch_size=64, n_process=1):
         """Split text by paragraphs and create dataframe from csv/text file.
         
         Parameters
         ----------
         file : file - csv or text file which contains original text for exercise generator
+        batch_size : int - number of paragraphs that spacy model processes in one batch
+        n_process : int - number of processes for spacy model. Use more than 1 process only for very long texts
         
         Returns
         -------
         pd.DataFrame() with column 'raw'. 1 row contain one sentence from original text
         """
         
-        # Convert text to DataFrame
-        dataset = pd.read_csv(file, names=['raw'], delimiter="\t")
-
-        # Split text in DataFrame by sentences
-        rows_list = []
-        list_text = dataset['raw'].values
-        for i in list_text:
-            doc = self.__nlp(i)
-            a = [sent.text.strip() for sent in doc.sents]
-            for j in a:
-                rows_list.append(j)
+        # Split text in file by sentences. File is read by chunks, every line is a paragraph
+        rows_list = self.split_sentences(self.read_paragraphs(file), batch_size=batch_size, n_process=n_process)
         df = pd.DataFrame(rows_list, columns=['raw'])
 
         return df
+
+
+    def read_paragraphs(self, file, chunk_size=2**16, max_paragraph=2**16):
+        """Read csv/text file by chunks and yield its paragraphs (non-empty lines) one by one, 
+        so the whole file is never kept in memory. Line, which is not finished in the chunk, is continued 
+        with the next chunk. Tabs are kept inside lines like in open_text()
+        
+        Parameters
+        ----------
+        file : file or path - csv or text file which contains original text for exercise generator
+        chunk_size : int - number of chars (bytes for binary files) read at once
+        max_paragraph : int - maximal length of paragraph. Longer lines are cut after the last finished sentence, 
+        so sentences are not broken
+        
+        Yields
+        ------
+        str with paragraph"""
+
+        f = open(file, 'rb') if isinstance(file, str) else file
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        tail = ''
+        try:
+            while True:
+                chunk = f.read(chunk_size)
+                last = len(chunk) == 0
+                # Chars, which bytes are split between chunks, are decoded with the next chunk
+                if isinstance(chunk, bytes):
+                    chunk = decoder.decode(chunk, final=last)
+                
+                lines = (tail + chunk).split('\n')
+                tail = lines.pop()
+                for line in lines:
+                    if line != '':
+                        yield line
+                
+                # Very long line without line breaks is cut after the last sentence
+                while len(tail) > max_paragraph:
+                    end = self.__paragraph_end(tail, max_paragraph)
+                    yield tail[:end]
+                    tail = tail[end:]
+                
+                if last:
+                    break
+        finally:
+            if isinstance(file, str):
+                f.close()
+        
+        if tail != '':
+            yield tail
+
+
+    def __paragraph_end(self, text, max_paragraph):
+        """Return position, where too long text could be cut: after the last sentence end, 
+        after the last space or at max_paragraph"""
+
+        head = text[:max_paragraph]
+        ends = [match.end() for match in re.finditer(r'[.!?]["\')\]]*\s+', head)]
+        if len(ends) > 0:
+            return ends[-1]
+        spaces = head.rstrip().rfind(' ')
+        if spaces > 0:
+            return spaces + 1
+        return max_paragraph
+
+
+    def stream_file(self, file, chunk_size=2**16, batch_size=64, n_process=1):
+        """Read csv/text file by chunks, split it by sentences and beautify them row by row. 
+        Memory does not depend on the size of file, so very big texts (whole novels) could be used. 
+        Unlike load_file(), parsed sentences are not saved into the text store
+        
+        Parameters
+        ----------
+        file : file or path - csv or text file which contains original text for exercise generator
+        chunk_size : int - number of chars (bytes for binary files) read at once
+        batch_size : int - number of paragraphs that spacy model processes in one batch
+        n_process : int - number of processes for spacy model
+        
+        Yields
+        ------
+        tuples (row_num, sentence) like rows of beautify_text()"""
+
+        paragraphs = self.read_paragraphs(file, chunk_size=chunk_size)
+        sentences = (sent.text.strip() 
+                     for doc in self.__senter.pipe(paragraphs, batch_size=batch_size, n_process=n_process) 
+                     for sent in doc.sents)
+        return self.iter_beautified(sentences)
+
+
+    def load_text(self, text, batch_size=64, n_process=1):
+        """Open text and beautify it. Sentences are saved into the text store, so the same text is opened again 
+        without spacy model. Sentences are parsed by the full model later, only if they get into a lesson.
+        
+        Parameters
+        ----------
+        text : str - original text for exercise generator
+        batch_size : int - number of paragraphs that spacy model processes in one batch
+        n_process : int - number of processes for spacy model. Use more than 1 process only for very long texts
+        
+        Returns
+        -------
+        pd.DataFrame() with columns 'row_num' and 'raw' like beautify_text()"""
+
+        return self.__load(text, 'text', lambda: self.open_text(text, batch_size=batch_size, n_process=n_process))
+
+
+    def load_file(self, file, batch_size=64, n_process=1):
+        """Open csv/text file and beautify it. Sentences are saved into the text store,
+        so the same file is opened again without spacy model.
+        
+        Parameters
+        ----------
+        file : file or path - csv or text file which contains original text for exercise generator
+        batch_size : int - number of paragraphs that spacy model processes in one batch
+        n_process : int - number of processes for spacy model. Use more than 1 process only for very long texts
+        
+        Returns
+        -------
+        pd.DataFrame() with columns 'row_num' and 'raw' like beautify_text()"""
+
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                content = f.read()
+        else:
+            content = file.read()
+            file.seek(0)
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+
+        return self.__load(content, 'file', lambda: self.open_file(file, batch_size=batch_size, n_process=n_process))
+
+
+    def __load(self, text, kind, open_func):
+        """Return beautified dataframe from the text store or create it with open_func() and save into the store"""
+
+        key = text_store.text_key(text, self.__senter, kind=kind)
+        df = self.__store.get(key)
+        if df is not None:
+            self.metrics.count('store_hits')
+            # Sentences, which got into lessons before, are already parsed
+            docs = self.__store.get_docs(key, self.__nlp)
+            self.ingestion_stats = {'paragraphs': np.nan, 'sentences': len(df), 'seconds': 0.0, 
+                                    'sentences_per_second': np.nan, 'stored': True}
+        else:
+            df = self.beautify_text(open_func())
+            self.ingestion_stats['stored'] = False
+            self.metrics.count('store_misses')
+            # Sentences are parsed by the full model later, only if they get into a lesson
+            docs = {}
+            self.__store.put(key, df)
+
+        self.__text_key = key
+        self.__text_sentences = frozenset(df['raw'])
+        self.__docs = docs
+        self.__unsaved_docs = set()
+        return df
+
+
+    def save_docs(self):
+        """Save parsed sentences of the text opened by load_text() or load_file() into the text store, 
+        so they are not parsed again next time. It is called by iter_lesson() at the end of generation"""
+
+        for components in self.__unsaved_docs:
+            self.__store.put_docs(self.__text_key, self.__nlp, components, self.__docs[components].values())
+        self.__unsaved_docs = set()
+
+
+    def __stored_doc(self, text, components):
+        """Return Doc of sentence of the loaded text, which was parsed with all given components, or None.
+        Doc parsed with more components could be used too"""
+
+        for doc_components, docs in self.__docs.items():
+            if text in docs and set(components) <= set(doc_components):
+                return docs[text]
+        return None
+
+
+    def __keep_doc(self, text, doc, components):
+        """Keep Doc of sentence of the loaded text until save_docs()"""
+
+        if text in self.__text_sentences:
+            self.__docs.setdefault(components, {})[text] = doc
+            self.__unsaved_docs.add(components)
+
+
+    def split_sentences(self, paragraphs, batch_size=64, n_process=1):
+        """Split paragraphs by sentences with lean spacy model (only sentence segmentation, see ModelRegistry.senter()). 
+        Paragraphs are streamed through the model in batches, 
+        the order of paragraphs and sentences is kept. Speed of splitting is saved into self.ingestion_stats
+        
+        Parameters
+        ----------
+        paragraphs : iterable with str - paragraphs of original text
+        batch_size : int - number of paragraphs that spacy model processes in one batch
+        n_process : int - number of processes for spacy model
+        
+        Returns
+        -------
+        list with str. 1 element contain one sentence from original text
+        """
+
+        start_time = time.perf_counter()
+        q_paragraphs = 0
+        rows_list = []
+        for doc in self.__senter.pipe(paragraphs, batch_size=batch_size, n_process=n_process):
+            q_paragraphs += 1
+            rows_list.extend(sent.text.strip() for sent in doc.sents)
+        seconds = time.perf_counter() - start_time
+        self.metrics.add_time('split_sentences', seconds)
+        self.metrics.count('paragraphs', q_paragraphs)
+
+        self.ingestion_stats = {'paragraphs': q_paragraphs,
+                                'sentences': len(rows_list),
+                                'seconds': seconds,
+                                'sentences_per_second': len(rows_list) / seconds if seconds > 0 else np.nan}
+
+        return rows_list
     
     
     def quotes_func(self, text):
@@ -103,19 +385,11 @@ class ExerciseGen():
         str with text that has even number of quotes
         """
         
-        # count_q - all quotes, count_q_open - opening quotes
-        count_q = 0
-        count_q_open = 0
-
-        # Count quotes in string. If next char is letter - that is opening quote
-        for i in range(len(text)):
-            if text[i] == '"':
-                count_q += 1
-                try:
-                    if re.sub(r'[^a-zA-Z]', '', text[i+1]) != '':
-                        count_q_open += 1 
-                except:
-                    pass
+        # count_q - all quotes, count_q_open - opening quotes (next char is letter)
+        count_q = text.count('"')
+        if count_q == 0:
+            return text
+        count_q_open = len(OPENING_QUOTE.findall(text))
 
         # Count closing quotes
         count_q_close = count_q - count_q_open
@@ -132,7 +406,7 @@ class ExerciseGen():
         
 
     def beautify_text(self, df):
-        """Add missing quotes and concatenate broken rows
+        """Add missing quotes and concatenate broken rows in one pass over sentences (see iter_beautified())
         
         Parameters
         ----------
@@ -140,49 +414,280 @@ class ExerciseGen():
         
         Returns
         -------
-        pd.DataFrame() with improved text
+        pd.DataFrame() with columns 'row_num' and 'raw' with improved text
         """
         
-        # If row starts with lowercase letter, join it with the previous row
-        # because that is ending of direct speech
-        df['shift_raw'] = df['raw'].shift(periods=-1, fill_value='')
-        df['raw_regex'] = df['raw'].str[:1].str.replace(r'[^a-z]', '', regex=True)
-        df['shift_raw_regex'] = df['raw_regex'].shift(periods=-1, fill_value='')
-        df.loc[df['shift_raw_regex'] != '', 'raw'] = (df.loc[df['shift_raw_regex'] != '', 'raw'] + 
-                                                      '" ' + 
-                                                      df.loc[df['shift_raw_regex'] != '', 'shift_raw'])
-        df = df[df['raw_regex'] == '']
-        df = df.drop(['shift_raw', 'raw_regex', 'shift_raw_regex'], axis=1)
-
-        # Add missing quotes
-        df['raw'] = df['raw'].apply(self.quotes_func)
-
-        # Add column with index
-        df = df.reset_index(drop=True)
-        df = df.reset_index()
-        df = df.rename(columns={"index": "row_num"})
+        with self.metrics.timer('beautify'):
+            rows = list(self.iter_beautified(df['raw']))
+            raw = np.empty(len(rows), dtype=object)
+            raw[:] = [text for _, text in rows]
+            return pd.DataFrame({'row_num': np.arange(len(rows), dtype='int64'), 'raw': raw}, columns=['row_num', 'raw'])
+
+
+    def iter_beautified(self, sentences):
+        """Add missing quotes and concatenate broken rows row by row. 
+        Only one next sentence is kept in memory, so very long texts could be streamed
+        
+        Parameters
+        ----------
+        sentences : iterable with str - sentences of text
+        
+        Yields
+        ------
+        tuples (row_num, sentence) with improved text"""
+
+        # Time of quotes_func() is summed here and added to stage 'quotes' once, 
+        # because timer for every sentence would take more time than the function itself
+        timed = self.metrics.enabled
+        quotes_seconds = 0.0
+        quotes_calls = 0
+
+        def fix_quotes(text):
+            nonlocal quotes_seconds, quotes_calls
+            if not timed:
+                return self.quotes_func(text)
+            start_time = time.perf_counter()
+            text = self.quotes_func(text)
+            quotes_seconds += time.perf_counter() - start_time
+            quotes_calls += 1
+            return text
+
+        row_num = 0
+        prev = None
+        prev_lower = False
+        try:
+            for text in sentences:
+                text_lower = LOWER_START.match(text) is not None
+                # If row starts with lowercase letter, join it with the previous row
+                # because that is ending of direct speech
+                if prev is not None and not prev_lower:
+                    yield row_num, fix_quotes(prev + '" ' + text if text_lower else prev)
+                    row_num += 1
+                prev = text
+                prev_lower = text_lower
+            if prev is not None and not prev_lower:
+                yield row_num, fix_quotes(prev)
+        finally:
+            if quotes_calls > 0:
+                self.metrics.add_time('quotes', quotes_seconds, calls=quotes_calls)
+
+
+    def needed_components(self, list_of_exercises=[True, True, True, True, True, True, True, True, True, True]):
+        """Return names of spacy components, which are needed by enabled exercise types (see EXERCISE_COMPONENTS). 
+        Other components are disabled while parsing, so lessons with cheap exercise types are parsed faster
+        
+        Parameters
+        ----------
+        - list_of_exercises: list with bools, see create_lesson()
+        
+        Returns
+        -------
+        list with names of components in the order of spacy pipeline
+        """
+
+        needed = set()
+        for ex_type, enabled in zip(EXERCISE_TYPES, list_of_exercises):
+            if enabled:
+                needed.update(EXERCISE_COMPONENTS[ex_type])
+        return [name for name in self.__nlp.pipe_names if name in needed]
+
+
+    def __enabled_components(self, components):
+        """Return tuple with names of spacy components, which are in components, in the order of spacy pipeline. 
+        If components is None, components needed by all exercise types are used"""
+
+        if components is None:
+            components = self.needed_components()
+        return tuple(name for name in self.__nlp.pipe_names if name in components)
+
+
+    def __disabled_components(self, components):
+        """Return names of spacy components, which are not in components. 
+        If components is None, components needed by all exercise types are used"""
+
+        if components is None:
+            components = self.needed_components()
+        return [name for name in self.__nlp.pipe_names if name not in components]
+
+
+    def parse_sentences(self, texts, docs=None, batch_size=256, components=None):
+        """Parse sentences with spacy model. Every unique sentence is parsed only once,
+        so parsed Docs could be shared between all exercise generators.
+
+        Parameters
+        ----------
+        - texts: list of sentences
+        - docs: dictionary with already parsed sentences. Sentences from it will not be parsed again, 
+        so they must be parsed with the same or more components
+        - batch_size: number of sentences that spacy model parses in one batch
+        - components: names of spacy components to run (see needed_components()). 
+        By default components needed by all exercise types are run
+
+        Returns
+        -------
+        dictionary {sentence : spacy Doc}
+        """
+
+        if docs is None:
+            docs = {}
+        components = self.__enabled_components(components)
+
+        # Sentences of the text opened by load_text() or load_file() could be parsed before
+        for text in texts:
+            if text not in docs:
+                doc = self.__stored_doc(text, components)
+                if doc is not None:
+                    docs[text] = doc
+
+        # Remove repeated and already parsed sentences, but keep the original order
+        new_texts = [text for text in dict.fromkeys(texts) if text not in docs]
+        disable = self.__disabled_components(components)
+        with self.metrics.timer('parse'):
+            for text, doc in zip(new_texts, self.__nlp.pipe(new_texts, batch_size=batch_size, disable=disable)):
+                docs[text] = doc
+                self.__keep_doc(text, doc, components)
+        self.metrics.count('parsed_sentences', len(new_texts))
+
+        return docs
+
+
+    def mask_spans(self, text, spans):
+        """Replace parts of text in one pass. Spans are set by character offsets from spacy
+        (token.idx, span.start_char), so repeated words are always replaced in the right place
+        
+        Parameters
+        ----------
+        - text: original text
+        - spans: list of tuples (start_char, end_char, replacement). Replacement could be '_____' for a gap, 
+        first letter with '_____' for a gap with hint, '**' + word + '**' for bold text or other word
+        
+        Returns
+        -------
+        str with replaced spans
+        """
+
+        parts = []
+        position = 0
+        for start_char, end_char, replacement in sorted(spans, key=lambda x:x[0]):
+            # Skip span that overlaps with the previous one
+            if start_char < position:
+                continue
+            parts.append(text[position:start_char])
+            parts.append(replacement)
+            position = end_char
+        parts.append(text[position:])
+
+        return ''.join(parts)
+
+
+    def __get_doc(self, text, components=None):
+        """Return text and its spacy Doc. If text is already parsed Doc, it is not parsed again. 
+        Otherwise only given spacy components are run (see parse_sentences())"""
+
+        if isinstance(text, Doc):
+            return text.text, text
+        components = self.__enabled_components(components)
+        doc = self.__stored_doc(text, components)
+        if doc is not None:
+            return text, doc
+        self.metrics.count('parsed_sentences')
+        with self.metrics.timer('parse'):
+            doc = self.__nlp(text, disable=self.__disabled_components(components))
+        self.__keep_doc(text, doc, components)
+        return text, doc
+
+
+    def __synonyms(self, word, topn=10):
+        """Return list of (word, score) with synonyms of word"""
+
+        self.metrics.count('distractor_queries')
+        with self.metrics.timer('distractors'):
+            return self.__distractors.synonyms(word, topn)
+
+
+    def __antonyms(self, word, topn=10):
+        """Return list of (word, score) with antonyms of word"""
+
+        self.metrics.count('distractor_queries')
+        with self.metrics.timer('distractors'):
+            return self.__distractors.antonyms(word, topn)
+
+
+    def __content_words(self, word, kind, topn=10):
+        """Return list with synonyms (kind='syn') or antonyms (kind='ant') of word without stop words.
+        Result is saved into the cache of distractor engine, so it is computed once for every word"""
+
+        key = (word, kind + '_content', topn)
+        words = self.__distractors.cache.get(key)
+        if words is None:
+            neighbours = self.__synonyms(word, topn) if kind == 'syn' else self.__antonyms(word, topn)
+            # Stop words are lexical attributes, so only tokenizer is needed
+            words = tuple(_.text for _ in self.__nlp.make_doc(' '.join(_[0] for _ in neighbours)) if not _.is_stop)
+            self.__distractors.cache.put(key, words)
+        return list(words)
+
+
+    def __inflections(self, token):
+        """Return dictionary {Penn Treebank tag : form} with all forms of token. 
+        Forms are the same as token._.inflect(tag) of pyinflect, but they are found by one lookup in the table"""
+
+        with self.metrics.timer('inflect'):
+            return inflections.table.token_forms(token)
+
+
+    def get_metrics(self):
+        """Return snapshot of timers and counters of all stages (see metrics.Metrics.snapshot()).
+        Metrics are collected only if they are enabled: ExerciseGen(metrics=True) or self.metrics.enabled = True"""
+
+        return self.metrics.snapshot()
+
+
+    def distractor_cache_stats(self):
+        """Return dictionary with size, hits, misses and evictions of the synonym and antonym cache"""
+
+        return self.__distractors.cache.stats()
+
+
+    def prefetch_distractors(self, texts, pos=['NOUN', 'VERB', 'ADJ', 'ADV'], topns=(10, 5)):
+        """Find synonyms and antonyms for all words of the texts at once, before exercises are created.
+        All queries are computed in a couple of matrix operations instead of two vocabulary scans per word
+        
+        Parameters
+        ----------
+        - texts: list with str or parsed spacy Docs
+        - pos: array with parts' of speech names. Only words with these parts of speech could be replaced in exercises
+        - topns: numbers of synonyms and antonyms, which generators ask for each word
+        """
+
+        words = []
+        for text in texts:
+            text, doc = self.__get_doc(text, POS_COMPONENTS)
+            words.extend(token.text.lower() for token in doc if token.pos_ in pos)
+        with self.metrics.timer('distractors/prefetch'):
+            self.__distractors.prefetch(words, topns=topns)
+
 
-        return df
-    
-    
     def select_word_syn_ant(self, text, pos=['NOUN', 'VERB', 'ADJ', 'ADV'], q_words=1):
         """Create english exercise: select correct missing word from synonym, antonym and correct word.
         
         Parameters
         ---------- 
-        - text : str - text with words for exercise
+        - text : str or spacy Doc - text with words for exercise
         - pos : list() - array with parts' of speech names. Default variant contain noun, verb, advective and adverb
         - q_words : int - number of words that will be questioned   
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         
         Function has a problem: sometimes it returns too similar words
         """
         
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['select_word_syn_ant'])
+
         task_type = 'select_word_syn_ant'
         task_text = text
         task_object = []
@@ -193,12 +698,10 @@ class ExerciseGen():
 
         # Save all available words with type in 'pos' arg. Later will be choosen only 'q_words' number of words
         # For each token save into task_object: token text, the index of the beginning and ending of the token in the text
-        save_text = text
-        for token in self.__nlp(text):
+        for token in doc:
             if token.pos_ in pos:
-                index = save_text.find(token.text)
+                index = token.idx
                 task_object.append([token, index, index+len(token.text)])
-                save_text = save_text[:index] + '#'*len(token.text) + save_text[index+len(token.text):]
                 
         # If we found more than 1 word with questioned type, create an exercise
         if len(task_object) >= 1:
@@ -208,10 +711,9 @@ class ExerciseGen():
             task_object.sort(key=lambda x:x[1])
             
             # Replace all random choosen tokens with '_____'
-            lag = 0
+            task_text = self.mask_spans(text, [(index_start, index_end, '_____') 
+                                               for token, index_start, index_end in task_object])
             for token, index_start, index_end in task_object:
-                task_text = task_text[:index_start-lag] + '_____' + task_text[index_end-lag:]
-                lag += len(token.text) - 5 # because 5 underscores
                 task_answer.append(token.text)
                 task_result.append('')
             
@@ -222,9 +724,7 @@ class ExerciseGen():
                 token_new = token[0].lower()
 
                 # Find synonyms
-                synonyms = self.__model.similar_by_word(token_new)
-                synonyms = [ _[0] for _ in synonyms]
-                synonyms = [_.text for _ in self.__nlp(' '.join(synonyms)) if not _.is_stop]
+                synonyms = self.__content_words(token_new, 'syn')
                 try:
                     if synonyms[0] == token_new:
                         token.append(synonyms[1].title() if token[0].istitle() else synonyms[1])
@@ -234,9 +734,7 @@ class ExerciseGen():
                     pass
 
                 # Find antonyms
-                antonyms = self.__model.most_similar(positive=[token_new, 'bad'], negative=['good'])
-                antonyms = [ _[0] for _ in antonyms]
-                antonyms = [_.text for _ in self.__nlp(' '.join(antonyms)) if not _.is_stop]
+                antonyms = self.__content_words(token_new, 'ant')
                 try:
                     if antonyms[0] == token_new or antonyms[0].title() == token[1] or antonyms[0] == token[1]:
                         token.append(antonyms[1].title() if token[0].istitle() else antonyms[1])
@@ -249,22 +747,21 @@ class ExerciseGen():
                 
         # If there are no words with type in 'pos' array, return empty exercise
         else:
-            task_object = np.nan
-            task_options = np.nan
-            task_answer = np.nan
-            task_result = np.nan
-            task_description = np.nan
-
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-                }
+            task_object = EMPTY
+            task_options = EMPTY
+            task_answer = EMPTY
+            task_result = EMPTY
+            task_description = EMPTY
+
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
 
     def select_word_adj(self, text, q_words=1):
@@ -272,16 +769,19 @@ class ExerciseGen():
 
         Parameters
         ----------  
-        - text: text with words for exercise
+        - text: text (str or parsed spacy Doc) with words for exercise
         - q_words: number of words that will be questioned 
 
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         """
 
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['select_word_adj'])
+
         task_text = text
         task_type = 'select_word_adj'
         task_object = []
@@ -292,16 +792,11 @@ class ExerciseGen():
         
         # Save all available adjectives with 3 form available. Later will be choosen only 'q_words' number of words
         # For each token save into task_object: token text, the index of the beginning and ending of the token in the text
-        save_text = text
-        for token in self.__nlp(text):
+        for token in doc:
             # Find adjective with 3 available forms
-            if (token.pos_=='ADJ' and 
-                token._.inflect('JJ') != None and 
-                token._.inflect('JJR') != None and 
-                token._.inflect('JJS') != None):
-                index = save_text.find(token.text)
+            if token.pos_=='ADJ' and all(tag in self.__inflections(token) for tag in inflections.ADJ_TAGS):
+                index = token.idx
                 task_object.append([token, index, index+len(token.text)])
-                save_text = save_text[:index] + '#'*len(token.text) + save_text[index+len(token.text):]
         
         # If we found more than 1 word with questioned type, create an exercise
         if len(task_object) > 0:
@@ -311,42 +806,38 @@ class ExerciseGen():
             task_object.sort(key=lambda x:x[1])
             
             # Replace all random choosen tokens with '_____'
-            lag = 0
+            task_text = self.mask_spans(text, [(index_start, index_end, '_____') 
+                                               for token, index_start, index_end in task_object])
             for token, index_start, index_end in task_object:
-                task_text = task_text[:index_start-lag] + '_____' + task_text[index_end-lag:]
-                lag += len(token.text) - 5 # because 5 underscores
                 task_answer.append(token.text)
                 task_result.append('')
             
             task_object = [token for token, index_start, index_end in task_object]
             
             for token in task_object:
-                task_adv_options = []
-                task_adv_options.append(token._.inflect('JJ'))  # JJ      Adjective
-                task_adv_options.append(token._.inflect('JJR')) # JJR     Adjective, comparative
-                task_adv_options.append(token._.inflect('JJS')) # JJS     Adjective, superlative
-                task_options.append(task_adv_options)
+                # JJ - adjective, JJR - comparative, JJS - superlative
+                forms = self.__inflections(token)
+                task_options.append([forms[tag] for tag in inflections.ADJ_TAGS])
             
             task_object = [token.text for token in task_object]
 
         # If text do not contain adjective with 3 available forms, return empty exercise
         else:
-            task_object = np.nan
-            task_options = np.nan
-            task_answer = np.nan
-            task_result = np.nan
-            task_description = np.nan
-
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-                }
+            task_object = EMPTY
+            task_options = EMPTY
+            task_answer = EMPTY
+            task_result = EMPTY
+            task_description = EMPTY
+
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
 
     def select_word_verb(self, text, q_words=2):
@@ -354,16 +845,19 @@ class ExerciseGen():
         
         Parameters
         ---------- 
-        - text: text with words for exercise
+        - text: text (str or parsed spacy Doc) with words for exercise
         - q_words: number of words that will be questioned
         
         Returns
         ------- 
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         """
         
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['select_word_verb'])
+
         task_type = 'select_word_verb'
         task_text = text
         task_object = []
@@ -374,12 +868,10 @@ class ExerciseGen():
         
         # Save all available verbs. Later will be choosen only 'q_words' number of words
         # For each token save into task_object: token text, the index of the beginning and ending of the token in the text
-        save_text = text
-        for token in self.__nlp(text):
+        for token in doc:
             if token.pos_=='VERB':
-                index = save_text.find(token.text)
+                index = token.idx
                 task_object.append([token, index, index+len(token.text)])
-                save_text = save_text[:index] + '#'*len(token.text) + save_text[index+len(token.text):]
                 
         # If we found more than 1 word with questioned type, create an exercise
         if len(task_object) > 0:
@@ -389,10 +881,9 @@ class ExerciseGen():
             task_object.sort(key=lambda x:x[1])
             
             # Replace all random choosen tokens with '_____'
-            lag = 0
+            task_text = self.mask_spans(text, [(index_start, index_end, '_____') 
+                                               for token, index_start, index_end in task_object])
             for token, index_start, index_end in task_object:
-                task_text = task_text[:index_start-lag] + '_____' + task_text[index_end-lag:]
-                lag += len(token.text) - 5 # because 5 underscores
                 task_answer.append(token.text)
                 task_result.append('')
             
@@ -400,7 +891,8 @@ class ExerciseGen():
             
             for token in task_object:
                 task_adv_options = []
-                for i in ['VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ', 'MD']:
+                forms = self.__inflections(token)
+                for i in inflections.VERB_TAGS:
                     # VB      Verb, base form
                     # VBD     Verb, past tense
                     # VBG     Verb, gerund or present participle
@@ -408,29 +900,28 @@ class ExerciseGen():
                     # VBP     Verb, non-3rd person singular present
                     # VBZ     Verb, 3rd person singular present
                     # MD      Modal
-                    if token._.inflect(i) not in task_adv_options and token._.inflect(i) != None:
-                        task_adv_options.append(token._.inflect(i)) 
+                    if i in forms and forms[i] not in task_adv_options:
+                        task_adv_options.append(forms[i]) 
                 task_options.append(task_adv_options)
             
             task_object = [token.text for token in task_object]
 
         if task_object == []:
-            task_object = np.nan
-            task_options = np.nan
-            task_answer = np.nan
-            task_result = np.nan
-            task_description = np.nan
-
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-                }
+            task_object = EMPTY
+            task_options = EMPTY
+            task_answer = EMPTY
+            task_result = EMPTY
+            task_description = EMPTY
+
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
     
     def select_sent_word(self, text, pos=['NOUN', 'VERB', 'ADV', 'ADJ'], q_words=1):
@@ -439,19 +930,22 @@ class ExerciseGen():
         
         Parameters
         ---------- 
-        - text: text with words for exercise
+        - text: text (str or parsed spacy Doc) with words for exercise
         - pos: array with parts' of speech names
         - q_words: number of words that will be questioned        
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         
         Function has a problem: sometimes it returns too similar words
         """
         
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['select_sent_word'])
+
         task_type = 'select_sent_word'
         task_text = text
         task_object = [text]
@@ -461,15 +955,15 @@ class ExerciseGen():
         task_description = 'Выберите правильное предложение'
         
         # Save all tokens and their beginning and ending index
-        save_text = text
         tokens = []
-        for token in self.__nlp(text):
+        for token in doc:
             if token.pos_ in pos:
-                index = save_text.find(token.text)
+                index = token.idx
                 tokens.append([token, index, index+len(token.text)])
-                save_text = save_text[:index] + '#'*len(token.text) + save_text[index+len(token.text):]
                   
         # If we found more than 1 token, create an exercise. If text is too long, the full text will exceed max size of window, so we create an exercise only for short texts
+        synonym_spans = []
+        antonym_spans = []
         if len(tokens) > 0 and len(text) < 100:
             
             # Choose random elements in quantity 'q_words'
@@ -477,46 +971,44 @@ class ExerciseGen():
             tokens.sort(key=lambda x:x[1])
             
             # Create 2nd sentence with synonyms and 3rd sentence with antonyms
-            second_sentence = text
-            scnd_lag = 0
-            third_sentence = text
-            thrd_lag = 0
             i=5
             for token, start_index, end_index in tokens:
-                m, n = np.random.randint(0, i, 2)
-                synonym = self.__model.most_similar(token.text.lower(), topn=i)[m][0]
+                synonyms = self.__synonyms(token.text.lower(), topn=i)
+                antonyms = self.__antonyms(token.text.lower(), topn=i)
+                # Search could return less than i words, so random positions depend on the number of found words
+                if len(synonyms) == 0 or len(antonyms) == 0:
+                    continue
+                m, n = np.random.randint(0, [len(synonyms), len(antonyms)])
+                synonym = synonyms[m][0]
                 synonym = synonym.title() if token.text.istitle() else synonym
-                second_sentence = second_sentence[:start_index+scnd_lag] + synonym + second_sentence[end_index+scnd_lag:]
-                scnd_lag += len(synonym) - len(token.text)
+                synonym_spans.append((start_index, end_index, synonym))
                 
-                antonym = self.__model.most_similar(positive = [token.text.lower(), 'bad'],
-                                                negative = ['good'],
-                                                topn=i)[n][0]
+                antonym = antonyms[n][0]
                 antonym = antonym.title() if token.text.istitle() else antonym
-                third_sentence = third_sentence[:start_index+thrd_lag] + antonym + third_sentence[end_index+thrd_lag:]
-                thrd_lag += len(antonym) - len(token.text)
-            
-            task_options.append(second_sentence)
-            task_options.append(third_sentence)
+                antonym_spans.append((start_index, end_index, antonym))
+        
+        # Options are created only if some words were replaced, otherwise all options would be the same sentence
+        if len(synonym_spans) > 0:
+            task_options.append(self.mask_spans(text, synonym_spans))
+            task_options.append(self.mask_spans(text, antonym_spans))
             random.shuffle(task_options)
 
         else:
-            task_object = np.nan
-            task_options = np.nan
-            task_answer = np.nan
-            task_result = np.nan
-            task_description = np.nan
-
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-                }
+            task_object = EMPTY
+            task_options = EMPTY
+            task_answer = EMPTY
+            task_result = EMPTY
+            task_description = EMPTY
+
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
     
     def select_sent_adj(self, text, q_words=1):
@@ -524,16 +1016,19 @@ class ExerciseGen():
         
         Parameters
         ---------- 
-        - text: text with words for exercise
+        - text: text (str or parsed spacy Doc) with words for exercise
         - q_words: number of words that will be questioned        
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         """
         
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['select_sent_adj'])
+
         task_type = 'select_sent_adj'
         task_text = text
         task_object = [text]
@@ -543,17 +1038,12 @@ class ExerciseGen():
         task_description = 'Выберите предложение с правильной формой прилагательного'
         
         # Save all verbs and their beginning and ending index
-        save_text = text
         adjs = []
-        for token in self.__nlp(text):
+        for token in doc:
             # Find adjective with 3 available forms
-            if (token.pos_=='ADJ' and 
-                token._.inflect('JJ') != None and 
-                token._.inflect('JJR') != None and 
-                token._.inflect('JJS') != None):
-                index = save_text.find(token.text)
+            if token.pos_=='ADJ' and all(tag in self.__inflections(token) for tag in inflections.ADJ_TAGS):
+                index = token.idx
                 adjs.append([token, index, index+len(token.text)])
-                save_text = save_text[:index] + '#'*len(token.text) + save_text[index+len(token.text):]
         
         # If we found more than 1 verb, create an exercise. If text is too long, the full text will exceed max size of window, so we create an exercise only for short texts
         if len(adjs) > 0 and len(text) < 100:
@@ -565,45 +1055,43 @@ class ExerciseGen():
             adj_forms = []
             for token, start_index, end_index in adjs:
                 token_adj_forms = []
-                for j in ['JJ', 'JJR', 'JJS']:
+                forms = self.__inflections(token)
+                for j in inflections.ADJ_TAGS:
                     # JJ      Adjective
                     # JJR     Adjective, comparative
                     # JJS     Adjective, superlative
-                    if token._.inflect(j) != token.text and token._.inflect(j) != None and token._.inflect(j) not in token_adj_forms:
-                        token_adj_forms.append(token._.inflect(j))
+                    if j in forms and forms[j] != token.text and forms[j] not in token_adj_forms:
+                        token_adj_forms.append(forms[j])
                 adj_forms.append(token_adj_forms)
             
             for _ in range(2):
                 new_word_1 = []
-                new_sent_1 = text
-                lag = 0
+                new_spans = []
                 for i, adj in enumerate(adjs):
                     token, start_index, end_index = adj
                     new_word_1.append(random.choice(adj_forms[i]))
                     adj_forms[i].remove(new_word_1[i])
                     new_word_1[i].title() if token.text.istitle() else new_word_1[i]
-                    new_sent_1 = new_sent_1[:start_index-lag] + new_word_1[i] + new_sent_1[end_index-lag:]
-                    lag += len(token.text) - len(new_word_1[i])
-                task_options.append(new_sent_1)
+                    new_spans.append((start_index, end_index, new_word_1[i]))
+                task_options.append(self.mask_spans(text, new_spans))
             random.shuffle(task_options)
             
         else:
-            task_object = np.nan
-            task_options = np.nan
-            task_answer = np.nan
-            task_result = np.nan
-            task_description = np.nan
-
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-                }
+            task_object = EMPTY
+            task_options = EMPTY
+            task_answer = EMPTY
+            task_result = EMPTY
+            task_description = EMPTY
+
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
     
     def select_sent_verb(self, text, q_words=1):
@@ -611,16 +1099,19 @@ class ExerciseGen():
         
         Parameters
         ---------- 
-        - text: text with words for exercise
+        - text: text (str or parsed spacy Doc) with words for exercise
         - q_words: number of words that will be questioned        
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         """
         
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['select_sent_verb'])
+
         task_type = 'select_sent_verb'
         task_text = text
         task_object = [text]
@@ -630,13 +1121,11 @@ class ExerciseGen():
         task_description = 'Выберите предложение с правильной формой глагола'
         
         # Save all verbs and their beginning and ending index
-        save_text = text
         verbs = []
-        for token in self.__nlp(text):
+        for token in doc:
             if token.pos_=='VERB':
-                index = save_text.find(token.text)
+                index = token.idx
                 verbs.append([token, index, index+len(token.text)])
-                save_text = save_text[:index] + '#'*len(token.text) + save_text[index+len(token.text):]
         
         # If we found more than 1 verb, create an exercise. If text is too long, the full text will exceed max size of window, so we create an exercise only for short texts
         if len(verbs) > 0 and len(text) < 100:
@@ -648,7 +1137,8 @@ class ExerciseGen():
             verb_forms = []
             for token, start_index, end_index in verbs:
                 token_verb_forms = []
-                for j in ['VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ', 'MD']:
+                forms = self.__inflections(token)
+                for j in inflections.VERB_TAGS:
                     # VB      Verb, base form
                     # VBD     Verb, past tense
                     # VBG     Verb, gerund or present participle
@@ -656,41 +1146,38 @@ class ExerciseGen():
                     # VBP     Verb, non-3rd person singular present
                     # VBZ     Verb, 3rd person singular present
                     # MD      Modal
-                    if token._.inflect(j) != token.text and token._.inflect(j) != None and token._.inflect(j) not in token_verb_forms:
-                        token_verb_forms.append(token._.inflect(j))
+                    if j in forms and forms[j] != token.text and forms[j] not in token_verb_forms:
+                        token_verb_forms.append(forms[j])
                 verb_forms.append(token_verb_forms)
             
             for _ in range(2):
                 new_word_1 = []
-                new_sent_1 = text
-                lag = 0
+                new_spans = []
                 for i, verb in enumerate(verbs):
                     token, start_index, end_index = verb
                     new_word_1.append(random.choice(verb_forms[i]))
                     verb_forms[i].remove(new_word_1[i])
                     new_word_1[i].title() if token.text.istitle() else new_word_1[i]
-                    new_sent_1 = new_sent_1[:start_index-lag] + new_word_1[i] + new_sent_1[end_index-lag:]
-                    lag += len(token.text) - len(new_word_1[i])
-                task_options.append(new_sent_1)
+                    new_spans.append((start_index, end_index, new_word_1[i]))
+                task_options.append(self.mask_spans(text, new_spans))
             random.shuffle(task_options)
             
         else:
-            task_object = np.nan
-            task_options = np.nan
-            task_answer = np.nan
-            task_result = np.nan
-            task_description = np.nan
-
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-                }
+            task_object = EMPTY
+            task_options = EMPTY
+            task_answer = EMPTY
+            task_result = EMPTY
+            task_description = EMPTY
+
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
         
     
     def select_memb_groups(self, text, q_words=1):
@@ -698,16 +1185,19 @@ class ExerciseGen():
         
         Parameters
         ---------- 
-        - text: text with words for exercise
+        - text: text (str or parsed spacy Doc) with words for exercise
         - q_words: number of text parts that will be questioned        
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         """
         
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['select_memb_groups'])
+
         task_type = 'select_memb_groups'
         task_text = text
         task_object = []
@@ -717,11 +1207,9 @@ class ExerciseGen():
         task_description = 'Определите, чем является выделенное словосочетание'
         
         # Save all chunks
-        save_text = text
-        for chunk in self.__nlp(text).noun_chunks:
-            index = save_text.find(chunk.text)
+        for chunk in doc.noun_chunks:
+            index = chunk.start_char
             task_object.append([chunk, index, index+len(chunk.text)])
-            save_text = save_text[:index] + '#'*len(chunk.text) + save_text[index+len(chunk.text):]
 
         # Text must have more than one chuck
         if len(task_object) > 1:
@@ -731,10 +1219,9 @@ class ExerciseGen():
             task_object.sort(key=lambda x:x[1])
             
             # Highlight chunk in bold
-            lag = 0
+            task_text = self.mask_spans(text, [(index_start, index_end, '**' + chunk.text + '**')
+                                               for chunk, index_start, index_end in task_object])
             for chunk, index_start, index_end in task_object:
-                task_text = task_text[:index_start+lag] + '**' + task_text[index_start+lag:index_end+lag]+ '**' + task_text[index_end+lag:]
-                lag += 4 # because 4 asterisks
                 task_answer.append(spacy.explain(chunk.root.dep_))
                 task_options.append('')
                 task_result.append('')
@@ -767,22 +1254,21 @@ class ExerciseGen():
 
             # If text has only one chunk, return empty exercise
         else:
-            task_object = np.nan
-            task_options = np.nan
-            task_answer = np.nan
-            task_result = np.nan
-            task_description = np.nan
-
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-                }
+            task_object = EMPTY
+            task_options = EMPTY
+            task_answer = EMPTY
+            task_result = EMPTY
+            task_description = EMPTY
+
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
     
     def fill_words_in_the_gaps(self, text, pos=['NOUN', 'VERB', 'ADV', 'ADJ'], q_words=1, hint=True):
@@ -790,18 +1276,21 @@ class ExerciseGen():
         
         Parameters
         ---------- 
-        - text: text with words for exercise
+        - text: text (str or parsed spacy Doc) with words for exercise
         - pos: array with parts' of speech names
         - q_words: number of words that will be questioned
         - hint: if True, first letter of missing word will be shown. If False - first letter will be hidden
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         """
         
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['fill_words_in_the_gaps'])
+
         task_type = 'fill_words_in_the_gaps'
         task_text = text     
         task_object = []     
@@ -811,13 +1300,11 @@ class ExerciseGen():
         task_description = 'Заполните пропущенное слово (вместе с первой буквой, если была использована подсказка)'
         
         # Save all tokens and their beginning and ending index
-        save_text = text
         tokens = []
-        for token in self.__nlp(text):
+        for token in doc:
             if token.pos_ in pos:
-                index = save_text.find(token.text)
+                index = token.idx
                 tokens.append([token, index, index+len(token.text)])
-                save_text = save_text[:index] + '#'*len(token.text) + save_text[index+len(token.text):]
         
         # If we found more than q_words+3 tokens, create an exercise. If there will be less than q_words+3 tokens, it would be hard to guess words
         if len(tokens) > q_words+3:
@@ -826,42 +1313,38 @@ class ExerciseGen():
             tokens = random.sample(tokens, k=min(q_words, len(tokens)))
             tokens.sort(key=lambda x:x[1])
             
-            lag = 0
-            task_text = text
+            spans = []
             for token, start_index, end_index in tokens:
                 task_object.append(token.text)
                 task_answer.append(token.text)
                 task_result.append('')
                 
                 if hint:
-                    task_text = task_text[:start_index-lag] + token.text[0] + '_____' + task_text[end_index-lag:]
-                    lag += len(token.text) - 6
+                    spans.append((start_index, end_index, token.text[0] + '_____'))
                 else:
-                    task_text = task_text[:start_index-lag] + '_____' + task_text[end_index-lag:]
-                    lag += len(token.text) - 5
+                    spans.append((start_index, end_index, '_____'))
+            task_text = self.mask_spans(text, spans)
 
         else:
-            return {'raw' : text,
-                    'task_type' : task_type,
-                    'task_text' : text,
-                    'task_object' : np.nan,
-                    'task_options' : np.nan,
-                    'task_answer' : np.nan,
-                    'task_result' : np.nan,
-                    'task_description' : np.nan,
-                    'task_total': np.nan
-                   }
-        
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-               }
+            return ExerciseRecord(raw=text,
+                                  task_type=task_type,
+                                  task_text=text,
+                                  task_object=EMPTY,
+                                  task_options=EMPTY,
+                                  task_answer=EMPTY,
+                                  task_result=EMPTY,
+                                  task_description=EMPTY,
+                                  task_total=EMPTY)
+        
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
     
     def listening_fill_chunks(self, text, q_words=1):
@@ -869,18 +1352,21 @@ class ExerciseGen():
         
         Parameters
         ---------- 
-        - text: text with chunks for exercise
+        - text: text (str or parsed spacy Doc) with chunks for exercise
         - q_words: number of chunks that will be questioned        
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         
         Function has a problem: sometimes it returns too similar words
         """
         
+        # Parse text only if it was not parsed before
+        text, doc = self.__get_doc(text, EXERCISE_COMPONENTS['listening_fill_chunks'])
+
         task_type = 'listening_fill_chunks'
         task_text = text     
         task_object = []     
@@ -890,11 +1376,9 @@ class ExerciseGen():
         task_description = 'Прослушайте аудиозапись и заполните пропущенное словосочетание'
         
         # Save all chunks
-        save_text = text
-        for chunk in self.__nlp(text).noun_chunks:
-            index = save_text.find(chunk.text)
+        for chunk in doc.noun_chunks:
+            index = chunk.start_char
             task_object.append([chunk, index, index+len(chunk.text)])
-            save_text = save_text[:index] + '#'*len(chunk.text) + save_text[index+len(chunk.text):]
         
         # If we found more than 1 chunk, create an exercise. If there will be less than 1 chunk, it would be hard to guess words
         if len(task_object) > 1:
@@ -903,39 +1387,35 @@ class ExerciseGen():
             task_object = random.sample(task_object, k=min(q_words, len(task_object)))
             task_object.sort(key=lambda x:x[1])
             
-            lag = 0
-            task_text = text
+            task_text = self.mask_spans(text, [(start_index, end_index, '_____') 
+                                               for chunk, start_index, end_index in task_object])
             for chunk, start_index, end_index in task_object:
                 task_answer.append(chunk.text)
                 task_result.append('')
-                task_text = task_text[:start_index-lag] + '_____' + task_text[end_index-lag:]
-                lag += len(chunk.text) - 5
             
             task_object = [chunk.text for chunk, start_index, end_index in task_object]
 
         # If text has only one chunk, return empty exercise
         else:
-            return {'raw' : text,
-                    'task_type' : task_type,
-                    'task_text' : text,
-                    'task_object' : np.nan,
-                    'task_options' : np.nan,
-                    'task_answer' : np.nan,
-                    'task_result' : np.nan,
-                    'task_description' : np.nan,
-                    'task_total': np.nan
-                   }
-        
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-               }
+            return ExerciseRecord(raw=text,
+                                  task_type=task_type,
+                                  task_text=text,
+                                  task_object=EMPTY,
+                                  task_options=EMPTY,
+                                  task_answer=EMPTY,
+                                  task_result=EMPTY,
+                                  task_description=EMPTY,
+                                  task_total=EMPTY)
+        
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
     
     def set_word_order(self, text):
@@ -943,15 +1423,18 @@ class ExerciseGen():
         
         Parameters
         ---------- 
-        - text: text with words for exercise  
+        - text: text (str or parsed spacy Doc) with words for exercise  
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : List(), 'task_object' : List(), 'task_options' : List(), 
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : List(), 'task_object' : List(), 'task_options' : Tuple(), 
          'task_answer' : List(), 'task_result' : List(), 'task_description' : str, 'task_total': int}
         """
         
+        # Spacy Doc is accepted too, but this exercise needs only its text
+        text = text.text if isinstance(text, Doc) else text
+
         task_type = 'set_word_order'
         task_text = text.split(' ')
         random.shuffle(task_text)
@@ -963,23 +1446,22 @@ class ExerciseGen():
        
         # Do not generate exersice if there to small or too large number of words
         if  len(task_text) < 3 or len(task_text) > 10:
-            task_text = np.nan
-            task_object = np.nan
-            task_options = np.nan
-            task_answer = np.nan
-            task_result = np.nan
-            task_description = np.nan
-
-        return {'raw' : text,
-                'task_type' : task_type,
-                'task_text' : task_text,
-                'task_object' : task_object,
-                'task_options' : task_options,
-                'task_answer' : task_answer,
-                'task_result' : task_result,
-                'task_description' : task_description,
-                'task_total': 0
-                }
+            task_text = EMPTY
+            task_object = EMPTY
+            task_options = EMPTY
+            task_answer = EMPTY
+            task_result = EMPTY
+            task_description = EMPTY
+
+        return ExerciseRecord(raw=text,
+                              task_type=task_type,
+                              task_text=task_text,
+                              task_object=task_object,
+                              task_options=task_options,
+                              task_answer=task_answer,
+                              task_result=task_result,
+                              task_description=task_description,
+                              task_total=0)
     
     
     def sent_with_no_exercises(self, text):
@@ -988,27 +1470,247 @@ class ExerciseGen():
         
         Parameters
         ----------  
-        - text: text to show on display        
+        - text: text (str or parsed spacy Doc) to show on display        
         
         Returns
         -------
-        dictionary:
-        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : np.nan, 'task_options' : np.nan, 
-         'task_answer' : np.nan, 'task_result' : np.nan, 'task_description' : np.nan, 'task_total': int}
+        ExerciseRecord:
+        {'raw' : str, 'task_type' : str, 'task_text' : str, 'task_object' : EMPTY, 'task_options' : EMPTY, 
+         'task_answer' : EMPTY, 'task_result' : EMPTY, 'task_description' : str, 'task_total': EMPTY}
         """
         
-        return {'raw' : text,
-                'task_type' : 'sent_with_no_exercises',
-                'task_text' : text,
-                'task_object' : np.nan,
-                'task_options' : np.nan,
-                'task_answer' : np.nan,
-                'task_result' : np.nan,
-                'task_description' : 'Предложение без упражнения',
-                'task_total': np.nan
-                }
+        # Spacy Doc is accepted too, but this exercise needs only its text
+        text = text.text if isinstance(text, Doc) else text
+
+        return ExerciseRecord(raw=text,
+                              task_type='sent_with_no_exercises',
+                              task_text=text,
+                              task_object=EMPTY,
+                              task_options=EMPTY,
+                              task_answer=EMPTY,
+                              task_result=EMPTY,
+                              task_description='Предложение без упражнения',
+                              task_total=EMPTY)
     
 
+    def eligible_exercises(self, 
+                           text, 
+                           list_of_exercises=[True, True, True, True, True, True, True, True, True, True], 
+                           q_words=[1, 1, 1, 1, 1, 1, 1, 1, 1]):
+        """Return exercise types, which could be created for the text. Only cheap checks are used: 
+        parts of speech, number of noun chunks and text length. Embeddings and inflections are not used, 
+        so the generator of eligible type still could return empty exercise
+        
+        Parameters
+        ----------
+        - text: text (str or parsed spacy Doc)
+        - list_of_exercises: list with bools, see create_lesson()
+        - q_words: number of words/chunks to replace in original text, see create_lesson()
+        
+        Returns
+        -------
+        list with exercise types from EXERCISE_TYPES
+        """
+
+        text, doc = self.__get_doc(text, self.needed_components(list_of_exercises))
+
+        n_words = sum(token.pos_ in ['NOUN', 'VERB', 'ADJ', 'ADV'] for token in doc)
+        has_adj = any(token.pos_ == 'ADJ' for token in doc)
+        has_verb = any(token.pos_ == 'VERB' for token in doc)
+        # Noun chunks are needed only for two exercise types
+        n_chunks = len(list(doc.noun_chunks)) if list_of_exercises[6] or list_of_exercises[8] else 0
+        n_split = len(text.split(' '))
+
+        checks = [n_words > 0,                          # select_word_syn_ant
+                  has_adj,                              # select_word_adj
+                  has_verb,                             # select_word_verb
+                  n_words > 0 and len(text) < 100,      # select_sent_word
+                  has_adj and len(text) < 100,          # select_sent_adj
+                  has_verb and len(text) < 100,         # select_sent_verb
+                  n_chunks > 1,                         # select_memb_groups
+                  n_words > q_words[7]+3,               # fill_words_in_the_gaps
+                  n_chunks > 1,                         # listening_fill_chunks
+                  3 <= n_split <= 10]                   # set_word_order
+
+        return [ex_type for ex_type, enabled, check in zip(EXERCISE_TYPES, list_of_exercises, checks) if enabled and check]
+
+
+    def __generate(self, ex_type, doc, q_words):
+        """Create exercise of given type with generator of the same name"""
+
+        with self.metrics.timer('exercise/' + ex_type):
+            if ex_type == 'set_word_order':
+                task = self.set_word_order(doc)
+            else:
+                task = getattr(self, ex_type)(doc, q_words=q_words[EXERCISE_TYPES.index(ex_type)])
+        self.metrics.count(('empty/' if task.is_empty else 'exercises/') + ex_type)
+        return task
+
+
+    def iter_lesson(self, 
+                    df, 
+                    start_row=1, 
+                    q_task=20, 
+                    list_of_exercises=[True, True, True, True, True, True, True, True, True, True], 
+                    q_words=[1, 1, 1, 1, 1, 1, 1, 1, 1], 
+                    planned=True, 
+                    first_window=4):
+        """Generate english lesson sentence by sentence. Exercises are yielded as soon as they are created, 
+        so the first exercises could be shown while the next ones are still generated. 
+        Generation stops as soon as q_task sentences have exercises.
+        
+        Parameters
+        ----------  
+        - df: dataframe, which contains only text and row_number
+        - start_row: the number of first sentence to start exercise generator
+        - q_task: task quantity
+        - list_of_exercises: list with bools, see create_lesson()
+        - q_words: number of words/chunks to replace in original text 
+        - planned: if True, one exercise is created for every sentence, like in create_planned_lesson(). 
+        If False, all available exercises are created for every sentence, like in create_lesson()
+        - first_window: number of sentences parsed in the first batch. Every next batch is twice bigger, 
+        but no bigger than the number of missing exercises
+        
+        Yields
+        ------
+        ExerciseRecord() objects with exercises and row numbers
+        """
+        
+        start_row = min(start_row, len(df)-1)
+        q_task = min(q_task, len(df)-start_row)
+        
+        rows = ((df.loc[j, 'row_num'], df.loc[j, 'raw']) for j in range(start_row-1, len(df)))
+        try:
+            yield from self.__iter_rows_lesson(rows, q_task, list_of_exercises, q_words, planned, first_window)
+        finally:
+            # Sentences of the loaded text, which were parsed for the lesson, are saved into the text store
+            self.save_docs()
+    
+    
+    def iter_file_lesson(self, 
+                         file, 
+                         start_row=1, 
+                         q_task=20, 
+                         list_of_exercises=[True, True, True, True, True, True, True, True, True, True], 
+                         q_words=[1, 1, 1, 1, 1, 1, 1, 1, 1], 
+                         planned=True, 
+                         first_window=4, 
+                         buffer_size=256, 
+                         chunk_size=2**16):
+        """Generate english lesson from very big csv/text file like iter_lesson(), without loading the whole file. 
+        File is read by chunks (see stream_file()) only until q_task sentences have exercises, 
+        no more than buffer_size sentences are parsed at once, so memory does not depend on the size of file
+        
+        Parameters
+        ----------  
+        - file: csv or text file or path to it
+        - start_row: the number of first sentence to start exercise generator
+        - q_task: task quantity
+        - list_of_exercises: list with bools, see create_lesson()
+        - q_words: number of words/chunks to replace in original text 
+        - planned: see iter_lesson()
+        - first_window: number of sentences parsed in the first batch
+        - buffer_size: maximal number of sentences parsed in one batch
+        - chunk_size: number of chars (bytes for binary files) read from file at once
+        
+        Yields
+        ------
+        ExerciseRecord() objects with exercises and row numbers
+        """
+        
+        rows = itertools.islice(self.stream_file(file, chunk_size=chunk_size), start_row-1, None)
+        return self.__iter_rows_lesson(rows, q_task, list_of_exercises, q_words, planned, first_window, 
+                                       max_window=buffer_size)
+    
+    
+    def __iter_rows_lesson(self, rows, q_task, list_of_exercises, q_words, planned, first_window, max_window=None):
+        """Generate exercises for rows from iterator with tuples (row_num, sentence), see iter_lesson(). 
+        Rows are taken from iterator by windows, window is no bigger than max_window"""
+        
+        q_task_fact = 0
+        
+        # Only spacy components needed by enabled exercise types are run
+        components = self.needed_components(list_of_exercises)
+        
+        # Number of planned exercises of each type and number of sentences, where each type is available
+        counts = {ex_type: 0 for ex_type in EXERCISE_TYPES}
+        available = {ex_type: 0 for ex_type in EXERCISE_TYPES}
+        
+        window_size = first_window
+        while q_task_fact < q_task:
+            # Parse next sentences in one batch. One row gives no more than one task,
+            # so there is no need to parse more rows than the number of missing tasks
+            size = min(window_size, q_task - q_task_fact)
+            if max_window is not None:
+                size = min(size, max_window)
+            window_rows = list(itertools.islice(rows, size))
+            if len(window_rows) == 0:
+                break
+            window = [text for _, text in window_rows]
+            window_size *= 2
+            # Parsed sentences of the window. Every sentence is parsed once and shared by all exercise generators
+            docs = self.parse_sentences(window, docs={}, components=components)
+            
+            if planned:
+                # Plan exercise types for all sentences of the window
+                plans = []
+                for text in window:
+                    with self.metrics.timer('plan'):
+                        plan = self.eligible_exercises(docs[text], list_of_exercises, q_words)
+                    for ex_type in plan:
+                        available[ex_type] += 1
+                    plan.sort(key=lambda ex_type: (counts[ex_type], available[ex_type]))
+                    if len(plan) > 0:
+                        counts[plan[0]] += 1
+                    plans.append(plan)
+                
+                # Find synonyms and antonyms only for sentences, which will have exercises with them
+                self.prefetch_distractors([docs[text] for text, plan in zip(window, plans) 
+                                           if len(plan) > 0 and plan[0] in ['select_word_syn_ant', 'select_sent_word']])
+            else:
+                # All enabled exercise types are created for every sentence
+                plans = [[ex_type for ex_type, enabled in zip(EXERCISE_TYPES, list_of_exercises) if enabled]] * len(window)
+                
+                # Find synonyms and antonyms for all sentences of the window together
+                if list_of_exercises[0] or list_of_exercises[3]:
+                    self.prefetch_distractors([docs[text] for text in window])
+            
+            for j, (text, plan) in enumerate(zip(window, plans)):
+                doc = docs[text]
+                
+                if planned:
+                    # Try planned exercise type first and the next eligible types, if exercise is empty
+                    row_tasks = [self.sent_with_no_exercises(doc)]
+                    for ex_type in plan:
+                        new_task = self.__generate(ex_type, doc, q_words)
+                        if not new_task.is_empty:
+                            row_tasks = [new_task]
+                            break
+                    
+                    # If planned exercise is empty, correct counter of exercise types
+                    if len(plan) > 0 and row_tasks[0]['task_type'] != plan[0]:
+                        counts[plan[0]] -= 1
+                        if row_tasks[0]['task_type'] in counts:
+                            counts[row_tasks[0]['task_type']] += 1
+                else:
+                    row_tasks = [self.__generate(ex_type, doc, q_words) for ex_type in plan]
+                    row_tasks.append(self.sent_with_no_exercises(doc))
+                    # Delete all empty exercises
+                    row_tasks = [task for task in row_tasks if not task.is_empty]
+                
+                # If any exercise is available, add 1 to counter q_task_fact
+                if any(task['task_type'] != 'sent_with_no_exercises' for task in row_tasks):
+                    q_task_fact += 1
+                
+                # Add row number from original dataframe to save the original order
+                for task in row_tasks:
+                    task.row_num = window_rows[j][0]
+                    yield task
+                
+                if q_task_fact >= q_task:
+                    return
+    
+    
     def create_lesson(self, 
                       df, 
                       start_row=1, 
@@ -1033,61 +1735,10 @@ class ExerciseGen():
         pd.DataFrame with english exercises
         """
         
-        start_row = min(start_row, len(df)-1)
-        q_task = min(q_task, len(df)-start_row)
-        
-        q_task_fact = 0
-        lesson_tasks = pd.DataFrame(columns=['row_num', 'raw', 'task_type', 'task_text', 'task_object', 'task_options', 
-                                      'task_answer', 'task_result', 'task_description', 'task_total'])
-
-        # For each row in dataframe save all available exercises
-        for i in range(start_row-1, len(df)):
-            mark = 0
-            if q_task_fact < q_task:
-                row_tasks = pd.DataFrame(columns=['raw', 'task_type', 'task_text', 'task_object', 'task_options', 
-                                                  'task_answer', 'task_result', 'task_description', 'task_total'])
-                if list_of_exercises[0]:
-                    row_tasks.loc[mark] = self.select_word_syn_ant(df.loc[i, 'raw'], q_words=q_words[0])
-                    mark += 1
-                if list_of_exercises[1]:
-                    row_tasks.loc[mark] = self.select_word_adj(df.loc[i, 'raw'], q_words=q_words[1])
-                    mark += 1
-                if list_of_exercises[2]:
-                    row_tasks.loc[mark] = self.select_word_verb(df.loc[i, 'raw'], q_words=q_words[2])
-                    mark += 1
-                if list_of_exercises[3]:
-                    row_tasks.loc[mark] = self.select_sent_word(df.loc[i, 'raw'], q_words=q_words[3])
-                    mark += 1
-                if list_of_exercises[4]:
-                    row_tasks.loc[mark] = self.select_sent_adj(df.loc[i, 'raw'], q_words=q_words[4])
-                    mark += 1    
-                if list_of_exercises[5]:
-                    row_tasks.loc[mark] = self.select_sent_verb(df.loc[i, 'raw'], q_words=q_words[5])
-                    mark += 1
-                if list_of_exercises[6]:
-                    row_tasks.loc[mark] = self.select_memb_groups(df.loc[i, 'raw'], q_words=q_words[6])
-                    mark += 1
-                if list_of_exercises[7]:
-                    row_tasks.loc[mark] = self.fill_words_in_the_gaps(df.loc[i, 'raw'], q_words=q_words[7])
-                    mark += 1
-                if list_of_exercises[8]:
-                    row_tasks.loc[mark] = self.listening_fill_chunks(df.loc[i, 'raw'], q_words=q_words[8])
-                    mark += 1  
-                if list_of_exercises[9]:
-                    row_tasks.loc[mark] = self.set_word_order(df.loc[i, 'raw'])
-                    mark += 1
-                row_tasks.loc[mark] = self.sent_with_no_exercises(df.loc[i, 'raw'])
-                # Delete all empty exercises and add row number from original dataframe to save the original order
-                row_tasks = row_tasks[row_tasks['raw'].isna() == False]
-                row_tasks['row_num'] = df.loc[i, 'row_num']
-                row_tasks = row_tasks[row_tasks['task_description'].isna() == False]
-
-                # If any exercise is available, add 1 to counter q_task_fact
-                if len(row_tasks[row_tasks['task_type'] != 'sent_with_no_exercises']) != 0:
-                    q_task_fact += 1
-                lesson_tasks = pd.concat([lesson_tasks, row_tasks], ignore_index=True)
-
-        return lesson_tasks
+        # Exercises of all rows are collected into list and converted into dataframe only once at the end
+        lesson_tasks = list(self.iter_lesson(df, start_row, q_task, list_of_exercises, q_words, planned=False))
+        with self.metrics.timer('assembly'):
+            return records_to_frame(lesson_tasks)
     
     
     def create_default_lesson(self, df):
@@ -1109,6 +1760,8 @@ class ExerciseGen():
         # new_df = df[df['task_type'] != 'sent_with_no_exercises'].sample(frac=1).sort_values(by='row_num')
         # new_df = new_df.groupby('row_num').agg('first').reset_index()
         
+        start_time = time.perf_counter()
+        
         # New: returns exercise dataset with corrected exercise balance
         # Fact exercise quantity 
         q_task = len(df.loc[df['task_type'] != 'sent_with_no_exercises', 'row_num'].unique())
@@ -1121,37 +1774,128 @@ class ExerciseGen():
                         .reset_index(drop=True)
                         ['task_type'])
         
+        # Queue of candidate exercises for every type: positions in dataframe and row numbers in original order.
+        # Head of the queue is the first exercise of the type, which sentence is not used yet
+        queues = {ex_type: [] for ex_type in ex_types}
+        for position, (row_num, task_type) in enumerate(zip(df['row_num'], df['task_type'])):
+            if task_type in queues:
+                queues[task_type].append((position, row_num))
+        heads = {ex_type: 0 for ex_type in ex_types}
+        # Sentences, which already have an exercise
+        used_rows = set()
+        # Positions of selected exercises in dataframe
+        selected = []
+        
         # Pointer to walk around the array in circles
         pointer = 0
         # Fact exercise counter
         q_task_fact = 0
-        # Result dataframe
-        new_df = pd.DataFrame(columns=['row_num', 'raw', 'task_type', 'task_text', 'task_object', 'task_options', 
-                                       'task_answer', 'task_result', 'task_description', 'task_total'])
+        # Number of exercise types in a row without new variants
+        misses = 0
         
         # Fill dataframe
         while q_task_fact < q_task:
-            new_task = df[(~df['row_num'].isin(new_df['row_num'].unique())) & (df['task_type']==ex_types[pointer])].head(1)
+            ex_type = ex_types[pointer]
+            queue = queues[ex_type]
+            head = heads[ex_type]
+            while head < len(queue) and queue[head][1] in used_rows:
+                head += 1
             # If exercise is possible, add it to new_df. Or move pointer and add exercise with other type
-            if len(new_task) != 0:
-                new_df = pd.concat([new_df, new_task], ignore_index=True)
+            if head < len(queue):
+                position, row_num = queue[head]
+                selected.append(position)
+                used_rows.add(row_num)
+                head += 1
                 q_task_fact += 1
+                misses = 0
             # Exception, when no one new variant left, end cycle
             else:
-                new_tasks = df[(~df['row_num'].isin(new_df['row_num'].unique())) & (df['task_type'].isin(ex_types))]
-                if len(new_tasks) == 0:
+                misses += 1
+                if misses == len(ex_types):
                     q_task_fact = q_task
+            heads[ex_type] = head
             if pointer == len(ex_types)-1:
                 pointer = 0
             else:
                 pointer += 1
         
-        df_with_no_exer = df[~df['row_num'].isin(new_df['row_num'].unique())]
+        new_df = df.iloc[selected]
+        df_with_no_exer = df[~df['row_num'].isin(used_rows)]
         new_df = pd.concat([new_df, df_with_no_exer], ignore_index=True).sort_values('row_num').reset_index(drop=True)
 
+        self.metrics.add_time('balance', time.perf_counter() - start_time)
         return new_df
     
     
+    def create_planned_lesson(self, 
+                              df, 
+                              start_row=1, 
+                              q_task=20, 
+                              list_of_exercises=[True, True, True, True, True, True, True, True, True, True], 
+                              q_words=[1, 1, 1, 1, 1, 1, 1, 1, 1]):
+        """Create english lesson with one exercise for every sentence. Unlike create_lesson() + create_default_lesson(), 
+        exercise type is chosen before generation, using cheap checks from eligible_exercises(), 
+        and only the generator of the chosen type is called. If it returns empty exercise, the next type is tried.
+        The least used type is chosen for every sentence, rare types go before frequent ones, 
+        so the lesson has a balanced number of exercises of each type.
+        
+        Parameters
+        ----------  
+        - df: dataframe, which contains only text and row_number
+        - start_row: the number of first sentence to start exercise generator
+        - q_task: task quantity
+        - list_of_exercises: list with bools, see create_lesson()
+        - q_words: number of words/chunks to replace in original text 
+        
+        Returns
+        -------
+        pd.DataFrame with english exercises in the same format as create_default_lesson()
+        """
+        
+        lesson_tasks = list(self.iter_lesson(df, start_row, q_task, list_of_exercises, q_words, planned=True))
+        with self.metrics.timer('assembly'):
+            return records_to_frame(lesson_tasks)
+
+
+    def export_lesson(self, lesson, path, format=None, chunk_size=1000):
+        """Save lesson or graded results into JSONL or Parquet file by chunks. Options, answers and results
+        are saved as lists, not as strings. Stream of iter_lesson() could be saved without building a dataframe
+
+        Parameters
+        ----------
+        - lesson: dataframe with exercises or iterable with ExerciseRecord() objects
+        - path: path to file or binary file object
+        - format: 'jsonl' or 'parquet'. By default format is taken from file extension
+        - chunk_size: number of exercises in one chunk
+
+        Returns
+        -------
+        int with number of saved exercises
+        """
+
+        with self.metrics.timer('export'):
+            return lesson_io.write_lesson(lesson, path, format=format, chunk_size=chunk_size)
+
+
+    @staticmethod
+    def load_lesson(path, format=None):
+        """Load lesson, which was saved by export_lesson(). Spacy and gensim models are not used and
+        ExerciseGen() object is not needed: ExerciseGen.load_lesson(path), so pre-generated lessons
+        could be shown without text parsing
+
+        Parameters
+        ----------
+        - path: path to file or binary file object
+        - format: 'jsonl' or 'parquet'. By default format is taken from file extension
+
+        Returns
+        -------
+        pd.DataFrame with english exercises in the same format as create_default_lesson()
+        """
+
+        return lesson_io.read_lesson(path, format=format)
+
+
     def show_result_table(self, df):
         """Convert all columns in dataframe into str format and rename columns to show result table in streamlit. 
         
@@ -1172,46 +1916,79 @@ class ExerciseGen():
         return new_df
     
     
-    def show_result_by_task_type(self, df):
+    def grade_lesson(self, lesson, submissions=None):
+        """Grade answers of one or many users. Every gap is checked separately, so exercises with several gaps 
+        get partial score. Typed answers are compared without case and extra spaces (see grading.grade())
+        
+        Parameters
+        ---------- 
+        - lesson: dataframe, which contains english exercises (and answers in column 'task_result')
+        - submissions: answers of users: list with items like column 'task_result' of lesson or dictionary 
+        {name : answers}. By default column 'task_result' of lesson is graded
+        
+        Returns
+        -------
+        grading.GradeReport() object with tables 'gaps', 'tasks', 'by_type' and methods task_total(), summary()
+        """
+
+        with self.metrics.timer('grading'):
+            return grading.grade(lesson, submissions)
+
+
+    def show_result_by_task_type(self, df, report=None):
         """Return short result table with all available exercise type and score of correct answers
         
         Parameters
         ---------- 
         - df: dataframe, which contains english exercises with answers
+        - report: result of grade_lesson(). If it is None, column 'task_total' of df is used
         
         Returns
         -------
         pd.DataFrame with english test results
         """
         
-        new_df = (df[df['task_type'] != 'sent_with_no_exercises']
-                  .groupby('task_description')['task_total']
-                  .agg(['count', 'sum']))
+        if report is not None:
+            new_df = report.by_type[report.by_type['submission'] == report.names[0]].set_index('task_description').sort_index()
+            new_df = new_df.rename(columns={'tasks': 'count', 'score': 'sum'})[['count', 'sum']]
+        else:
+            new_df = (df[df['task_type'] != 'sent_with_no_exercises']
+                      .groupby('task_description')['task_total']
+                      .agg(['count', 'sum']))
         new_df['wrong_answers'] = new_df['count'] - new_df['sum']
-        new_df['result'] = new_df['sum'].astype('int').astype('str') + ' / ' + new_df['count'].astype('int').astype('str')
+        new_df['result'] = new_df['sum'].map(grading.format_score) + ' / ' + new_df['count'].astype('int').astype('str')
         new_df = new_df.sort_values(by='wrong_answers', ascending=False)
         new_df = new_df.drop(['count', 'sum', 'wrong_answers'], axis=1).reset_index()
         new_df.columns = ['Тип упражнения', 'Результат']
         return new_df
     
     
-    def result_interpretation(self, df):
+    def result_interpretation(self, df, report=None):
         """Return string with result interpretation
         
         Parameters
         ---------- 
         - df: dataframe, which contains english exercises with answers
+        - report: result of grade_lesson(). If it is None, column 'task_total' of df is used
         
         Returns
         -------
         str with result interpretation
         """
         
-        correct_cnt = int(df['task_total'].sum())
-        all_cnt = int(df.loc[df['task_type'] != 'sent_with_no_exercises', 'task_total'].count())
+        if report is not None:
+            tasks = report.tasks[report.tasks['submission'] == report.names[0]]
+            correct_cnt = tasks['score'].sum()
+            all_cnt = len(tasks)
+            task_with_mistakes = tasks.loc[tasks['score'] < 1, 'task_description'].unique()
+        else:
+            tasks = df[df['task_type'] != 'sent_with_no_exercises']
+            correct_cnt = df['task_total'].sum()
+            all_cnt = int(tasks['task_total'].count())
+            task_with_mistakes = tasks.loc[tasks['task_total'] < 1, 'task_description'].unique()
         correct_prop = round(correct_cnt / all_cnt * 100, 0)
         
-        result_info = ('Ваш результат: ' + str(correct_cnt) + ' / ' + str(all_cnt) + ' (' + str(correct_prop) + '%)')
+        result_info = ('Ваш результат: ' + grading.format_score(correct_cnt) + ' / ' + str(all_cnt) + ' (' + str(correct_prop) + '%)')
         result_comment = ''
         if correct_prop == 100:
             result_comment = 'А как записаться к вам на урок английского? 🤓'
@@ -1223,10 +2000,9 @@ class ExerciseGen():
             result_comment = 'Стоит повторить несколько тем 🤔'
         
         result_mistakes = ''
-        if correct_cnt != all_cnt:
-            task_with_mistakes = str(df.loc[(df['task_total'] == 0) & (df['task_type'] != 'sent_with_no_exercises'), 'task_description'].unique())
+        if len(task_with_mistakes) > 0:
             result_mistakes = ('Ошибки были в упражнениях следующих типов: ' + 
-                               task_with_mistakes + 
+                               str(task_with_mistakes) + 
                                '. В следующий раз попробуй сделать упор именно на такие упражнения')
         
         return result_info, result_comment, result_mistakes
@@ -0,0 +1,257 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from lesson_io import WORD_LIST_TYPES
+
+
+# Exercise types with answers typed by user. Their answers are compared without case and extra spaces
+FREE_TEXT_TYPES = ['fill_words_in_the_gaps', 'listening_fill_chunks']
+
+# Separator of words in answers of set_word_order
+WORD_SEPARATOR = '\x1f'
+
+
+def join_words(values):
+    """Join lists of words (answers of set_word_order) into strings with WORD_SEPARATOR.
+    Strings are kept, other values become empty strings
+
+    Parameters
+    ----------
+    - values: pd.Series with answers
+
+    Returns
+    -------
+    pd.Series with str
+    """
+
+    try:
+        return values.fillna('').str.join(WORD_SEPARATOR).fillna('')
+    except AttributeError:
+        # .str accessor is not available, if there are no strings and lists at all
+        return pd.Series('', index=values.index, dtype=object)
+
+
+def format_score(score):
+    """Return score as a string: whole scores without fraction, partial scores with two digits"""
+
+    return '{:g}'.format(round(float(score), 2))
+
+
+class AnswerKey():
+
+    def __init__(self, lesson):
+        """Initiation of AnswerKey() object. Key keeps correct answers of all gaps of lesson in one flat array,
+        so any number of submissions is graded by comparing arrays, without loops over exercises
+
+        Parameters
+        ----------
+        - lesson: dataframe with english exercises (see ExerciseGen.create_default_lesson())
+        """
+
+        self.lesson = lesson
+
+        # Number of gaps of every exercise. Sentences without exercises have no gaps
+        task_type = lesson['task_type'].values
+        answers = pd.Series(lesson['task_answer'].values, dtype=object)
+        gaps = answers.where(answers.map(type).isin([list, tuple])).str.len().fillna(0).astype('int64').values
+        self.gaps = np.where(task_type == 'sent_with_no_exercises', 0, gaps)
+
+        # Exercises with gaps and position of their first gap in flat arrays
+        self.tasks = np.flatnonzero(self.gaps > 0)
+        self.starts = np.concatenate([[0], np.cumsum(self.gaps[self.tasks])[:-1]]).astype('int64')
+
+        # Flat arrays with all gaps
+        self.free_text = np.repeat(np.isin(task_type[self.tasks], FREE_TEXT_TYPES), self.gaps[self.tasks])
+        self.word_list = np.repeat(np.isin(task_type[self.tasks], WORD_LIST_TYPES), self.gaps[self.tasks])
+        self.answers = self.__normalize(answers.iloc[self.tasks].explode().values)
+
+
+    def __normalize(self, values):
+        """Normalize flat array with answers for gaps, which could contain answers of several submissions: 
+        lists of words are joined, answers typed by user are compared without case and extra spaces"""
+
+        n_submissions = len(values) // max(len(self.free_text), 1)
+        free_text = np.tile(self.free_text, n_submissions)
+        word_list = np.tile(self.word_list, n_submissions)
+
+        values = pd.Series(values, dtype=object)
+        if word_list.any():
+            values[word_list] = join_words(values[word_list])
+        values = values.fillna('').astype(str)
+        if free_text.any():
+            # Submissions repeat the same answers, so only unique answers are normalized
+            codes, uniques = pd.factorize(values[free_text])
+            values[free_text] = pd.Series(uniques, dtype=object).str.split().str.join(' ').str.lower().values[codes]
+        return values.values
+
+
+    def pad(self, submissions):
+        """Return answers of submissions for all gaps of the key. Missing answers are empty strings, 
+        extra answers are dropped. Answer, which is not a list, is the answer for the first gap
+
+        Parameters
+        ----------
+        - submissions: list with answers of users, every item is like column 'task_result' of lesson
+
+        Returns
+        -------
+        np.array with answers of shape (number of submissions, number of gaps)
+        """
+
+        n_rows = len(self.lesson)
+        n_tasks = len(self.tasks)
+        n_gaps = len(self.answers)
+        if any(len(results) != n_rows for results in submissions):
+            raise ValueError('Every submission must have an answer for every row of lesson')
+        padded = np.full(len(submissions) * n_gaps, '', dtype=object)
+        if n_tasks == 0:
+            return padded.reshape(len(submissions), 0)
+
+        # Answers of exercises with gaps for all submissions in one series, one item per (submission, exercise).
+        # After explode() every item is an answer for one gap, index is the number of the item
+        cells = pd.Series(list(itertools.chain.from_iterable(submissions)), dtype=object)
+        cells = cells.iloc[(np.arange(len(submissions))[:, np.newaxis] * n_rows + self.tasks).ravel()]
+        cells = cells.reset_index(drop=True).explode()
+
+        # Every answer gets position of its gap in the padded matrix
+        cell = cells.index.values
+        submission, task = np.divmod(cell, n_tasks)
+        gap = cells.groupby(level=0).cumcount().values
+        keep = gap < self.gaps[self.tasks][task]
+        positions = submission * n_gaps + self.starts[task] + gap
+
+        padded[positions[keep]] = cells.values[keep]
+        return padded.reshape(len(submissions), n_gaps)
+
+
+    def grade(self, submissions):
+        """Grade submissions
+
+        Parameters
+        ----------
+        - submissions: list with answers of users, every item is like column 'task_result' of lesson
+
+        Returns
+        -------
+        np.array with bools of shape (number of submissions, number of gaps)
+        """
+
+        keys = self.__normalize(self.pad(submissions).ravel()).reshape(len(submissions), len(self.answers))
+        return keys == self.answers[np.newaxis, :]
+
+
+class GradeReport():
+
+    def __init__(self, key, correct, names):
+        """Initiation of GradeReport() object. Report keeps results of grade() in three tables:
+        - gaps: correctness of every gap
+        - tasks: number of correct gaps, score (share of correct gaps) and full correctness of every exercise
+        - by_type: number of exercises, sum of scores and number of correct exercises for every exercise type
+
+        Parameters
+        ----------
+        - key: AnswerKey() object
+        - correct: np.array with bools of shape (number of submissions, number of gaps)
+        - names: names of submissions
+        """
+
+        lesson = key.lesson
+        n_submissions = len(names)
+        n_tasks = len(key.tasks)
+        gaps = key.gaps[key.tasks]
+
+        # Correct gaps of every exercise are summed in one call for all submissions
+        if n_tasks > 0:
+            correct_gaps = np.add.reduceat(correct.astype('int64'), key.starts, axis=1)
+        else:
+            correct_gaps = np.zeros((n_submissions, 0), dtype='int64')
+
+        submission = np.repeat(np.array(names, dtype=object), n_tasks)
+        self.tasks = pd.DataFrame({'submission': submission,
+                                   'row': np.tile(lesson.index.values[key.tasks], n_submissions),
+                                   'task_type': np.tile(lesson['task_type'].values[key.tasks], n_submissions),
+                                   'task_description': np.tile(lesson['task_description'].values[key.tasks],
+                                                               n_submissions),
+                                   'gaps': np.tile(gaps, n_submissions),
+                                   'correct_gaps': correct_gaps.ravel(),
+                                   'score': (correct_gaps / gaps).ravel() if n_tasks > 0 else np.zeros(0),
+                                   'correct': (correct_gaps == gaps).ravel()})
+
+        self.gaps = pd.DataFrame({'submission': np.repeat(np.array(names, dtype=object), len(key.answers)),
+                                  'row': np.tile(np.repeat(lesson.index.values[key.tasks], gaps), n_submissions),
+                                  'gap': np.tile(np.concatenate([np.arange(n) for n in gaps]) if n_tasks > 0
+                                                 else np.zeros(0, dtype='int64'), n_submissions),
+                                  'correct': correct.ravel()})
+
+        self.by_type = (self.tasks
+                        .groupby(['submission', 'task_description'], sort=False)
+                        .agg(tasks=('score', 'size'), score=('score', 'sum'), correct=('correct', 'sum'))
+                        .reset_index())
+
+        self.names = list(names)
+
+
+    def task_total(self, submission=None, partial=True):
+        """Return result of every exercise for one submission in lesson order, like column 'task_total'.
+        Sentences without exercises get np.nan
+
+        Parameters
+        ----------
+        - submission: name of submission. By default the first submission is used
+        - partial: if True, result is share of correct gaps. If False, result is 1 only if all gaps are correct
+
+        Returns
+        -------
+        pd.Series with index of lesson
+        """
+
+        if submission is None:
+            submission = self.names[0]
+        tasks = self.tasks[self.tasks['submission'] == submission]
+        values = tasks['score'] if partial else tasks['correct'].astype('float64')
+        return pd.Series(values.values, index=tasks['row'].values, dtype='float64')
+
+
+    def summary(self):
+        """Return table with total result of every submission
+
+        Returns
+        -------
+        pd.DataFrame with columns 'submission', 'tasks', 'score', 'correct', 'percent'
+        """
+
+        summary = (self.tasks
+                   .groupby('submission', sort=False)
+                   .agg(tasks=('score', 'size'), score=('score', 'sum'), correct=('correct', 'sum'))
+                   .reindex(self.names, fill_value=0)
+                   .rename_axis('submission')
+                   .reset_index())
+        summary['percent'] = 100 * summary['score'] / summary['tasks'].where(summary['tasks'] > 0)
+        return summary
+
+
+def grade(lesson, submissions=None):
+    """Grade one or many submissions of lesson. Every gap is checked separately, so exercises with several gaps
+    get partial score. Answers typed by user (see FREE_TEXT_TYPES) are compared without case and extra spaces
+
+    Parameters
+    ----------
+    - lesson: dataframe with english exercises (see ExerciseGen.create_default_lesson())
+    - submissions: answers of users: list with items like column 'task_result' of lesson or dictionary
+    {name : answers}. By default column 'task_result' of lesson is graded
+
+    Returns
+    -------
+    GradeReport() object
+    """
+
+    if submissions is None:
+        submissions = {'result': lesson['task_result']}
+    if not isinstance(submissions, dict):
+        submissions = dict(enumerate(submissions))
+
+    key = AnswerKey(lesson)
+    correct = key.grade([list(results) for results in submissions.values()])
+    return GradeReport(key, correct, list(submissions.keys()))
@@ -0,0 +1,178 @@
+import os
+import sys
+import argparse
+import functools
+
+import pyinflect
+
+
+# Penn Treebank tags of inflected forms in pyinflect data
+TAGS = ['VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ', 'MD', 'JJ', 'JJR', 'JJS', 'RB', 'RBR', 'RBS', 'NN', 'NNS']
+
+# Tags of verb and adjective forms, which are used in exercises
+VERB_TAGS = ['VB', 'VBD', 'VBG', 'VBN', 'VBP', 'VBZ', 'MD']
+ADJ_TAGS = ['JJ', 'JJR', 'JJS']
+
+
+def caps_style(word):
+    """Return capitalization style of word: 'all_upper', 'first_upper' or 'lower' (the same as pyinflect)"""
+
+    if word.isupper():
+        return 'all_upper'
+    elif word and word[0].isupper():
+        return 'first_upper'
+    else:
+        return 'lower'
+
+
+def apply_caps_style(word, style):
+    """Return word with capitalization style (the same as pyinflect)"""
+
+    if style == 'all_upper':
+        return word.upper()
+    elif style == 'first_upper':
+        return word.capitalize()
+    else:
+        return word.lower()
+
+
+class InflectionTable():
+
+    def __init__(self, engine=None, cache_size=2**16):
+        """Initiation of InflectionTable() object. Table keeps the first form of every lemma for every tag
+        from pyinflect data (AGID table with pyinflect overrides): one tuple with interned strings per lemma,
+        forms are in the order of TAGS. Results are the same as token._.inflect(tag) of pyinflect,
+        but all forms of a token are found by one lookup and lookups are memoized
+
+        Parameters
+        ----------
+        - engine: pyinflect Inflections() object. Default is the engine, which pyinflect creates on import 
+        and returns from pyinflect.InflectionEngine(), so pyinflect data is not loaded again
+        - cache_size: maximal number of memoized (lemma, capitalization style) pairs
+        """
+
+        if engine is None:
+            # pyinflect.InflectionEngine() does not create a new engine, it returns the one created on import
+            engine = pyinflect.InflectionEngine()
+
+        self.__forms = {}
+        for lemma in set(engine.infl_data) | set(engine.overrides):
+            forms = dict(engine.infl_data.get(lemma, {}))
+            forms.update(engine.overrides.get(lemma, {}))
+            if len(forms) > 0:
+                self.__forms[sys.intern(lemma)] = tuple(sys.intern(forms[tag][0]) if tag in forms else None
+                                                        for tag in TAGS)
+        self.__tag_index = {tag: i for i, tag in enumerate(TAGS)}
+        self.__lookup = functools.lru_cache(maxsize=cache_size)(self.__find)
+
+
+    def __len__(self):
+        return len(self.__forms)
+
+
+    def __find(self, lemma, style):
+        """Return dictionary {tag: form} for lemma, which is written in capitalization style of the token"""
+
+        # Like pyinflect, capitalization of the token is applied to the lemma,
+        # the lemma is searched in lowercase and forms get capitalization of the lemma
+        lemma = apply_caps_style(lemma, style)
+        forms = self.__forms.get(lemma.lower())
+        if forms is None:
+            return {}
+        lemma_style = caps_style(lemma)
+        return {tag: apply_caps_style(form, lemma_style) for tag, form in zip(TAGS, forms) if form is not None}
+
+
+    def forms(self, lemma, text=None):
+        """Return all forms of lemma
+
+        Parameters
+        ----------
+        - lemma: lemma of word
+        - text: word in text. Forms get its capitalization style. By default capitalization of lemma is used
+
+        Returns
+        -------
+        dictionary {tag: form}. Dictionary is shared by all calls with the same arguments, it must not be changed
+        """
+
+        return self.__lookup(lemma, caps_style(lemma if text is None else text))
+
+
+    def token_forms(self, token):
+        """Return all forms of spacy token, see forms()"""
+
+        return self.forms(token.lemma_, token.text)
+
+
+    def inflect(self, token, tag):
+        """Return form of spacy token for tag or None, like token._.inflect(tag) of pyinflect"""
+
+        return self.token_forms(token).get(tag)
+
+
+    def cache_info(self):
+        """Return statistics of memoized lookups"""
+
+        return self.__lookup.cache_info()
+
+
+# Table of the process. It is built from pyinflect data once and shared by all ExerciseGen() objects
+table = InflectionTable()
+
+
+def compare_with_pyinflect(docs, table=table):
+    """Compare forms of the table with token._.inflect(tag) of pyinflect for every token of docs and every tag
+    from TAGS. The tag of the token itself is checked too, so version of pyinflect, which returns the token text 
+    for its own tag instead of the form from data, is found
+
+    Parameters
+    ----------
+    - docs: iterable with spacy Docs
+    - table: InflectionTable()
+
+    Returns
+    -------
+    dictionary with number of 'checks', number of checks with the own tag of token 'own_tag_checks'
+    and list 'mismatches' with tuples (token text, lemma, tag, form of table, form of pyinflect)
+    """
+
+    checks = 0
+    own_tag_checks = 0
+    mismatches = []
+    for doc in docs:
+        for token in doc:
+            for tag in TAGS:
+                expected = token._.inflect(tag)
+                found = table.inflect(token, tag)
+                checks += 1
+                own_tag_checks += tag == token.tag_
+                if found != expected:
+                    mismatches.append((token.text, token.lemma_, tag, found, expected))
+    return {'checks': checks, 'own_tag_checks': own_tag_checks, 'mismatches': mismatches}
+
+
+if __name__ == '__main__':
+    import model_registry
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Check that inflection table returns the same forms as pyinflect')
+    parser.add_argument('files', nargs='*', 
+                        default=[os.path.join(folder, 'Little_Red_Cap_Jacob_and_Wilhelm_Grimm.txt'), 
+                                 os.path.join(folder, 'Little_Red_Riding_Hood_Charles_Perrault.txt')], 
+                        help='text files. By default bundled fairy tales are used')
+    parser.add_argument('--model', default='en_core_web_sm', help='spacy model')
+    args = parser.parse_args()
+
+    nlp = model_registry.registry.nlp(args.model)
+    texts = []
+    for file in args.files:
+        with open(file, encoding='utf-8') as f:
+            texts.extend(line for line in f.read().split('\n') if line.strip())
+
+    result = compare_with_pyinflect(nlp.pipe(texts))
+    print('Table:', len(table), 'lemmas,', result['checks'], 'checks,', result['own_tag_checks'], 
+          'checks with own tag of token,', len(result['mismatches']), 'mismatches')
+    for mismatch in result['mismatches'][:20]:
+        print(*mismatch)
+    sys.exit(1 if len(result['mismatches']) > 0 else 0)
@@ -0,0 +1,269 @@
+import json
+
+import numpy as np
+
+from exercise_record import ExerciseRecord, EMPTY, LESSON_COLUMNS, records_to_frame, frame_to_records
+
+
+# Exercise types, which options are sentences: one list of options for the whole exercise, not for every word
+SENTENCE_OPTION_TYPES = ['select_sent_word', 'select_sent_adj', 'select_sent_verb']
+
+# Exercise types, which text, answers and results are lists of words
+WORD_LIST_TYPES = ['set_word_order']
+
+
+def lesson_format(path, format=None):
+    """Return format of lesson file: 'jsonl' or 'parquet'. By default format is taken from file extension"""
+
+    if format is None:
+        name = path if isinstance(path, str) else getattr(path, 'name', '')
+        format = 'parquet' if str(name).endswith('.parquet') else 'jsonl'
+    if format not in ['jsonl', 'parquet']:
+        raise ValueError('Unknown lesson format: ' + str(format))
+    return format
+
+
+def plain(value):
+    """Convert value into JSON types: tuples into lists, numpy numbers into python numbers, EMPTY and NaN into None"""
+
+    if value is EMPTY:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def to_json_row(record):
+    """Convert exercise record into dictionary, which could be saved into JSON"""
+
+    return {column: plain(record[column]) for column in LESSON_COLUMNS}
+
+
+def from_json_row(row):
+    """Convert dictionary from JSON into exercise record"""
+
+    return ExerciseRecord(**{column: EMPTY if row.get(column) is None else row[column] for column in LESSON_COLUMNS})
+
+
+def parquet_schema():
+    """Return schema of Parquet file with lesson. Every column has one type, so fields, which structure
+    depends on exercise type, are wrapped into lists (see to_parquet_row())"""
+
+    import pyarrow as pa
+
+    words = pa.list_(pa.string())
+    return pa.schema([('row_num', pa.int64()),
+                      ('raw', pa.string()),
+                      ('task_type', pa.string()),
+                      ('task_text', words),
+                      ('task_object', words),
+                      ('task_options', pa.list_(words)),
+                      ('task_answer', pa.list_(words)),
+                      ('task_result', pa.list_(words)),
+                      ('task_description', pa.string()),
+                      ('task_total', pa.float64())])
+
+
+def to_parquet_row(record):
+    """Convert exercise record into dictionary with Parquet schema:
+    - task_text is a list of words for set_word_order and a list with one text for other types
+    - task_options is a list of options for every word, options of select_sent_* are wrapped into one more list
+    - every answer and result is a list of words for set_word_order (null for empty answer)
+      and a list with one string for other types
+    """
+
+    row = to_json_row(record)
+    word_list = row['task_type'] in WORD_LIST_TYPES
+
+    def wrap(value):
+        if value is None or word_list:
+            return value
+        return [value]
+
+    def wrap_answer(value):
+        if value is None or (word_list and isinstance(value, list)):
+            return value
+        # Empty answer of set_word_order is a string, it is saved as null
+        return None if word_list and value == '' else [value]
+
+    row['task_text'] = wrap(row['task_text'])
+    if row['task_options'] is not None and row['task_type'] in SENTENCE_OPTION_TYPES:
+        row['task_options'] = [row['task_options']]
+    for column in ['task_answer', 'task_result']:
+        if row[column] is not None:
+            row[column] = [wrap_answer(value) for value in row[column]]
+    if isinstance(row['task_total'], bool):
+        row['task_total'] = float(row['task_total'])
+    return row
+
+
+def from_parquet_row(row):
+    """Convert dictionary with Parquet schema into exercise record (see to_parquet_row())"""
+
+    row = dict(row)
+    word_list = row['task_type'] in WORD_LIST_TYPES
+
+    if row['task_text'] is not None and not word_list:
+        row['task_text'] = row['task_text'][0]
+    if row['task_options'] is not None and row['task_type'] in SENTENCE_OPTION_TYPES:
+        row['task_options'] = row['task_options'][0]
+    for column in ['task_answer', 'task_result']:
+        if row[column] is not None and word_list:
+            row[column] = ['' if value is None else value for value in row[column]]
+        elif row[column] is not None:
+            row[column] = [value[0] for value in row[column]]
+    return from_json_row(row)
+
+
+class LessonWriter():
+
+    def __init__(self, path, format=None, chunk_size=1000):
+        """Initiation of LessonWriter() object. Writer saves exercises into JSONL or Parquet file by chunks,
+        so the whole lesson is never kept in memory. Nested fields are saved as lists.
+        Writer is a context manager: file is closed at the end of 'with' block
+
+        Parameters
+        ----------
+        - path: path to file or binary file object
+        - format: 'jsonl' or 'parquet'. By default format is taken from file extension
+        - chunk_size: number of exercises in one chunk (row group of Parquet file)
+        """
+
+        self.format = lesson_format(path, format)
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.__chunk = []
+        self.__own_file = isinstance(path, str)
+        self.__file = open(path, 'wb') if self.__own_file else path
+        self.__parquet = None
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            self.__parquet = pq.ParquetWriter(self.__file, parquet_schema())
+
+
+    def write(self, record):
+        """Add exercise to the file
+
+        Parameters
+        ----------
+        - record: ExerciseRecord() object or exercise dictionary
+        """
+
+        self.__chunk.append(record)
+        self.count += 1
+        if len(self.__chunk) >= self.chunk_size:
+            self.flush()
+
+
+    def write_all(self, records):
+        """Add all exercises to the file"""
+
+        for record in records:
+            self.write(record)
+
+
+    def flush(self):
+        """Write collected chunk into the file"""
+
+        if len(self.__chunk) == 0:
+            return
+        if self.format == 'jsonl':
+            lines = ''.join(json.dumps(to_json_row(record), ensure_ascii=False) + '\n' for record in self.__chunk)
+            self.__file.write(lines.encode('utf-8'))
+        else:
+            import pyarrow as pa
+            self.__parquet.write_table(pa.Table.from_pylist([to_parquet_row(record) for record in self.__chunk],
+                                                            schema=parquet_schema()))
+        self.__chunk = []
+
+
+    def close(self):
+        """Write the last chunk and close the file"""
+
+        self.flush()
+        if self.__parquet is not None:
+            self.__parquet.close()
+            self.__parquet = None
+        if self.__own_file:
+            self.__file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_lesson(lesson, path, format=None, chunk_size=1000):
+    """Save lesson into JSONL or Parquet file
+
+    Parameters
+    ----------
+    - lesson: dataframe with exercises or iterable with ExerciseRecord() objects (for example ExerciseGen.iter_lesson())
+    - path: path to file or binary file object
+    - format: 'jsonl' or 'parquet'. By default format is taken from file extension
+    - chunk_size: number of exercises in one chunk
+
+    Returns
+    -------
+    int with number of saved exercises
+    """
+
+    if hasattr(lesson, 'itertuples'):
+        lesson = frame_to_records(lesson)
+    with LessonWriter(path, format=format, chunk_size=chunk_size) as writer:
+        writer.write_all(lesson)
+    return writer.count
+
+
+def iter_lesson_file(path, format=None, chunk_size=1000):
+    """Read exercises from JSONL or Parquet file one by one, without spacy and gensim models
+
+    Parameters
+    ----------
+    - path: path to file or binary file object
+    - format: 'jsonl' or 'parquet'. By default format is taken from file extension
+    - chunk_size: number of exercises, which are read from Parquet file at once
+
+    Yields
+    ------
+    ExerciseRecord() objects
+    """
+
+    format = lesson_format(path, format)
+    if format == 'jsonl':
+        file = open(path, 'rb') if isinstance(path, str) else path
+        try:
+            for line in file:
+                if line.strip():
+                    yield from_json_row(json.loads(line))
+        finally:
+            if isinstance(path, str):
+                file.close()
+    else:
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            for row in batch.to_pylist():
+                yield from_parquet_row(row)
+
+
+def read_lesson(path, format=None):
+    """Read lesson from JSONL or Parquet file into dataframe, without spacy and gensim models
+
+    Parameters
+    ----------
+    - path: path to file or binary file object
+    - format: 'jsonl' or 'parquet'. By default format is taken from file extension
+
+    Returns
+    -------
+    pd.DataFrame with columns LESSON_COLUMNS
+    """
+
+    return records_to_frame(list(iter_lesson_file(path, format=format)))
@@ -0,0 +1,157 @@
+import time
+import threading
+import contextlib
+
+import pandas as pd
+
+
+# Context manager, which does nothing. It is returned by disabled timers, so they cost almost nothing
+NO_TIMER = contextlib.nullcontext()
+
+
+class Metrics():
+
+    def __init__(self, enabled=False):
+        """Initiation of Metrics() object. Metrics keep timers and counters of ExerciseGen() stages:
+        spacy parsing, search of synonyms and antonyms, inflections, text beautifying, lesson assembly
+        and every exercise type. Stages could be nested, for example search of synonyms is a part of exercise.
+        If metrics are disabled, timers and counters do nothing
+
+        Parameters
+        ----------
+        - enabled: if True, metrics are collected
+        """
+
+        self.enabled = enabled
+        self.__timers = {}
+        self.__counters = {}
+        self.__lock = threading.Lock()
+
+
+    def timer(self, stage):
+        """Return context manager, which adds time of the block to the stage
+
+        Parameters
+        ----------
+        - stage: name of the stage, for example 'parse' or 'exercise/select_word_adj'
+        """
+
+        if not self.enabled:
+            return NO_TIMER
+        return self.__timer(stage)
+
+
+    @contextlib.contextmanager
+    def __timer(self, stage):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start_time)
+
+
+    def add_time(self, stage, seconds, calls=1):
+        """Add time to the stage
+
+        Parameters
+        ----------
+        - stage: name of the stage
+        - seconds: time in seconds
+        - calls: number of calls, which took this time
+        """
+
+        if not self.enabled:
+            return
+        with self.__lock:
+            timer = self.__timers.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            timer['calls'] += calls
+            timer['seconds'] += seconds
+            timer['max_seconds'] = max(timer['max_seconds'], seconds / calls if calls > 0 else seconds)
+
+
+    def count(self, name, n=1):
+        """Add n to the counter
+
+        Parameters
+        ----------
+        - name: name of the counter, for example 'distractor_queries'
+        - n: number to add
+        """
+
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + n
+
+
+    def reset(self):
+        """Delete all collected timers and counters"""
+
+        with self.__lock:
+            self.__timers = {}
+            self.__counters = {}
+
+
+    def snapshot(self):
+        """Return copy of all timers and counters
+
+        Returns
+        -------
+        dictionary:
+        {'timers': {stage: {'calls': int, 'seconds': float, 'max_seconds': float}}, 'counters': {name: int}}
+        """
+
+        with self.__lock:
+            return {'timers': {stage: dict(timer) for stage, timer in self.__timers.items()},
+                    'counters': dict(self.__counters)}
+
+
+    def to_frame(self):
+        """Return table with timers sorted from the slowest stage
+
+        Returns
+        -------
+        pd.DataFrame with columns 'stage', 'calls', 'seconds', 'mean_ms', 'max_ms'
+        """
+
+        timers = self.snapshot()['timers']
+        df = pd.DataFrame([{'stage': stage,
+                            'calls': timer['calls'],
+                            'seconds': timer['seconds'],
+                            'mean_ms': 1000 * timer['seconds'] / timer['calls'] if timer['calls'] > 0 else 0.0,
+                            'max_ms': 1000 * timer['max_seconds']} for stage, timer in timers.items()],
+                          columns=['stage', 'calls', 'seconds', 'mean_ms', 'max_ms'])
+        return df.sort_values('seconds', ascending=False).reset_index(drop=True)
+
+
+    def to_prometheus(self, prefix='exercisegen'):
+        """Return metrics in Prometheus text format, so they could be scraped by monitoring
+
+        Parameters
+        ----------
+        - prefix: prefix of metric names
+
+        Returns
+        -------
+        str with metrics
+        """
+
+        snapshot = self.snapshot()
+
+        def label(value):
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = ['# HELP {}_stage_seconds_total Total time of stage in seconds'.format(prefix),
+                 '# TYPE {}_stage_seconds_total counter'.format(prefix)]
+        for stage, timer in sorted(snapshot['timers'].items()):
+            lines.append('{}_stage_seconds_total{{stage="{}"}} {}'.format(prefix, label(stage), repr(timer['seconds'])))
+        lines += ['# HELP {}_stage_calls_total Number of calls of stage'.format(prefix),
+                  '# TYPE {}_stage_calls_total counter'.format(prefix)]
+        for stage, timer in sorted(snapshot['timers'].items()):
+            lines.append('{}_stage_calls_total{{stage="{}"}} {}'.format(prefix, label(stage), timer['calls']))
+        lines += ['# HELP {}_events_total Number of events'.format(prefix),
+                  '# TYPE {}_events_total counter'.format(prefix)]
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('{}_events_total{{name="{}"}} {}'.format(prefix, label(name), value))
+
+        return '\n'.join(lines) + '\n'
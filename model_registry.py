@@ -0,0 +1,311 @@
+import os
+import time
+import argparse
+import threading
+
+import pandas as pd
+import numpy as np
+import spacy
+from gensim.models import KeyedVectors
+
+import gensim.downloader as api
+
+from distractors import NeighbourTable, IVFIndex
+
+
+# Folder with vectors converted into native gensim format. It could be changed with environment variable
+VECTORS_DIR = os.environ.get('EXERCISEGEN_VECTORS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+
+
+def rss_bytes():
+    """Return resident memory of the current process in bytes. Returns np.nan if it is unknown"""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return np.nan
+
+
+def model_bytes(model):
+    """Return size of model's arrays in bytes. Works for gensim KeyedVectors and models with 'nbytes' attribute,
+    for other models returns np.nan"""
+
+    if hasattr(model, 'nbytes'):
+        return model.nbytes
+    vectors = getattr(model, 'vectors', None)
+    if isinstance(vectors, np.ndarray):
+        return vectors.nbytes
+    return np.nan
+
+
+def vectors_path(name):
+    """Return default path of converted gensim model"""
+
+    return os.path.join(VECTORS_DIR, name + '.kv')
+
+
+def neighbours_path(name):
+    """Return default path of precomputed neighbour table of gensim model"""
+
+    return os.path.join(VECTORS_DIR, name + '.neighbours.npz')
+
+
+def ann_index_path(name):
+    """Return default path of approximate nearest neighbour index of gensim model"""
+
+    return os.path.join(VECTORS_DIR, name + '.ivf.npz')
+
+
+def read_vectors(source):
+    """Read gensim KeyedVectors from gensim downloader or from local file.
+
+    Parameters
+    ----------
+    - source: model name in gensim downloader or path to local file. Local file could be saved gensim model (.kv, .model),
+    word2vec binary file (.bin) or text file in word2vec or GloVe format (GloVe files have no header line)
+
+    Returns
+    -------
+    gensim KeyedVectors
+    """
+
+    if not os.path.exists(source):
+        return api.load(source)
+
+    if source.endswith('.kv') or source.endswith('.model'):
+        return KeyedVectors.load(source)
+    if source.endswith('.bin'):
+        return KeyedVectors.load_word2vec_format(source, binary=True)
+
+    # word2vec text file starts with header "<number of words> <vector size>", GloVe text file has no header
+    with open(source, 'rb') as f:
+        first_line = f.readline().split()
+    no_header = len(first_line) != 2
+    return KeyedVectors.load_word2vec_format(source, binary=False, no_header=no_header)
+
+
+def convert_vectors(source, target):
+    """Convert vectors into native gensim format, which could be opened with mmap. Conversion is needed only once.
+    Vectors and their norms are saved into separate .npy files next to target file
+
+    Parameters
+    ----------
+    - source: model name in gensim downloader or path to local file (see read_vectors())
+    - target: path to converted model
+
+    Returns
+    -------
+    str with path to converted model
+    """
+
+    model = read_vectors(source)
+    model.fill_norms()
+
+    target_dir = os.path.dirname(os.path.abspath(target))
+    os.makedirs(target_dir, exist_ok=True)
+    model.save(target, separately=['vectors', 'norms'])
+
+    return target
+
+
+# Components of spacy model, which are not needed to split text by sentences
+SENTER_EXCLUDE = ['tok2vec', 'tagger', 'parser', 'attribute_ruler', 'lemmatizer', 'ner']
+
+
+def load_senter(name='en_core_web_sm'):
+    """Load lean spacy model, which only splits text by sentences. Trained pipelines have 'senter' component,
+    which is disabled by default and does not need tok2vec and parser, so it is much faster than the full model.
+    If the model has no 'senter', the dependency parser sets sentence boundaries, but tagger, lemmatizer and NER
+    are still excluded. Models without both components get rule-based 'sentencizer'
+
+    Parameters
+    ----------
+    - name: name of spacy model
+
+    Returns
+    -------
+    spacy Language object
+    """
+
+    nlp = spacy.load(name, exclude=SENTER_EXCLUDE)
+    if 'senter' in nlp.component_names:
+        nlp.enable_pipe('senter')
+        return nlp
+
+    nlp = spacy.load(name, exclude=[component for component in SENTER_EXCLUDE if component not in ['tok2vec', 'parser']])
+    if not nlp.has_pipe('parser'):
+        nlp.add_pipe('sentencizer')
+    return nlp
+
+
+class ModelRegistry():
+
+    def __init__(self):
+        """Initiation of ModelRegistry() object.
+        Registry keeps models that are shared by all ExerciseGen() objects and all streamlit sessions of the process"""
+
+        self.__models = {}
+        self.__stats = {}
+        # One lock protects dictionaries, one lock per model makes other threads wait while the model is loading
+        self.__lock = threading.Lock()
+        self.__loading_locks = {}
+
+
+    def get(self, name, loader):
+        """Return model by name. Model is loaded only once, all the next calls return the same object.
+        If several threads ask for the same model, only one of them loads it, the others wait.
+
+        Parameters
+        ----------
+        - name: model name in registry
+        - loader: function without arguments, which loads the model
+
+        Returns
+        -------
+        loaded model
+        """
+
+        if name in self.__models:
+            return self.__models[name]
+
+        with self.__lock:
+            loading_lock = self.__loading_locks.setdefault(name, threading.Lock())
+
+        with loading_lock:
+            if name not in self.__models:
+                rss_before = rss_bytes()
+                start_time = time.perf_counter()
+                model = loader()
+                self.__stats[name] = {'load_seconds': time.perf_counter() - start_time,
+                                      'rss_delta_bytes': rss_bytes() - rss_before,
+                                      'model_bytes': model_bytes(model)}
+                self.__models[name] = model
+
+        return self.__models[name]
+
+
+    def put(self, name, model):
+        """Save already loaded model into registry. Useful for tests and benchmarks with small models
+
+        Parameters
+        ----------
+        - name: model name in registry
+        - model: loaded model
+        """
+
+        with self.__lock:
+            self.__models[name] = model
+            self.__stats[name] = {'load_seconds': 0.0, 'rss_delta_bytes': np.nan, 'model_bytes': model_bytes(model)}
+
+
+    def nlp(self, name='en_core_web_sm'):
+        """Return spacy model"""
+
+        return self.get('spacy/' + name, lambda: spacy.load(name))
+
+
+    def senter(self, name='en_core_web_sm'):
+        """Return lean spacy model, which only splits text by sentences (see load_senter())"""
+
+        return self.get('spacy-senter/' + name, lambda: load_senter(name))
+
+
+    def vectors(self, name='glove-wiki-gigaword-100', path=None):
+        """Return gensim KeyedVectors model. If the model was converted by convert_vectors(), 
+        it is opened with mmap='r': the vectors are not copied into memory of the process 
+        and all processes share them through the OS page cache. Otherwise gensim downloader is used.
+        Attention - it takes a very long time to download if it is not already installed
+        
+        Parameters
+        ----------
+        - name: model name in gensim downloader
+        - path: path to converted model. Default path is VECTORS_DIR/<name>.kv
+        """
+
+        if path is None:
+            path = vectors_path(name)
+
+        def loader():
+            if os.path.exists(path):
+                return KeyedVectors.load(path, mmap='r')
+            return api.load(name)
+
+        return self.get('gensim/' + name, loader)
+
+
+    def neighbours(self, name='glove-wiki-gigaword-100', path=None):
+        """Return precomputed synonym and antonym neighbours of gensim model (see distractors.NeighbourTable)
+        or None, if the table was not built
+
+        Parameters
+        ----------
+        - name: model name in gensim downloader
+        - path: path to neighbour table. Default path is VECTORS_DIR/<name>.neighbours.npz
+        """
+
+        if path is None:
+            path = neighbours_path(name)
+
+        def loader():
+            if os.path.exists(path):
+                return NeighbourTable.load(path, model=self.vectors(name))
+            return None
+
+        return self.get('neighbours/' + name, loader)
+
+
+    def ann_index(self, name='glove-wiki-gigaword-100', path=None):
+        """Return approximate nearest neighbour index of gensim model (see distractors.IVFIndex)
+        or None, if the index was not built. Without index exact search is used
+
+        Parameters
+        ----------
+        - name: model name in gensim downloader
+        - path: path to index. Default path is VECTORS_DIR/<name>.ivf.npz
+        """
+
+        if path is None:
+            path = ann_index_path(name)
+
+        def loader():
+            if os.path.exists(path):
+                return IVFIndex.load(path, model=self.vectors(name))
+            return None
+
+        return self.get('ann/' + name, loader)
+
+
+    def stats(self):
+        """Return table with load time and memory usage of all loaded models
+
+        Returns
+        -------
+        pd.DataFrame with columns 'model', 'load_seconds', 'rss_delta_mb', 'model_mb'
+        """
+
+        with self.__lock:
+            stats = dict(self.__stats)
+
+        df = pd.DataFrame([{'model': name,
+                            'load_seconds': stat['load_seconds'],
+                            'rss_delta_mb': stat['rss_delta_bytes'] / 2**20,
+                            'model_mb': stat['model_bytes'] / 2**20} for name, stat in stats.items()],
+                          columns=['model', 'load_seconds', 'rss_delta_mb', 'model_mb'])
+        return df
+
+
+# Registry of the process. All ExerciseGen() objects use it if other registry is not given
+registry = ModelRegistry()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert gensim vectors into format, which could be opened with mmap')
+    parser.add_argument('name', nargs='?', default='glove-wiki-gigaword-100', help='model name in gensim downloader')
+    parser.add_argument('--source', help='local file with vectors. By default model is taken from gensim downloader')
+    parser.add_argument('--target', help='path to converted model. By default VECTORS_DIR/<name>.kv')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    target = convert_vectors(args.source or args.name, args.target or vectors_path(args.name))
+    print('Vectors are saved into', target, 'in', round(time.perf_counter() - start_time, 1), 'seconds')
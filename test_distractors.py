@@ -0,0 +1,33 @@
+from distractors import LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=3)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, key.upper())
+
+    # Read value becomes the most recently used, checking the key does not change the order
+    assert cache.get('a') == 'A'
+    assert 'b' in cache
+    cache.put('d', 'D')
+    assert [key for key in 'abcd' if key in cache] == ['a', 'c', 'd']
+
+    # New value of the existing key makes it the most recently used too
+    cache.put('c', 'C2')
+    cache.put('e', 'E')
+    assert [key for key in 'abcde' if key in cache] == ['c', 'd', 'e']
+    assert cache.get('c') == 'C2'
+    assert cache.get('a') is None
+
+    cache.resize(1)
+    assert len(cache) == 1 and cache.get('c') == 'C2'
+    assert cache.stats() == {'size': 1, 'max_size': 1, 'hits': 3, 'misses': 1, 'evictions': 4, 'hit_rate': 0.75}
+
+
+def test_lru_cache_clear():
+    cache = LRUCache(max_size=2)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()['hits'] == 0 and cache.stats()['evictions'] == 0
@@ -0,0 +1,222 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import PARAGRAPH
+from exercise_record import EMPTY, LESSON_COLUMNS
+
+
+POS = ['NOUN', 'VERB', 'ADV', 'ADJ']
+
+
+def legacy_positions(text, items):
+    """Find start and end of every token or chunk like the old generators did:
+    the first occurrence of its text, which is then covered with '#'"""
+
+    save_text = text
+    positions = []
+    for item in items:
+        index = save_text.find(item.text)
+        positions.append([item, index, index+len(item.text)])
+        save_text = save_text[:index] + '#'*len(item.text) + save_text[index+len(item.text):]
+    return positions
+
+
+def legacy_replace(text, spans):
+    """Replace sorted spans one by one and shift the next ones by lag like the old generators did"""
+
+    lag = 0
+    for start_index, end_index, replacement in spans:
+        text = text[:start_index+lag] + replacement + text[end_index+lag:]
+        lag += len(replacement) - (end_index - start_index)
+    return text
+
+
+def legacy_default_lesson(df):
+    """Balance exercise types like create_default_lesson() did before: search in the whole dataframe 
+    and pd.concat() for every selected exercise"""
+
+    q_task = len(df.loc[df['task_type'] != 'sent_with_no_exercises', 'row_num'].unique())
+    ex_types = list(df[df['task_type'] != 'sent_with_no_exercises']
+                    .groupby('task_type')['row_num']
+                    .agg('count')
+                    .reset_index()
+                    .sort_values(by='row_num')
+                    .reset_index(drop=True)
+                    ['task_type'])
+    pointer = 0
+    q_task_fact = 0
+    new_df = pd.DataFrame(columns=LESSON_COLUMNS)
+    while q_task_fact < q_task:
+        new_task = df[(~df['row_num'].isin(new_df['row_num'].unique())) & (df['task_type']==ex_types[pointer])].head(1)
+        if len(new_task) != 0:
+            new_df = pd.concat([new_df, new_task], ignore_index=True)
+            q_task_fact += 1
+        else:
+            new_tasks = df[(~df['row_num'].isin(new_df['row_num'].unique())) & (df['task_type'].isin(ex_types))]
+            if len(new_tasks) == 0:
+                q_task_fact = q_task
+        if pointer == len(ex_types)-1:
+            pointer = 0
+        else:
+            pointer += 1
+    df_with_no_exer = df[~df['row_num'].isin(new_df['row_num'].unique())]
+    return pd.concat([new_df, df_with_no_exer], ignore_index=True).sort_values('row_num').reset_index(drop=True)
+
+
+def synthetic_lesson(n_rows, seed):
+    """Create lesson with random exercise types for every sentence. Some sentences have no exercises"""
+
+    rng = np.random.default_rng(seed)
+    types = ['select_word_adj', 'select_sent_word', 'fill_words_in_the_gaps', 'set_word_order']
+    records = []
+    for row_num in range(1, n_rows+1):
+        row_types = list(rng.choice(types, size=rng.integers(0, len(types)+1), replace=False, p=[0.1, 0.2, 0.3, 0.4]))
+        for task_type in row_types or ['sent_with_no_exercises']:
+            records.append({'row_num': row_num, 'raw': 'sentence ' + str(row_num), 'task_type': task_type, 
+                            'task_text': 'sentence ' + str(row_num), 'task_object': '', 'task_options': '', 
+                            'task_answer': '', 'task_result': '', 'task_description': '', 'task_total': 0.0})
+    return pd.DataFrame(records, columns=LESSON_COLUMNS)
+
+
+def token_attributes(doc):
+    """Return attributes of tokens, which are used by exercise generators"""
+
+    return [(token.text, token.idx, token.pos_, token.tag_, token.lemma_, token.dep_, token.head.i) for token in doc]
+
+
+def test_offsets_match_legacy_search(ex_gen, sentences):
+    docs = ex_gen.parse_sentences(sentences)
+    for text in sentences:
+        doc = docs[text]
+        tokens = [token for token in doc if token.pos_ in POS]
+        assert ([(index_start, index_end) for token, index_start, index_end in legacy_positions(text, tokens)]
+                == [(token.idx, token.idx+len(token.text)) for token in tokens])
+        chunks = list(doc.noun_chunks)
+        assert ([(index_start, index_end) for chunk, index_start, index_end in legacy_positions(text, chunks)]
+                == [(chunk.start_char, chunk.end_char) for chunk in chunks])
+
+
+def test_mask_spans_matches_legacy_replace(ex_gen, sentences):
+    docs = ex_gen.parse_sentences(sentences)
+    for text in sentences:
+        tokens = [(token.idx, token.idx+len(token.text), token.text) for token in docs[text]]
+        # Every token is replaced, so spans of words and punctuation marks are adjacent
+        for make in [lambda word: '_____',
+                     lambda word: word[0] + '_____',
+                     lambda word: '**' + word + '**',
+                     lambda word: word.upper() + 'ish']:
+            spans = [(start_index, end_index, make(word)) for start_index, end_index, word in tokens]
+            assert ex_gen.mask_spans(text, spans) == legacy_replace(text, spans)
+            assert ex_gen.mask_spans(text, spans[::-1]) == legacy_replace(text, spans)
+            assert ex_gen.mask_spans(text, spans[1::3]) == legacy_replace(text, spans[1::3])
+
+
+def test_mask_spans_skips_overlapping_spans(ex_gen, sentences):
+    docs = ex_gen.parse_sentences(sentences)
+    for text in sentences:
+        for chunk in docs[text].noun_chunks:
+            chunk_span = (chunk.start_char, chunk.end_char, '_____')
+            inner_spans = [(token.idx, token.idx+len(token.text), '**' + token.text + '**') for token in chunk]
+            assert ex_gen.mask_spans(text, [chunk_span] + inner_spans) == legacy_replace(text, [chunk_span])
+
+
+def test_mask_spans_finds_repeated_substring(ex_gen):
+    text = 'He came to me.'
+    doc = ex_gen.parse_sentences([text])[text]
+    token = [token for token in doc if token.text == 'me'][0]
+    spans = [(token.idx, token.idx+len(token.text), '_____')]
+    assert ex_gen.mask_spans(text, spans) == 'He came to _____.'
+    # The old search found 'me' inside 'came'
+    assert legacy_replace(text, [(index_start, index_end, '_____')
+                                 for item, index_start, index_end in legacy_positions(text, [token])]) == 'He ca_____ to me.'
+
+
+@pytest.mark.parametrize('hint', [True, False])
+def test_fill_words_in_the_gaps_matches_legacy(ex_gen, sentences, hint):
+    docs = ex_gen.parse_sentences(sentences)
+    q_words = 2
+    for seed, text in enumerate(sentences):
+        random.seed(seed)
+        record = ex_gen.fill_words_in_the_gaps(docs[text], q_words=q_words, hint=hint)
+
+        random.seed(seed)
+        tokens = legacy_positions(text, [token for token in docs[text] if token.pos_ in POS])
+        if len(tokens) <= q_words+3:
+            assert record.task_answer is EMPTY
+            continue
+        tokens = random.sample(tokens, k=q_words)
+        tokens.sort(key=lambda x:x[1])
+        spans = [(start_index, end_index, (token.text[0] if hint else '') + '_____')
+                 for token, start_index, end_index in tokens]
+        assert record.task_text == legacy_replace(text, spans)
+        assert record.task_answer == [token.text for token, start_index, end_index in tokens]
+
+
+@pytest.mark.parametrize('ex_type', ['select_memb_groups', 'listening_fill_chunks'])
+def test_chunk_exercises_match_legacy(ex_gen, sentences, ex_type):
+    docs = ex_gen.parse_sentences(sentences)
+    q_words = 2
+    for seed, text in enumerate(sentences):
+        random.seed(seed)
+        record = getattr(ex_gen, ex_type)(docs[text], q_words=q_words)
+
+        random.seed(seed)
+        chunks = legacy_positions(text, list(docs[text].noun_chunks))
+        if len(chunks) <= 1:
+            assert record.task_answer is EMPTY
+            continue
+        chunks = random.sample(chunks, k=min(q_words, len(chunks)))
+        chunks.sort(key=lambda x:x[1])
+        if ex_type == 'select_memb_groups':
+            spans = [(start_index, end_index, '**' + chunk.text + '**') for chunk, start_index, end_index in chunks]
+        else:
+            spans = [(start_index, end_index, '_____') for chunk, start_index, end_index in chunks]
+        assert record.task_text == legacy_replace(text, spans)
+        assert record.task_object == [chunk.text for chunk, start_index, end_index in chunks]
+
+
+def test_parse_sentences_parses_repeated_sentences_once(ex_gen, registry, sentences):
+    assert len(set(sentences)) < len(sentences)
+    ex_gen.metrics.enabled = True
+    docs = ex_gen.parse_sentences(sentences)
+
+    assert list(docs) == list(dict.fromkeys(sentences))
+    assert ex_gen.metrics.snapshot()['counters']['parsed_sentences'] == len(set(sentences))
+    # The old code parsed every sentence by full spacy model
+    nlp = registry.nlp()
+    for text in sentences:
+        old_doc = nlp(text)
+        assert token_attributes(docs[text]) == token_attributes(old_doc)
+        assert [chunk.text for chunk in docs[text].noun_chunks] == [chunk.text for chunk in old_doc.noun_chunks]
+
+    # Already parsed sentences are not parsed again
+    ex_gen.parse_sentences(sentences, docs=docs)
+    assert ex_gen.metrics.snapshot()['counters']['parsed_sentences'] == len(set(sentences))
+
+
+def assert_same_balance(new_df, old_df):
+    """Lessons must have the same exercise type for every sentence"""
+
+    assert new_df['task_type'].value_counts().to_dict() == old_df['task_type'].value_counts().to_dict()
+    assert list(zip(new_df['row_num'], new_df['task_type'])) == list(zip(old_df['row_num'], old_df['task_type']))
+
+
+# The old code concatenates empty dataframe
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+@pytest.mark.parametrize('seed', range(5))
+def test_create_default_lesson_matches_legacy(ex_gen, seed):
+    lesson = synthetic_lesson(60, seed)
+    assert_same_balance(ex_gen.create_default_lesson(lesson), legacy_default_lesson(lesson))
+
+
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+def test_create_default_lesson_matches_legacy_on_text(ex_gen):
+    random.seed(123)
+    np.random.seed(123)
+    df = ex_gen.load_text(PARAGRAPH)
+    lesson = ex_gen.create_lesson(df, q_task=len(df))
+    assert lesson['task_type'].nunique() > 1
+    assert_same_balance(ex_gen.create_default_lesson(lesson), legacy_default_lesson(lesson))
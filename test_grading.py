@@ -0,0 +1,211 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import grading
+from exercise_record import ExerciseRecord, records_to_frame
+
+
+def old_normalize(value, free_text=False):
+    """Normalize answer for one gap like the old per-gap loop did"""
+
+    if isinstance(value, (list, tuple)):
+        return grading.WORD_SEPARATOR.join(str(word) for word in value)
+    if not isinstance(value, str):
+        return ''
+    if free_text:
+        return ' '.join(value.split()).lower()
+    return value
+
+
+def old_grade(lesson, results):
+    """Grade one submission like the old per-gap loop did: answers are cut or padded with ''
+    to the number of gaps and compared one by one
+
+    Returns
+    -------
+    dictionary {row of lesson : (number of gaps, number of correct gaps)}
+    """
+
+    scores = {}
+    for row, task_type, task_answer, task_result in zip(lesson.index, lesson['task_type'], lesson['task_answer'], results):
+        if task_type == 'sent_with_no_exercises' or not isinstance(task_answer, (list, tuple)) or len(task_answer) == 0:
+            continue
+        gaps = len(task_answer)
+        if not isinstance(task_result, (list, tuple)):
+            task_result = []
+        task_result = list(task_result[:gaps]) + [''] * (gaps - len(task_result))
+        free_text = task_type in grading.FREE_TEXT_TYPES
+        correct = sum(old_normalize(answer, free_text) == old_normalize(result, free_text)
+                      for answer, result in zip(task_answer, task_result))
+        scores[row] = (gaps, correct)
+    return scores
+
+
+def make_lesson():
+    """Lesson with every kind of answers: one and several gaps, typed answers, word lists,
+    sentences without exercises and exercise without gaps"""
+
+    order = ['The', 'wolf', 'came', 'to', 'the', 'house.']
+    records = [ExerciseRecord('s0', 'sent_with_no_exercises', 's0', task_description='Предложение без упражнения'),
+               ExerciseRecord('s1', 'select_word_syn_ant', 's1', ['wolf'], [['wolf', 'dog', 'cat']], ['wolf'], [''],
+                              'Выберите правильное слово', 0),
+               ExerciseRecord('s2', 'fill_words_in_the_gaps', 's2', ['Wolf', 'house'], [], ['Wolf', 'house'], ['', ''],
+                              'Заполните пропущенное слово', 0),
+               ExerciseRecord('s3', 'listening_fill_chunks', 's3', ['the old grandmother'], [], ['the old grandmother'], [''],
+                              'Прослушайте аудиозапись', 0),
+               ExerciseRecord('s4', 'set_word_order', order[::-1], [], [], [order], [''],
+                              'Расставьте слова в правильном порядке', 0),
+               ExerciseRecord('s5', 'sent_with_no_exercises', 's5', task_description='Предложение без упражнения'),
+               ExerciseRecord('s6', 'select_word_verb', 's6', [], [], [], [], 'Выберите правильную форму глагола', 0),
+               ExerciseRecord('s7', 'select_memb_groups', 's7', ['a', 'b', 'c'], [['x', 'y', 'z']] * 3, ['x', 'y', 'z'],
+                              ['', '', ''], 'Определите, чем является выделенное словосочетание', 0),
+               ExerciseRecord('s8', 'select_word_syn_ant', 's8', ['girl'], [['girl', 'boy', 'man']], ['girl'], [''],
+                              'Выберите правильное слово', 0),
+               ExerciseRecord('s9', 'sent_with_no_exercises', 's9', task_description='Предложение без упражнения')]
+    for row_num, record in enumerate(records):
+        record.row_num = row_num
+    return records_to_frame(records)
+
+
+def variants(answer, task_type, rnd):
+    """Return random answer for one gap: correct, changed case and spaces, wrong or empty"""
+
+    if isinstance(answer, list):
+        return rnd.choice([list(answer), answer[::-1], answer[:-1], '', None])
+    choices = [answer, answer + 'x', '', None, np.nan]
+    if task_type in grading.FREE_TEXT_TYPES:
+        choices += [answer.upper(), '  ' + answer.replace(' ', '   ') + ' ', answer.title() + '\t']
+    return rnd.choice(choices)
+
+
+def random_submissions(lesson, n_submissions, seed):
+    """Answers of users with random number of answers for every exercise: fewer than gaps, equal and more"""
+
+    rnd = random.Random(seed)
+    submissions = {}
+    for i in range(n_submissions):
+        results = []
+        for task_type, task_answer in zip(lesson['task_type'], lesson['task_answer']):
+            if not isinstance(task_answer, list):
+                results.append(rnd.choice([np.nan, None, []]))
+                continue
+            n_answers = rnd.randint(0, len(task_answer) + 1)
+            answers = [variants(task_answer[min(j, len(task_answer)-1)] if task_answer else 'extra', task_type, rnd)
+                       for j in range(n_answers)]
+            results.append(answers)
+        submissions['user' + str(i)] = results
+    return submissions
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_scores_match_old_loop(seed):
+    lesson = make_lesson()
+    submissions = random_submissions(lesson, 100, seed)
+    report = grading.grade(lesson, submissions)
+
+    for name, results in submissions.items():
+        old = old_grade(lesson, results)
+        tasks = report.tasks[report.tasks['submission'] == name]
+        assert list(tasks['row']) == list(old)
+        assert list(zip(tasks['gaps'], tasks['correct_gaps'])) == list(old.values())
+
+        total = report.task_total(name)
+        assert total.to_dict() == {row: correct / gaps for row, (gaps, correct) in old.items()}
+        assert report.task_total(name, partial=False).to_dict() == {row: float(correct == gaps)
+                                                                    for row, (gaps, correct) in old.items()}
+
+
+def test_typed_answers_ignore_case_and_spaces():
+    lesson = make_lesson()
+    results = [list(answers) if isinstance(answers, list) else answers for answers in lesson['task_answer']]
+    results[2] = ['  wOLF ', 'HOUSE\n']
+    results[3] = ['The  old\tgrandmother ']
+    results[1] = ['Wolf']
+    report = grading.grade(lesson, [results])
+
+    total = report.task_total()
+    assert total[2] == 1 and total[3] == 1
+    # Case matters for options chosen from the list
+    assert total[1] == 0
+
+
+def test_fewer_answers_than_gaps():
+    lesson = make_lesson()
+    results = [np.nan] * len(lesson)
+    results[2] = ['Wolf']
+    results[7] = ['x', 'y']
+    report = grading.grade(lesson, [results])
+
+    total = report.task_total()
+    assert total[2] == 0.5
+    assert total[7] == pytest.approx(2 / 3)
+    assert total[1] == 0 and total[4] == 0
+
+
+def test_tasks_without_gaps_are_not_graded():
+    lesson = make_lesson()
+    report = grading.grade(lesson, [[np.nan] * len(lesson)])
+
+    # Sentences without exercises and exercise with empty answer list have no gaps
+    assert set(report.task_total().index) == {1, 2, 3, 4, 7, 8}
+    assert report.gaps.groupby('row').size().to_dict() == {1: 1, 2: 2, 3: 1, 4: 1, 7: 3, 8: 1}
+
+    no_gaps = lesson[lesson['task_type'] == 'sent_with_no_exercises']
+    report = grading.grade(no_gaps, [[np.nan] * len(no_gaps)] * 2)
+    assert len(report.tasks) == 0
+    assert report.summary()['tasks'].tolist() == [0, 0]
+    assert report.summary()['percent'].isna().all()
+
+
+def test_summary_by_type_matches_old_loop(ex_gen):
+    lesson = make_lesson()
+    submissions = random_submissions(lesson, 20, seed=7)
+    report = grading.grade(lesson, submissions)
+
+    summary = report.summary().set_index('submission')
+    for name, results in submissions.items():
+        old = old_grade(lesson, results)
+        by_type = {}
+        for row, (gaps, correct) in old.items():
+            tasks, score, full = by_type.get(lesson.loc[row, 'task_description'], (0, 0, 0))
+            by_type[lesson.loc[row, 'task_description']] = (tasks + 1, score + correct / gaps, full + (correct == gaps))
+
+        table = report.by_type[report.by_type['submission'] == name].set_index('task_description')
+        assert set(table.index) == set(by_type)
+        for description, (tasks, score, full) in by_type.items():
+            assert table.loc[description, 'tasks'] == tasks
+            assert table.loc[description, 'score'] == pytest.approx(score)
+            assert table.loc[description, 'correct'] == full
+
+        assert summary.loc[name, 'tasks'] == len(old)
+        assert summary.loc[name, 'score'] == pytest.approx(sum(correct / gaps for gaps, correct in old.values()))
+        assert summary.loc[name, 'correct'] == sum(correct == gaps for gaps, correct in old.values())
+
+    # Table of the app is the same for the report and for column 'task_total' filled by the old loop.
+    # Exercise without gaps is dropped, because the old table counts it with zero tasks
+    df = lesson.drop(index=6)
+    results = [submissions['user0'][row] for row in df.index]
+    old = old_grade(df, results)
+    df['task_total'] = pd.Series({row: correct / gaps for row, (gaps, correct) in old.items()}, dtype='float64')
+    pd.testing.assert_frame_equal(ex_gen.show_result_by_task_type(df, grading.grade(df, [results])),
+                                  ex_gen.show_result_by_task_type(df))
+
+
+def test_answer_not_in_list_is_first_gap():
+    lesson = make_lesson()
+    results = [np.nan] * len(lesson)
+    results[1] = 'wolf'
+    results[2] = 'wolf'
+
+    # The old loop counted such answers as empty
+    total = grading.grade(lesson, [results]).task_total()
+    assert total[1] == 1 and total[2] == 0.5
+
+
+def test_submission_of_wrong_length():
+    lesson = make_lesson()
+    with pytest.raises(ValueError):
+        grading.grade(lesson, [[np.nan] * (len(lesson) - 1)])
@@ -0,0 +1,60 @@
+import copy
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import lesson_io
+from exercise_record import EMPTY, records_to_frame
+from exercisegen import EXERCISE_TYPES
+
+
+@pytest.fixture
+def records(ex_gen, sentences):
+    """Exercises of every type for sentences of the paragraph. Some of them are answered by user"""
+
+    random.seed(123)
+    np.random.seed(123)
+    docs = ex_gen.parse_sentences(sentences)
+    records = []
+    for row_num, text in enumerate(sentences):
+        for ex_type in EXERCISE_TYPES + ['sent_with_no_exercises']:
+            record = getattr(ex_gen, ex_type)(docs[text])
+            if record.is_empty:
+                continue
+            record.row_num = row_num
+            records.append(record)
+
+    totals = [0, 1, 0.5, True, EMPTY]
+    for i, record in enumerate(records):
+        if record.task_type == 'sent_with_no_exercises':
+            continue
+        # Every second exercise is answered correctly, so results are filled like answers
+        if i % 2 == 0:
+            record.task_result = copy.deepcopy(record.task_answer)
+        record.task_total = totals[i % len(totals)]
+    return records
+
+
+@pytest.mark.parametrize('format', ['jsonl', 'parquet'])
+def test_round_trip(records, tmp_path, format):
+    assert {record.task_type for record in records} == set(EXERCISE_TYPES + ['sent_with_no_exercises'])
+    path = str(tmp_path / ('lesson.' + format))
+
+    assert lesson_io.write_lesson(records, path, chunk_size=7) == len(records)
+    df = lesson_io.read_lesson(path)
+
+    pd.testing.assert_frame_equal(df, records_to_frame(records))
+    assert df['task_total'].dtype == 'float64'
+    assert list(lesson_io.iter_lesson_file(path)) == records
+
+
+@pytest.mark.parametrize('format', ['jsonl', 'parquet'])
+def test_round_trip_from_frame(records, tmp_path, format):
+    path = str(tmp_path / ('lesson.' + format))
+    lesson = records_to_frame(records)
+
+    lesson_io.write_lesson(lesson, path)
+
+    pd.testing.assert_frame_equal(lesson_io.read_lesson(path), lesson)
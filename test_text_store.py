@@ -0,0 +1,72 @@
+import os
+
+import pandas as pd
+import pytest
+
+from text_store import TextStore
+
+
+def make_table(n=20):
+    return pd.DataFrame({'raw': ['Sentence number ' + str(i) + '.' for i in range(n)], 'row_num': range(n)})
+
+
+def set_last_used(store, key, seconds):
+    """Set time of the last use of the entry"""
+
+    os.utime(os.path.join(store.path, key + '.json'), (seconds, seconds))
+
+
+def keys(store):
+    return set(store.entries()['key'])
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TextStore(str(tmp_path / 'store'))
+
+
+def test_evict_deletes_least_recently_used(store):
+    for key, seconds in [('a', 100), ('b', 300), ('c', 200)]:
+        store.put(key, make_table())
+        set_last_used(store, key, seconds)
+    entry_bytes = store.entries()['bytes'].max()
+    store.max_bytes = 3 * entry_bytes
+
+    store.put('d', make_table())
+    assert keys(store) == {'b', 'c', 'd'}
+
+    # get() updates time of the last use, so 'c' is the oldest entry now
+    assert store.get('b') is not None
+    store.put('e', make_table())
+    assert keys(store) == {'b', 'd', 'e'}
+    assert store.get('c') is None and store.get('a') is None
+
+
+def test_evict_keeps_just_written_entry(store):
+    store.max_bytes = 1
+    store.put('a', make_table())
+    assert keys(store) == {'a'}
+
+    store.put('b', make_table(5))
+    assert keys(store) == {'b'}
+    pd.testing.assert_frame_equal(store.get('b'), make_table(5))
+
+
+def test_evict_counts_and_deletes_docs(store, registry):
+    nlp = registry.nlp()
+    components = tuple(nlp.pipe_names)
+    docs = [nlp(text) for text in make_table(5)['raw']]
+
+    store.put('a', make_table(5))
+    table_bytes = store.entries()['bytes'].sum()
+    store.put_docs('a', nlp, components, docs)
+    docs_bytes = store.entries()['bytes'].sum() - table_bytes
+    assert docs_bytes > 0
+    assert [doc.text for doc in store.get_docs('a', nlp)[components].values()] == list(make_table(5)['raw'])
+
+    # Entry 'a' is bigger than the limit only with its Docs. It is deleted with its Docs, when 'b' is written
+    set_last_used(store, 'a', 100)
+    store.max_bytes = 2 * table_bytes + docs_bytes // 2
+    store.put('b', make_table(5))
+    assert keys(store) == {'b'}
+    assert sorted(os.listdir(store.path)) == ['b.json']
@@ -0,0 +1,94 @@
+import os
+import threading
+
+import pytest
+
+from tts_cache import AudioCache, OfflineBackend
+
+
+class SlowBackend(OfflineBackend):
+    """Offline synthesizer, which waits for event before it finishes the text 'slow'"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def synthesize(self, text, path):
+        super().synthesize(text, path)
+        if text == 'slow':
+            self.started.set()
+            self.release.wait(10)
+
+
+def set_last_used(path, seconds):
+    os.utime(path, (seconds, seconds))
+
+
+def files(cache):
+    return set(cache.entries()['file'])
+
+
+@pytest.fixture
+def audio_dir(tmp_path):
+    return str(tmp_path / 'audio')
+
+
+def test_evict_deletes_least_recently_used(audio_dir):
+    cache = AudioCache(audio_dir, backend=OfflineBackend(), keep_seconds=0)
+    paths = [cache.get(text) for text in ['one', 'two', 'six']]
+    for path, seconds in zip(paths, [300, 100, 200]):
+        set_last_used(path, seconds)
+    cache.max_bytes = cache.entries()['bytes'].sum()
+
+    # The file 'two' is the oldest one
+    new_path = cache.get('ten')
+    assert files(cache) == {paths[0], paths[2], new_path}
+
+    # Tiny cache keeps only the file, which was just written
+    cache.max_bytes = 1
+    new_path = cache.get('new')
+    assert files(cache) == {new_path}
+
+
+def test_evict_keeps_recently_returned(audio_dir):
+    cache = AudioCache(audio_dir, backend=OfflineBackend(), max_bytes=1, keep_seconds=600)
+    first = cache.get('first')
+    set_last_used(first, 100)
+    # The file 'first' is the oldest one and the cache is full, but the file was returned recently
+    second = cache.get('second')
+    assert files(cache) == {first, second}
+
+    # The file is written by other process and returned from the cache
+    old = AudioCache(audio_dir, backend=OfflineBackend()).get('old')
+    assert cache.get('old') == old
+    set_last_used(old, 50)
+    cache.get('third')
+    assert old in files(cache)
+
+    # Files, which were returned long ago, are deleted
+    cache.keep_seconds = 0
+    cache.evict()
+    assert files(cache) == set()
+
+
+def test_evict_keeps_pending(audio_dir):
+    backend = SlowBackend()
+    cache = AudioCache(audio_dir, backend=backend, max_bytes=1, keep_seconds=0)
+    future = cache.submit('slow')
+    assert backend.started.wait(10)
+    assert cache.stats()['pending'] == 1
+
+    # Other process has written the same file, while this cache is still synthesizing it
+    other = AudioCache(audio_dir, backend=OfflineBackend(), max_bytes=2**20)
+    path = other.get('slow')
+    assert path == cache.path_for('slow')
+    set_last_used(path, 100)
+
+    cache.get('fast')
+    assert path in files(cache)
+
+    backend.release.set()
+    assert future.result(10) == path
+    assert os.path.exists(path)
+    assert cache.stats()['pending'] == 0
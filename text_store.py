@@ -0,0 +1,285 @@
+import os
+import json
+import hashlib
+import threading
+
+import pandas as pd
+import spacy
+from spacy.tokens import DocBin
+
+
+# Folder with parsed texts. It could be changed with environment variable
+STORE_DIR = os.environ.get('EXERCISEGEN_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'texts'))
+
+# Version of stored data. It must be changed, if open_text(), open_file() or beautify_text() return other sentences
+STORE_VERSION = 2
+
+
+def normalize_text(text):
+    """Normalize text before hashing: the same line endings and no spaces at the end of lines and text.
+    These differences do not change sentences, so texts with them share one entry of the store"""
+
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return '\n'.join(line.rstrip() for line in text.split('\n')).strip()
+
+
+def model_version(nlp):
+    """Return version of spacy model, spacy library and enabled components. 
+    Texts split or parsed by other version or other components are processed again"""
+
+    return '{}_{}-{} spacy-{} {}'.format(nlp.meta.get('lang'), nlp.meta.get('name'), nlp.meta.get('version'),
+                                         spacy.__version__, '+'.join(nlp.pipe_names))
+
+
+def docs_version(nlp):
+    """Return short hash of model version (see model_version()), which is a part of names of stored Docs"""
+
+    return hashlib.sha256(model_version(nlp).encode('utf-8')).hexdigest()[:16]
+
+
+def docs_name(nlp, components):
+    """Return name of Docs in the store entry: hash of model version and names of components, which parsed them.
+    Docs parsed by other model or other components get other name
+
+    Parameters
+    ----------
+    - nlp: spacy model, which parsed Docs
+    - components: names of enabled components in the order of spacy pipeline
+
+    Returns
+    -------
+    str with name, components are joined by '+'
+    """
+
+    # Docs without components are made by tokenizer only
+    return docs_version(nlp) + '.' + ('+'.join(components) if len(components) > 0 else 'tokenizer')
+
+
+def text_key(text, nlp, kind='text'):
+    """Return key of text in the store: sha256 of normalized text, model version and store version
+
+    Parameters
+    ----------
+    - text: original text
+    - nlp: spacy model
+    - kind: how the text was opened: 'text' for open_text(), 'file' for open_file()
+
+    Returns
+    -------
+    str with hex digest
+    """
+
+    key = hashlib.sha256()
+    for part in [str(STORE_VERSION), model_version(nlp), kind, normalize_text(text)]:
+        key.update(part.encode('utf-8'))
+        key.update(b'\0')
+    return key.hexdigest()
+
+
+class TextStore():
+
+    def __init__(self, path=STORE_DIR, max_bytes=512 * 2**20):
+        """Initiation of TextStore() object. Store keeps table with sentences of opened text on disk,
+        so the same text is opened again without spacy model. Sentences are parsed later, only if they get 
+        into a lesson, and their Docs (DocBin) are added to the entry, so they are not parsed again next time.
+        Every entry is file <key>.json with table and files <key>.<docs name>.spacy with Docs parsed 
+        by one set of spacy components (see docs_name()).
+        If size of the store is bigger than max_bytes, least recently used entries are deleted
+
+        Parameters
+        ----------
+        - path: folder with stored texts
+        - max_bytes: maximal size of the store in bytes
+        """
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+
+    def __table_file(self, key):
+        """Return path of table of the entry"""
+
+        return os.path.join(self.path, key + '.json')
+
+
+    def __docs_files(self, key):
+        """Return dictionary {docs name : path} with all Docs of the entry"""
+
+        files = {}
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.startswith(key + '.') and name.endswith('.spacy'):
+                    files[name[len(key) + 1:-len('.spacy')]] = os.path.join(self.path, name)
+        return files
+
+
+    def __contains__(self, key):
+        return os.path.exists(self.__table_file(key))
+
+
+    def get(self, key):
+        """Return stored table. Time of the last use is updated
+
+        Parameters
+        ----------
+        - key: key of the text (see text_key())
+
+        Returns
+        -------
+        pd.DataFrame or None, if the text is not in the store
+        """
+
+        table_file = self.__table_file(key)
+        try:
+            with open(table_file, encoding='utf-8') as f:
+                table = json.load(f)
+            # Time of modification is used as time of the last use
+            os.utime(table_file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return pd.DataFrame(table['data'], columns=table['columns'])
+
+
+    def get_docs(self, key, nlp):
+        """Return all stored Docs of the entry, which were parsed by the model
+
+        Parameters
+        ----------
+        - key: key of the text (see text_key())
+        - nlp: spacy model. Its vocabulary is used to restore Docs
+
+        Returns
+        -------
+        dictionary {tuple with names of components : dictionary {sentence : spacy Doc}}
+        """
+
+        version = docs_version(nlp)
+        docs = {}
+        for name, docs_file in self.__docs_files(key).items():
+            if not name.startswith(version + '.'):
+                continue
+            components = name[len(version) + 1:]
+            try:
+                doc_bin = DocBin().from_disk(docs_file)
+            except (OSError, ValueError):
+                continue
+            components = () if components == 'tokenizer' else tuple(components.split('+'))
+            docs[components] = {doc.text: doc for doc in doc_bin.get_docs(nlp.vocab)}
+        return docs
+
+
+    def put(self, key, df):
+        """Save table into the store and delete least recently used entries, if the store is too big
+
+        Parameters
+        ----------
+        - key: key of the text (see text_key())
+        - df: dataframe with sentences
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+        table_file = self.__table_file(key)
+        table = {'columns': list(df.columns), 'data': df.values.tolist()}
+
+        # File is written under temporary name and renamed, so other processes never read half-written entry
+        with self.__lock:
+            with open(table_file + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(table, f, ensure_ascii=False)
+            os.replace(table_file + '.tmp', table_file)
+
+        self.evict(keep=key)
+
+
+    def put_docs(self, key, nlp, components, docs):
+        """Save Docs of the entry, which were parsed by the model with given components. 
+        Docs parsed before by the same components are replaced, so all of them must be given again
+
+        Parameters
+        ----------
+        - key: key of the text (see text_key())
+        - nlp: spacy model, which parsed Docs
+        - components: names of enabled components in the order of spacy pipeline
+        - docs: iterable with parsed spacy Docs
+        """
+
+        if key not in self:
+            return
+        docs_file = os.path.join(self.path, key + '.' + docs_name(nlp, components) + '.spacy')
+        doc_bin = DocBin(docs=docs)
+
+        with self.__lock:
+            doc_bin.to_disk(docs_file + '.tmp')
+            os.replace(docs_file + '.tmp', docs_file)
+
+        self.evict(keep=key)
+
+
+    def entries(self):
+        """Return table with all entries of the store
+
+        Returns
+        -------
+        pd.DataFrame with columns 'key', 'bytes', 'last_used', sorted from least to most recently used
+        """
+
+        tables = {}
+        docs_bytes = {}
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                file = os.path.join(self.path, name)
+                try:
+                    if name.endswith('.json'):
+                        tables[name[:-len('.json')]] = (os.path.getsize(file), os.path.getmtime(file))
+                    elif name.endswith('.spacy'):
+                        key = name.split('.')[0]
+                        docs_bytes[key] = docs_bytes.get(key, 0) + os.path.getsize(file)
+                except OSError:
+                    continue
+
+        # Entry exists only when its table exists, Docs are added to the size of their entry
+        rows = [{'key': key, 'bytes': size + docs_bytes.get(key, 0), 'last_used': last_used} 
+                for key, (size, last_used) in tables.items()]
+
+        df = pd.DataFrame(rows, columns=['key', 'bytes', 'last_used'])
+        return df.sort_values('last_used').reset_index(drop=True)
+
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until size of the store is not bigger than max_bytes
+
+        Parameters
+        ----------
+        - keep: key of the entry, which must not be deleted
+        """
+
+        with self.__lock:
+            entries = self.entries()
+            size = entries['bytes'].sum()
+            for key, key_bytes in zip(entries['key'], entries['bytes']):
+                if size <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                for file in [self.__table_file(key)] + list(self.__docs_files(key).values()):
+                    try:
+                        os.remove(file)
+                    except OSError:
+                        pass
+                size -= key_bytes
+
+
+    def stats(self):
+        """Return dictionary with number of entries, size of the store, hits and misses"""
+
+        entries = self.entries()
+        return {'entries': len(entries), 'bytes': int(entries['bytes'].sum()), 'hits': self.hits, 'misses': self.misses}
+
+
+# Store of the process. All ExerciseGen() objects use it if other store is not given
+store = TextStore()
@@ -0,0 +1,265 @@
+import os
+import math
+import time
+import wave
+import struct
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import pandas as pd
+
+
+# Folder with audio files. It could be changed with environment variable
+AUDIO_DIR = os.environ.get('EXERCISEGEN_AUDIO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio'))
+
+# Synthesizer: 'gtts' or 'offline'. It could be changed with environment variable
+TTS_BACKEND = os.environ.get('EXERCISEGEN_TTS_BACKEND', 'gtts')
+
+
+class GTTSBackend():
+
+    def __init__(self, lang='en'):
+        """Synthesizer, which uses Google Text-to-Speech (needs internet connection)
+
+        Parameters
+        ----------
+        - lang: language of text
+        """
+
+        self.name = 'gtts-' + lang
+        self.extension = 'mp3'
+        self.lang = lang
+
+
+    def synthesize(self, text, path):
+        """Save audio with text into file"""
+
+        # gTTS is imported only here, so offline synthesizer works without it
+        import gtts
+
+        gtts.gTTS(text, lang=self.lang).save(path)
+
+
+class OfflineBackend():
+
+    def __init__(self, rate=8000, seconds_per_char=0.02):
+        """Offline stand-in synthesizer for tests and benchmarks. It writes WAV file with a tone,
+        which length depends on length of text and frequency depends on text
+
+        Parameters
+        ----------
+        - rate: sample rate
+        - seconds_per_char: duration of audio for one char of text
+        """
+
+        self.name = 'offline'
+        self.extension = 'wav'
+        self.rate = rate
+        self.seconds_per_char = seconds_per_char
+
+
+    def synthesize(self, text, path):
+        """Save audio with text into file"""
+
+        frequency = 200 + int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:4], 16) % 600
+        n_frames = max(1, int(len(text) * self.seconds_per_char * self.rate))
+        frames = b''.join(struct.pack('<h', int(8000 * math.sin(2 * math.pi * frequency * i / self.rate)))
+                          for i in range(n_frames))
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(self.rate)
+            f.writeframes(frames)
+
+
+def get_backend(name=TTS_BACKEND):
+    """Return synthesizer by name: 'gtts' or 'offline'"""
+
+    if name == 'gtts':
+        return GTTSBackend()
+    if name == 'offline':
+        return OfflineBackend()
+    raise ValueError('Unknown TTS backend: ' + str(name))
+
+
+def audio_key(text, backend):
+    """Return key of audio: sha256 of synthesizer name and text"""
+
+    return hashlib.sha256((backend.name + '\0' + text).encode('utf-8')).hexdigest()
+
+
+class AudioCache():
+
+    def __init__(self, path=AUDIO_DIR, backend=None, max_bytes=256 * 2**20, max_workers=4, keep_seconds=600):
+        """Initiation of AudioCache() object. Cache keeps audio files for sentences on disk.
+        File name is a hash of sentence, so the same sentence is synthesized only once for all sessions and users.
+        Synthesis runs in background threads. If size of the cache is bigger than max_bytes,
+        least recently used files are deleted, except files, which are being synthesized or were returned recently
+
+        Parameters
+        ----------
+        - path: folder with audio files
+        - backend: synthesizer with attributes 'name', 'extension' and method synthesize(text, path).
+        Default synthesizer is set by TTS_BACKEND
+        - max_bytes: maximal size of the cache in bytes
+        - max_workers: maximal number of threads, which synthesize audio at the same time
+        - keep_seconds: files, which paths were returned during the last keep_seconds, are not deleted, 
+        because pages could still show them
+        """
+
+        self.path = path
+        self.backend = backend if backend is not None else get_backend()
+        self.max_bytes = max_bytes
+        self.keep_seconds = keep_seconds
+        self.hits = 0
+        self.misses = 0
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tts')
+        # Futures of audio, which is being synthesized. The same sentence is never synthesized twice at the same time
+        self.__pending = {}
+        # Time, when paths of files were returned last time
+        self.__returned = {}
+        self.__lock = threading.Lock()
+
+
+    def path_for(self, text):
+        """Return path of audio file for text"""
+
+        return os.path.join(self.path, audio_key(text, self.backend) + '.' + self.backend.extension)
+
+
+    def submit(self, text):
+        """Start synthesis of text in background, if there is no audio for it in the cache
+
+        Parameters
+        ----------
+        - text: sentence
+
+        Returns
+        -------
+        concurrent.futures.Future with path of audio file
+        """
+
+        path = self.path_for(text)
+        with self.__lock:
+            if path in self.__pending:
+                return self.__pending[path]
+            if os.path.exists(path):
+                self.hits += 1
+                self.__returned[path] = time.monotonic()
+                # Time of modification is used as time of the last use
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                future = Future()
+                future.set_result(path)
+                return future
+            self.misses += 1
+            future = self.__executor.submit(self.__synthesize, text, path)
+            self.__pending[path] = future
+            return future
+
+
+    def __synthesize(self, text, path):
+        """Synthesize audio into temporary file, rename it and delete old files, if the cache is too big"""
+
+        tmp_path = path + '.' + str(threading.get_ident()) + '.tmp'
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            self.backend.synthesize(text, tmp_path)
+            os.replace(tmp_path, path)
+            with self.__lock:
+                self.__returned[path] = time.monotonic()
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            with self.__lock:
+                self.__pending.pop(path, None)
+        self.evict(keep=path)
+        return path
+
+
+    def get(self, text, timeout=None):
+        """Return path of audio file for text. Waits until audio is synthesized"""
+
+        return self.submit(text).result(timeout=timeout)
+
+
+    def prefetch(self, texts):
+        """Start synthesis of all texts in background
+
+        Returns
+        -------
+        list with futures
+        """
+
+        return [self.submit(text) for text in texts]
+
+
+    def entries(self):
+        """Return table with all audio files of the cache
+
+        Returns
+        -------
+        pd.DataFrame with columns 'file', 'bytes', 'last_used', sorted from least to most recently used
+        """
+
+        rows = []
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                if name.endswith('.tmp'):
+                    continue
+                file = os.path.join(self.path, name)
+                try:
+                    rows.append({'file': file, 'bytes': os.path.getsize(file), 'last_used': os.path.getmtime(file)})
+                except OSError:
+                    continue
+
+        df = pd.DataFrame(rows, columns=['file', 'bytes', 'last_used'])
+        return df.sort_values('last_used').reset_index(drop=True)
+
+
+    def evict(self, keep=None):
+        """Delete least recently used files until size of the cache is not bigger than max_bytes.
+        Files, which are being synthesized or were returned during the last keep_seconds, are not deleted
+
+        Parameters
+        ----------
+        - keep: path of the file, which must not be deleted
+        """
+
+        with self.__lock:
+            now = time.monotonic()
+            self.__returned = {file: returned for file, returned in self.__returned.items() 
+                               if now - returned < self.keep_seconds}
+            protected = set(self.__returned) | set(self.__pending) | {keep}
+
+            entries = self.entries()
+            size = entries['bytes'].sum()
+            for file, file_bytes in zip(entries['file'], entries['bytes']):
+                if size <= self.max_bytes:
+                    break
+                if file in protected:
+                    continue
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+                size -= file_bytes
+
+
+    def stats(self):
+        """Return dictionary with number of files, size of the cache, hits, misses and number of pending syntheses"""
+
+        entries = self.entries()
+        with self.__lock:
+            pending = len(self.__pending)
+        return {'files': len(entries), 'bytes': int(entries['bytes'].sum()),
+                'hits': self.hits, 'misses': self.misses, 'pending': pending}
+
+
+# Cache of the process. It is shared by all streamlit sessions
+cache = AudioCache()